@@ -2,23 +2,17 @@ import csv
 import time
 
 import pandas as pd
-from pymongo import MongoClient
+from mongo_essentials import connect_to_mongo
 from tqdm import tqdm  # Für die Fortschrittsanzeige
-from grab_text import create_temp_directory, clean_temp_directory, get_clean_text_by_id
+from grab_text import create_temp_directory, clean_temp_directory
+import corpus_pack
 import numpy as np
 from check_bias import parse_bias_response
 from collections import defaultdict
-import re
 from transformers import AutoTokenizer
-from tokenizers import Tokenizer
-
-
-def connect_to_mongo():
-    client = MongoClient("mongodb://localhost:27017/")  # Default MongoDB port
-    db = client["court_decisions"]  # Database name
-    collection = db["judgments"]  # Collection name
-    # print("MongoDB connected and database/collection created.")
-    return collection
+from token_cache import load_tokenizer, encode_texts, refresh_token_counts, tokenizer_hash
+from mongo_indexes import ensure_indexes
+from bias_parser import parse_response, response_text
 
 
 def analyze_biases_into_csv():
@@ -134,7 +128,7 @@ def estimate_tokens(char_count, model="llama"):
 
 def get_llama_tokens(text):
     # tokenizer from https://huggingface.co/unsloth/llama-3-8b/blob/main/tokenizer.json
-    tokenizer = Tokenizer.from_file("tokenizer.json")
+    tokenizer = load_tokenizer()    # einmal pro Prozess geladen
     return len(tokenizer.encode(text))
 
 def get_multiple_llama_tokens(texts):
@@ -144,40 +138,33 @@ def get_multiple_llama_tokens(texts):
     :param texts: Liste von Texten, die tokenisiert werden sollen
     :return: Liste von Token-Anzahlen (eine Zahl pro Text)
     """
-    tokenizer = Tokenizer.from_file("tokenizer.json")
-
-    return [len(tokenizer.encode(text)) for text in texts]
+    # Gebündelt mit encode_batch, bei vielen Texten auf einen Prozess-Pool verteilt
+    return encode_texts(texts)
 
 
 def analyze_token_ratio():
     """
     Analysiert, wie viele Einträge ein Verhältnis von num_characters/3 zu Llama-Tokens haben,
     das entweder kleiner oder größer ist.
+    Die Tokenzahlen kommen aus dem Token-Cache (token_counts); nur neue oder
+    geänderte Texte werden dafür neu gelesen und gezählt.
     """
     collection = connect_to_mongo()
-    entries = collection.find({"selected_for_smaller_experiment": True})
+    query = {"selected_for_smaller_experiment": True}
 
-    texts = []
-    entry_metadata = []
+    refresh_token_counts(collection, query, get_text=lambda entry: corpus_pack.get_clean_text(entry["_id"]))
 
-    # Sammle die Texte und Metadaten für die Batch-Verarbeitung
-    for entry in entries:
-        try:
-            clean_text = get_clean_text_by_id(entry["_id"])
-            if not clean_text:
-                continue
-
-            texts.append(clean_text)
-            entry_metadata.append({
-                "num_characters": entry["num_characters"]
-            })
-        except KeyError as e:
-            print(f"Fehlendes Feld bei Eintrag {entry['_id']}: {e}")
-        except Exception as e:
-            print(f"Fehler bei Verarbeitung {entry['_id']}: {e}")
+    token_field = f"token_counts.{tokenizer_hash()}.document"
+    entries = collection.find({**query, token_field: {"$exists": True}},
+                              {"num_characters": 1, token_field: 1})
 
-    # Berechne Tokens für alle Texte auf einmal
-    llama_token_counts = get_multiple_llama_tokens(texts)
+    entry_metadata = []
+    llama_token_counts = []
+    for entry in entries:
+        entry_metadata.append({
+            "num_characters": entry["num_characters"]
+        })
+        llama_token_counts.append(entry["token_counts"][tokenizer_hash()]["document"])
 
     # Zähler für größer/kleiner Verhältnisse
     count_greater = 0
@@ -205,14 +192,13 @@ def get_longest_texts(limit=100):
     collection = connect_to_mongo()
 
     # Filtere nach `selected_for_experiment` und sortiere absteigend nach `num_characters`
-    longest_entries = collection.find({"selected_for_experiment": True}).sort("num_characters", -1).limit(limit)
+    longest_entries = collection.find({"selected_for_experiment": True}, {"_id": 1}).sort("num_characters", -1).limit(limit)
 
+    # Texte aus dem Korpus, sonst gesammelt bereinigen (Prozess-Pool)
     texts = []
-    for entry in longest_entries:
-        entry_id = entry["_id"]  # MongoDB `_id` Feld
-        cleaned_text = get_clean_text_by_id(entry_id)  # Text mithilfe der Funktion bereinigen
-        print(f"Ungefähre Textlänge in token: {len(cleaned_text) // 3}")
+    for cleaned_text in corpus_pack.get_clean_texts([entry["_id"] for entry in longest_entries]):
         if cleaned_text:
+            print(f"Ungefähre Textlänge in token: {len(cleaned_text) // 3}")
             texts.append(cleaned_text)  # Füge bereinigten Text der Liste hinzu
 
     return texts
@@ -403,10 +389,6 @@ def check_ollama_errors():
     print(f"Gesamtzahl Ollama-Response-Fehler: {len(error_responses)} in {doc_count} Untersuchungen")
 
 
-import re
-from collections import defaultdict
-
-
 def parse_ollama_responses(run_id=5):
     collection = connect_to_mongo()
     bias_counter = defaultdict(int)
@@ -442,41 +424,24 @@ def parse_ollama_responses(run_id=5):
             if response.get('run_id') != run_id:
                 continue
 
-            content = response['response']
-
-            # <think>-Block entfernen
-            if "</think>" in content:
-                content = content.split('</think>')[-1].strip()
+            # <think>-Block wird vom Parser entfernt
+            parsed = parse_response(response_text(response), "de")
 
             # Fall: Kein Bias
-            if content.strip() == "Kein Bias":
+            if parsed.no_bias:
                 bias_counter["Kein Bias"] += 1
                 bias_counting_array[0] += 1  # Ensure it counts
                 continue
 
-            # Extrahiere alle Bias-Abschnitte
-            bias_sections = re.findall(
-                r'Identifizierter Bias: (.*?)\nTextpassage: (.*?)\nBegründung: (.*?)(?=\n\nIdentifizierter Bias:|\Z)',
-                content,
-                re.DOTALL
-            )
+            if parsed.incomplete:
+                print(f"⚠️ {parsed.incomplete} invalid bias section(s) in {doc['_id']}")  # Debug
 
-            for bias_section in bias_sections:
-                if len(bias_section) != 3:
-                    print(f"⚠️ Invalid bias section: {bias_section}")  # Debug
+            for bias in parsed.biases:
+                # Reihenfolge von valid_biases entspricht der kanonischen ID
+                if bias.bias_type_id is None or bias.bias_type_id >= len(valid_biases):
+                    print(f"⚠️ Unmatched bias type: '{bias.bias_type}'")
                     continue
-
-                bias_type, textpassage, reasoning = bias_section
-                bias_type = bias_type.strip()  # Normalize
-
-                # Debugging: Print found bias types
-                if bias_type not in valid_biases:
-                    print(f"⚠️ Unmatched bias type: '{bias_type}'")
-
-                for i, valid_bias in enumerate(valid_biases):
-                    if bias_type == valid_bias:
-                        bias_counting_array[i] += 1
-                        break  # Stop checking after finding a match
+                bias_counting_array[bias.bias_type_id] += 1
 
     # Ausgabe der gezählten Bias-Vorkommen
     for i in range(len(valid_biases)):
@@ -485,6 +450,7 @@ def parse_ollama_responses(run_id=5):
 
 if __name__ == "__main__":
     collection = connect_to_mongo()
+    ensure_indexes(collection)
 
     #longest_texts = get_longest_texts(limit=1)
     #for text in longest_texts:
@@ -207,183 +207,61 @@ def MATCHING_SET(lang: str):
 SELECTION_FILTER = "selected_for_annotation"
 
 
-from prepare_data import connect_to_mongo
-import re
+# Serving: waitress (mehrere Threads in einem Prozess, damit sich alle den Cache teilen)
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 5000
+SERVER_THREADS = 8
+# Bias-Liste und einzelne Biases werden so lange gecacht; Annotationen leeren den Cache sofort
+ANNOTATION_CACHE_TTL = 60   # Sekunden
+
+
+from mongo_essentials import connect_to_mongo, get_client
+import judgment_repository
+import bias_indexer
+from mongo_indexes import ensure_indexes
+from ttl_cache import TTLCache, cached
+from bias_parser import parse_response, response_text
 import json
 import time
+import hashlib
+import logging
+from urllib.parse import urlencode
 
 from flask import Flask, render_template, jsonify, request, redirect, url_for  # added redirect and url_for
 from flask_pymongo import PyMongo
 app = Flask(__name__)
+annotation_cache = TTLCache(ttl=ANNOTATION_CACHE_TTL)
 
 
 def create_indexes_for_biases(run_ids=[4,5], query_string = SELECTION_FILTER):
-    collection = connect_to_mongo()
-
-    # Filter mit Skip-Logik
-    query = {query_string: True}
-
-    # stores all biases
-    biases = []
-
-
-    # get all documents from collection
-    for judgment in collection.find(query):
-        # get all responses from ollama_responses with run_ids
-        for run_id in run_ids:
-            # get the right response with current run_id
-            for response in judgment['ollama_responses']:
-                if response.get('run_id') != run_id:
-                    continue
-
-                if isinstance(response["response"], dict):
-                    content = response["response"]["original_text"]
-                else:
-                    content = response["response"]
-
-                # Now content can be safely stripped:
-                if content.strip() == "Kein Bias":
-                    continue
-
-                # Before extracting biases:
-                if isinstance(response["response"], str):
-                    collection.update_one(
-                        {"_id": judgment["_id"], "ollama_responses.run_id": run_id},
-                        {
-                            "$set": {
-                                "ollama_responses.$.response": {
-                                    "original_text": response["response"],
-                                    "biases": []
-                                }
-                            }
-                        }
-                    )
-
-                # Extrahiere alle Bias-Abschnitte
-                bias_sections = re.findall(
-                    r'Identifizierter Bias: (.*?)\nTextpassage: (.*?)\nBegründung: (.*?)(?=\n\nIdentifizierter Bias:|\Z)',
-                    content,
-                    re.DOTALL
-                )
-
-                for bias_section in bias_sections:
-                    if len(bias_section) != 3:
-                        print(f"⚠️ Invalid bias section: {bias_section}")  # Debug
-                        continue
-
-                    bias_type, textpassage, reasoning = bias_section
-                    bias_type = bias_type.strip()  # Normalize
-                    textpassage = textpassage.strip()  # Normalize
-                    reasoning = reasoning.strip()  # Normalize
-
-                    # Debugging: Print found bias types
-                    if bias_type not in VALID_BIASES:
-                        continue
-
-                    # Create bias object
-                    bias = {
-                        "id": len(biases) + 1,
-                        "summary": judgment.get("summary"),
-                        "origin_url": "https://entscheidsuche.ch/docs/" + judgment.get("HTML", {}).get("Datei"),
-                        "run_id": run_id,
-                        "bias_type_id": VALID_BIASES.index(bias_type),
-                        "bias_type_name": bias_type,
-                        "textpassage": textpassage,
-                        "reasoning": reasoning,
-                        "annotations": []
-                    }
-                    
-                    rearrange_biases = False
-                    if rearrange_biases:
-                        # Insert the bias into MongoDB response: add field "bias" to the matching ollama_responses element
-                        collection.update_one(
-                            {"_id": judgment["_id"], "ollama_responses.run_id": run_id},
-                            {
-                                "$addToSet": {
-                                    "ollama_responses.$.response.biases": {
-                                        "id": len(biases) + 1,
-                                        "summary": judgment.get("summary"),
-                                        "origin_url": "https://entscheidsuche.ch/docs/" + judgment.get("HTML", {}).get("Datei"),
-                                        "run_id": run_id,
-                                        "bias_type_id": VALID_BIASES.index(bias_type),
-                                        "bias_type_name": bias_type,
-                                        "textpassage": textpassage,
-                                        "reasoning": reasoning,
-                                        "annotations": []
-                                    }
-                                }
-                            }
-                        )
-                    
-                    biases.append(bias)
-
+    """
+    Indexiert die Biases der noch nicht geparsten Antworten (inkrementell,
+    IDs aus dem Zähler in ``counters``) und gibt die neu gespeicherten zurück.
+    """
+    biases = bias_indexer.index_biases(run_ids, {query_string: True}, "de", VALID_BIASES)
+    annotation_cache.invalidate()
     return biases
 
 
-def get_all_biases(run_ids=[9], query_string=SELECTION_FILTER):
-    collection = connect_to_mongo()
-    pipeline = [
-        {"$match": {query_string: True}},
-        {"$unwind": "$ollama_responses"},
-        {"$match": {"ollama_responses.run_id": {"$in": run_ids}}},
-        {"$project": {
-            "biases": {
-                "$filter": {
-                    "input": "$ollama_responses.response.biases",
-                    "as": "bias",
-                    "cond": {"$in": ["$$bias.run_id", run_ids]}
-                }
-            }
-        }},
-        {"$unwind": "$biases"}
-    ]
-
-    results = list(collection.aggregate(pipeline))
-    biases = []
-    for doc in results:
-        bias = doc.get("biases", {})
-        annotators = [ann.get('annotator') for ann in bias.get('annotations', [])]
-        biases.append({
-                        "id": bias.get('id'),
-                        "arr_annotators": annotators,
-                        "run_id": bias.get('run_id')
-                    })
-    
-    return biases
+@cached(annotation_cache, "bias_page")
+def get_bias_page(run_ids=[9], query_string=SELECTION_FILTER, **page_args):
+    # page_args: Filter (unannotated_by, disagreement, bias_type_id, language) und Cursor (after, before, around, limit)
+    return judgment_repository.list_bias_page(run_ids, selection_filter=query_string, **page_args)
 
     
 
+@cached(annotation_cache, "bias")
 def get_bias_by_id(bias_id, run_ids=[9], query_string=SELECTION_FILTER):
-    collection = connect_to_mongo()
-    pipeline = [
-        {"$match": {query_string: True}},
-        {"$unwind": "$ollama_responses"},
-        {"$match": {"ollama_responses.run_id": {"$in": run_ids}}},
-        {"$project": {
-            "_id": 1,
-            "summary": 1,
-            "HTML": 1,
-            "bias": {
-                "$filter": {
-                    "input": "$ollama_responses.response.biases",
-                    "as": "bias_item",
-                    "cond": {"$eq": ["$$bias_item.id", bias_id]}
-                }
-            }
-        }},
-        {"$unwind": "$bias"}
-    ]
-    results = list(collection.aggregate(pipeline))
-    # print(f"run_ids: {run_ids}, {len(results)} results found for bias_id {bias_id}")
+    record = judgment_repository.get_bias(bias_id, run_ids, selection_filter=query_string)
+    # print(f"run_ids: {run_ids}, found: {record is not None} for bias_id {bias_id}")
     
-    if not results:
+    if record is None:
         print(f"Could not find bias with id {bias_id}")
         return None
 
-    doc = results[0]
-    bias = doc["bias"]
-    summary = doc.get("summary")
-    datei = doc.get("HTML", {}).get("Datei") if isinstance(doc.get("HTML"), dict) else None
+    bias = record["bias"]
+    summary = record["summary"]
+    datei = record["html_file"]
     bias_type = bias.get("bias_type_name")
     origin_url = bias.get("origin_url")
 
@@ -420,103 +298,85 @@ def get_total_bias_count(run_ids=[4,5]):
             for response in judgment['ollama_responses']:
                 if response.get('run_id') != run_id:
                     continue
-                if isinstance(response["response"], dict):
-                    content = response["response"]["original_text"]
-                else:
-                    content = response["response"]
-                if content.strip() == "Kein Bias":
-                    continue
                 # Count all recognized bias sections
-                matches = re.findall(
-                    r'Identifizierter Bias: (.*?)\nTextpassage: (.*?)\nBegründung: (.*?)(?=\n\nIdentifizierter Bias:|\Z)',
-                    content, re.DOTALL
-                )
-                for section in matches:
-                    if len(section) == 3 and section[0].strip() in VALID_BIASES:
-                        count += 1
+                parsed = parse_response(response_text(response), "de")
+                count += sum(1 for bias in parsed.biases if bias.bias_type_id is not None)
     return count
 
 
 def update_annotation_in_db(bias_id, annotator, bias_type_id, comment, run_id, query_string=SELECTION_FILTER):
-    collection = connect_to_mongo()
     bias_id = int(bias_id)
     bias_type_id = int(bias_type_id)
-    current_time = time.time()
-
-    # Retrieve all documents once.
-    docs = list(collection.find({
-        query_string: True,
-        "ollama_responses.response.biases.id": bias_id,
-        "ollama_responses.response.biases.run_id" : run_id
-    }))
-
-    # print(f"{docs[0]=}")
-
-
-    updated = False
-    # Iterate through each document using nested loops
-    for doc in docs:
-        if "ollama_responses" not in doc:
-            continue
-        for i, response in enumerate(doc.get("ollama_responses", [])):
-            resp = response.get("response")
-            if not (isinstance(resp, dict) and "biases" in resp):
-                continue
-            for j, bias in enumerate(resp["biases"]):
-                if bias.get("id") == bias_id:
-                    annotations = bias.get("annotations", [])
-                    found = False
-                    for k, ann in enumerate(annotations):
-                        if ann.get("annotator") == annotator:
-                            annotations[k]["bias_type_id"] = bias_type_id
-                            annotations[k]["comment"] = comment
-                            annotations[k]["timestamp"] = current_time
-                            found = True
-                            break
-                    if not found:
-                        new_annotation = {
-                            "annotator": annotator,
-                            "bias_type_id": bias_type_id,
-                            "comment": comment,
-                            "bias_id": bias_id,
-                            "timestamp": current_time
-                        }
-                        annotations.append(new_annotation)
-                    doc["ollama_responses"][i]["response"]["biases"][j]["annotations"] = annotations
-                    updated = True
-                    break
-            if updated:
-                break
-        if updated:
-            collection.replace_one({"_id": doc["_id"]}, doc)
-            break
-    if not updated:
+    annotation = {
+        "annotator": annotator,
+        "bias_type_id": bias_type_id,
+        "comment": comment,
+        "bias_id": bias_id,
+        "timestamp": time.time()
+    }
+    saved = judgment_repository.save_annotation(bias_id, run_id, annotation, selection_filter=query_string)
+    annotation_cache.invalidate()
+    if saved is None:
         print(f"Bias with {bias_id=} {run_id=} {annotator=} not found in any document")
+    return saved
 
         
 
 def reload_indexes_for_biases(query_string=SELECTION_FILTER):
-    collection = connect_to_mongo()
-    new_index = 1
-
-    for judgment in collection.find({query_string: True}):
-        modified = False
-        if "ollama_responses" in judgment and isinstance(judgment["ollama_responses"], list):
-            for response in judgment["ollama_responses"]:
-                if response.get("run_id") in [4, 5]:
-                    inner_response = response.get("response", {})
-                    if "biases" in inner_response and isinstance(inner_response["biases"], list):
-                        for bias in inner_response["biases"]:
-                            bias["id"] = new_index
-                            new_index += 1
-                        modified = True
-        if modified:
-            collection.update_one(
-                {"_id": judgment["_id"]},
-                {"$set": {"ollama_responses": judgment["ollama_responses"]}}
-            )
-    print(f"Reindexed {new_index - 1} bias objects.")
+    # Biases werden nicht mehr neu nummeriert (Annotationen verweisen auf die IDs);
+    # es werden nur noch nicht indexierte Antworten nachgetragen.
+    biases = create_indexes_for_biases([4, 5], query_string)
+    print(f"Indexed {len(biases)} new bias objects.")
+
+
+
+def parse_run_ids(default):
+    # Parse run_ids from query parameters, e.g., ?run_ids=4,5 or ?run_ids=4
+    run_ids_param = request.args.get('run_ids', None)
+    if run_ids_param:
+        run_ids = [int(r.strip()) for r in run_ids_param.split(',') if r.strip().isdigit()]
+        if run_ids:
+            return run_ids
+    return default
+
+
+def parse_list_filters():
+    """Filter der Fallliste aus den Query-Parametern, z. B. ?unannotated_by=Tom%20Herzberg&disagreement=1&bias_type=3&language=English"""
+    filters = {}
+    if request.args.get('unannotated_by'):
+        filters["unannotated_by"] = request.args['unannotated_by']
+    if request.args.get('disagreement') in ('1', 'true'):
+        filters["disagreement"] = True
+    if request.args.get('bias_type', '').isdigit():
+        filters["bias_type_id"] = int(request.args['bias_type'])
+    if request.args.get('language'):
+        filters["language"] = request.args['language']
+    return filters
+
+
+def list_query_string(run_ids):
+    """Query-String, der Runs und Filter beim Blättern erhält."""
+    args = {'run_ids': ",".join(map(str, run_ids))}
+    args.update({key: request.args[key] for key in ('unannotated_by', 'disagreement', 'bias_type', 'language')
+                 if request.args.get(key)})
+    return urlencode(args)
+
+
+def bias_payload(bias_id, run_ids):
+    """Bias wie ihn Template und API anzeigen (inkl. englischem Bias-Namen), oder None."""
+    selected_bias = get_bias_by_id(bias_id=bias_id, run_ids=run_ids)
+    if selected_bias is None:
+        return None
+    return {**selected_bias, "bias_type_name": VALID_BIASES_ENGLISH[ int( selected_bias["bias_type_id"] ) ]}
+
 
+def json_with_etag(payload):
+    """JSON-Antwort mit ETag; bei passendem If-None-Match kommt 304 ohne Body."""
+    body = json.dumps(payload, sort_keys=True, default=str)
+    response = app.response_class(body, mimetype="application/json")
+    response.set_etag(hashlib.sha1(body.encode("utf-8")).hexdigest())
+    response.headers["Cache-Control"] = "no-cache"   # Browser darf cachen, muss aber per ETag nachfragen
+    return response.make_conditional(request)
 
 
 # Serve the annotation.jinja2 file placed in the templates folder.
@@ -528,19 +388,35 @@ def index():
 # New route: Use both paths so /1 and /1/ work
 @app.route('/<int:bias_id>')
 def bias_route(bias_id, run_ids=[9], not_found=False):
-    # Parse run_ids from query parameters, e.g., ?run_ids=4,5 or ?run_ids=4
-    run_ids_param = request.args.get('run_ids', None)
-    if (run_ids_param):
-        run_ids = [int(r.strip()) for r in run_ids_param.split(',') if r.strip().isdigit()]
-    else:
-        run_ids = run_ids
+    run_ids = parse_run_ids(run_ids)
     print(f"{run_ids=}")
-    selected_bias = get_bias_by_id(bias_id=bias_id, run_ids=run_ids)
+    selected_bias = bias_payload(bias_id, run_ids)
     if selected_bias is None and not not_found:
         return bias_route(bias_id=1, run_ids=run_ids, not_found=True)
-    selected_bias["bias_type_name"] = VALID_BIASES_ENGLISH[ int( selected_bias["bias_type_id"] ) ]
-    all_biases = get_all_biases(run_ids=run_ids)
-    return render_template('annotation.jinja2', bias=selected_bias, all_biases=all_biases, num_biases=len(all_biases), guidelines=GUIDELINES_ENGLISH, bias_types=VALID_BIASES_ENGLISH, run_ids=run_ids)
+    page = get_bias_page(run_ids=run_ids, around=f"{selected_bias['id']}-{selected_bias['run_id']}", **parse_list_filters())
+    all_biases = page["items"]
+    return render_template('annotation.jinja2', bias=selected_bias, all_biases=all_biases, num_biases=len(all_biases), page_next=page["next"], page_prev=page["prev"], list_query=list_query_string(run_ids), guidelines=GUIDELINES_ENGLISH, bias_types=VALID_BIASES_ENGLISH, run_ids=run_ids)
+
+
+@app.route('/api/bias/<int:bias_id>')
+def api_bias(bias_id):
+    payload = bias_payload(bias_id, parse_run_ids([9]))
+    if payload is None:
+        return jsonify(error=f"bias {bias_id} not found"), 404
+    return json_with_etag(payload)
+
+
+@app.route('/api/biases')
+def api_biases():
+    # Seitenweise: ?run_ids=9&after=<cursor> bzw. &before=<cursor>, &limit=100, dazu die Filter aus parse_list_filters
+    page_args = {key: request.args[key] for key in ('after', 'before', 'around') if request.args.get(key)}
+    if request.args.get('limit', '').isdigit():
+        page_args["limit"] = int(request.args['limit'])
+    try:
+        page = get_bias_page(run_ids=parse_run_ids([9]), **page_args, **parse_list_filters())
+    except ValueError:
+        return jsonify(error="invalid cursor"), 400
+    return json_with_etag(page)
 
 
 @app.route('/update_annotation', methods=['POST'])
@@ -553,9 +429,9 @@ def update_annotation():
     bias_id = data.get('bias_id')
     run_id = int(data.get('run_id'))
     print(f"Updating annotation for bias {bias_id} by annotator {annotator} to bias type {bias_type_id} with run_id {run_id} with comment {comment}")
-    update_annotation_in_db(bias_id=bias_id, annotator=annotator, bias_type_id=bias_type_id, comment=comment, run_id=run_id)
+    saved = update_annotation_in_db(bias_id=bias_id, annotator=annotator, bias_type_id=bias_type_id, comment=comment, run_id=run_id)
 
-    return jsonify(success=True)
+    return jsonify(success=saved is not None, annotation=saved)
 
 @app.route('/filter_run_ids')
 def filter_run_ids():
@@ -567,9 +443,33 @@ def filter_run_ids():
     # Ensure at least one run_id is selected – fallback to [4]
     if not run_ids:
         run_ids = [9]
-    first_bias_with_run_id = get_all_biases(run_ids=run_ids)[0]
+    first_bias_with_run_id = get_bias_page(run_ids=run_ids, limit=1)["items"][0]
     return redirect(url_for('bias_route', bias_id=first_bias_with_run_id.get('id'), run_ids=",".join(map(str, run_ids))))
 
+@app.route('/health')
+def health():
+    # Wird von watchdog.py abgefragt; 503, wenn MongoDB nicht erreichbar ist
+    try:
+        get_client().admin.command("ping")
+    except Exception as e:
+        return jsonify(status="error", mongo=str(e)), 503
+    return jsonify(status="ok", mongo="ok", cache=annotation_cache.stats())
+
+
+def serve(host=SERVER_HOST, port=SERVER_PORT, threads=SERVER_THREADS):
+    """Startet den Annotationsserver mit waitress; ohne waitress mit dem Flask-Server (threaded)."""
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        logging.warning("waitress nicht installiert (pip install waitress), nutze den Flask-Entwicklungsserver")
+        app.run(host=host, port=port, threaded=True)
+        return
+    logging.info(f"Annotationsserver auf http://{host}:{port} mit {threads} Threads")
+    waitress_serve(app, host=host, port=port, threads=threads)
+
+
 if __name__ == '__main__':
     # update_annotation_in_db(bias_id=1, annotator="Tom Herzberg", run_id=9, bias_type_id=3, comment="")
-    app.run(debug=True)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    ensure_indexes(connect_to_mongo())
+    serve()
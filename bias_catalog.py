@@ -0,0 +1,323 @@
+"""
+bias_catalog.py
+
+Materialisierter Katalog aller Biases in ``court_decisions.bias_catalog``.
+
+Pro Bias eine flache Zeile mit Bias-ID, Run, ``_id`` des Urteils, den
+Positionen im Urteil (``ollama_responses.<response_index>.response.biases.
+<bias_index>``), Bias-Typ, Sprache, Auswahl-Flags, den Annotatoren mit ihrem
+Label und ob sich die Annotatoren uneinig sind. Die Annotationsseite braucht
+damit keine ``$unwind``-Aggregation über alle Urteile mehr, sondern nur
+indexierte Lookups.
+
+Die Fallliste wird seitenweise mit Cursorn über (bias_id, run_id) gelesen
+(``list_page``, ``window``); die Seitengröße ist begrenzt, egal wie viele Runs
+dazukommen.
+
+Der Katalog wird pro Urteil aktualisiert (``sync_judgment``), sobald Biases
+geparst oder neu nummeriert werden; ``record_annotation`` hält Annotatoren
+und Labels beim Speichern einer Annotation aktuell. ``rebuild_catalog``
+baut ihn für eine beliebige Auswahl von Urteilen neu auf.
+
+Wer Auswahl-Flags der Urteile per ``update_many`` ändert, ruft danach
+``refresh_flags(query)`` (gesetzte Flags) bzw. ``refresh_flagged(flag)``
+(entfernte Flags) auf; beide schreiben nur das Feld ``flags`` der Zeilen.
+"""
+
+from __future__ import annotations
+
+import logging
+
+from pymongo import ASCENDING, DeleteMany, IndexModel, ReplaceOne, UpdateMany
+
+from mongo_essentials import connect_to_mongo, get_collection
+
+BIAS_CATALOG_COLLECTION = "bias_catalog"
+CATALOG_BATCH_SIZE = 200            # Urteile pro bulk_write beim Neuaufbau
+FLAG_BATCH_SIZE = 5000              # Urteile pro bulk_write beim Aktualisieren der Flags
+PAGE_SIZE = 100                     # Fälle pro Seite der Fallliste
+MAX_PAGE_SIZE = 500
+
+# Auswahl-Flags der Urteile, die im Katalog mitgeführt werden
+SELECTION_FLAGS = ["selected_for_annotation", "selected_for_smaller_experiment", "selected_for_experiment"]
+
+CATALOG_INDEXES = [
+    IndexModel([("run_id", ASCENDING), ("bias_id", ASCENDING)], name="run_bias", unique=True),
+    IndexModel([("flags", ASCENDING), ("run_id", ASCENDING), ("bias_id", ASCENDING)], name="flags_run_bias"),
+    IndexModel([("judgment_id", ASCENDING)], name="judgment"),
+    IndexModel([("flags", ASCENDING), ("language", ASCENDING), ("run_id", ASCENDING), ("bias_id", ASCENDING)],
+               name="flags_language_run_bias"),
+]
+
+# Nur die Felder, aus denen die Katalogzeilen entstehen (kein Volltext, keine Antworttexte)
+JUDGMENT_PROJECTION = {
+    "language": 1,
+    **{flag: 1 for flag in SELECTION_FLAGS},
+    "ollama_responses.run_id": 1,
+    "ollama_responses.response.biases.id": 1,
+    "ollama_responses.response.biases.run_id": 1,
+    "ollama_responses.response.biases.bias_type_id": 1,
+    "ollama_responses.response.biases.bias_type_name": 1,
+    "ollama_responses.response.biases.annotations.annotator": 1,
+    "ollama_responses.response.biases.annotations.bias_type_id": 1,
+}
+
+# Felder einer Zeile in der Fallliste
+LIST_PROJECTION = {"_id": 0, "bias_id": 1, "run_id": 1, "annotators": 1, "bias_type_id": 1,
+                   "language": 1, "disagreement": 1}
+
+_indexes_ready = False
+
+
+def catalog_collection():
+    """Die Katalog-Collection; legt beim ersten Zugriff ihre Indexe an."""
+    global _indexes_ready
+    catalog = get_collection(BIAS_CATALOG_COLLECTION)
+    if not _indexes_ready:
+        catalog.create_indexes(CATALOG_INDEXES)
+        _indexes_ready = True
+    return catalog
+
+
+def row_key(run_id: int, bias_id: int) -> str:
+    return f"{run_id}:{bias_id}"
+
+
+def catalog_rows(judgment: dict) -> list[dict]:
+    """Katalogzeilen aller Biases eines (projizierten) Urteils."""
+    flags = [flag for flag in SELECTION_FLAGS if judgment.get(flag)]
+    rows = []
+    for i, response in enumerate(judgment.get("ollama_responses") or []):
+        resp = response.get("response")
+        if not isinstance(resp, dict):
+            continue
+        # "biases" kann null sein (Antworten ohne gefundene Biases)
+        for j, bias in enumerate(resp.get("biases") or []):
+            if not isinstance(bias, dict) or "id" not in bias:
+                continue
+            run_id = bias.get("run_id", response.get("run_id"))
+            annotations = [{"annotator": a["annotator"], "bias_type_id": a.get("bias_type_id")}
+                           for a in bias.get("annotations") or [] if a.get("annotator")]
+            rows.append({
+                "_id": row_key(run_id, bias["id"]),
+                "bias_id": bias["id"],
+                "run_id": run_id,
+                "judgment_id": judgment["_id"],
+                "response_index": i,
+                "bias_index": j,
+                "bias_type_id": bias.get("bias_type_id"),
+                "bias_type_name": bias.get("bias_type_name"),
+                "language": judgment.get("language"),
+                "flags": flags,
+                "annotators": [a["annotator"] for a in annotations],
+                "annotations": annotations,
+                "disagreement": len({a["bias_type_id"] for a in annotations}) > 1,
+            })
+    return rows
+
+
+def _replace_ops(judgment: dict) -> list:
+    ops = [DeleteMany({"judgment_id": judgment["_id"]})]
+    ops += [ReplaceOne({"_id": row["_id"]}, row, upsert=True) for row in catalog_rows(judgment)]
+    return ops
+
+
+def sync_judgment(judgment_id, collection=None) -> int:
+    """
+    Aktualisiert die Katalogzeilen eines Urteils (nach dem Parsen oder
+    Umnummerieren seiner Biases). Gibt die Anzahl Zeilen zurück.
+    """
+    collection = collection if collection is not None else connect_to_mongo()
+    judgment = collection.find_one({"_id": judgment_id}, JUDGMENT_PROJECTION)
+    if judgment is None:
+        catalog_collection().delete_many({"judgment_id": judgment_id})
+        return 0
+    ops = _replace_ops(judgment)
+    catalog_collection().bulk_write(ops, ordered=True)
+    return len(ops) - 1
+
+
+def rebuild_catalog(query: dict | None = None, collection=None) -> int:
+    """
+    Baut den Katalog für alle Urteile aus ``query`` neu auf (Standard: alle
+    Urteile mit mindestens einem Bias). Gibt die Anzahl Zeilen zurück.
+    """
+    collection = collection if collection is not None else connect_to_mongo()
+    catalog = catalog_collection()
+    query = query if query is not None else {"ollama_responses.response.biases.0": {"$exists": True}}
+
+    ops, batch_judgments, rows = [], 0, 0
+    for judgment in collection.find(query, JUDGMENT_PROJECTION):
+        judgment_ops = _replace_ops(judgment)
+        ops += judgment_ops
+        rows += len(judgment_ops) - 1
+        batch_judgments += 1
+        if batch_judgments >= CATALOG_BATCH_SIZE:
+            catalog.bulk_write(ops, ordered=True)
+            ops, batch_judgments = [], 0
+    if ops:
+        catalog.bulk_write(ops, ordered=True)
+
+    logging.info(f"Bias-Katalog: {rows} Einträge neu aufgebaut")
+    return rows
+
+
+def refresh_flags(query: dict, collection=None) -> int:
+    """
+    Übernimmt die aktuellen Auswahl-Flags der Urteile aus ``query`` in ihre
+    Katalogzeilen. Gibt die Anzahl geänderter Zeilen zurück.
+    """
+    collection = collection if collection is not None else connect_to_mongo()
+    catalog = catalog_collection()
+    query = {"$and": [query, {"ollama_responses.response.biases.0": {"$exists": True}}]}
+
+    modified = 0
+    groups: dict[tuple, list] = {}      # Flags -> _ids der Urteile
+    pending = 0
+
+    def flush():
+        nonlocal modified, pending
+        if groups:
+            result = catalog.bulk_write([UpdateMany({"judgment_id": {"$in": ids}}, {"$set": {"flags": list(flags)}})
+                                         for flags, ids in groups.items()], ordered=False)
+            modified += result.modified_count
+        groups.clear()
+        pending = 0
+
+    for judgment in collection.find(query, {flag: 1 for flag in SELECTION_FLAGS}):
+        flags = tuple(flag for flag in SELECTION_FLAGS if judgment.get(flag))
+        groups.setdefault(flags, []).append(judgment["_id"])
+        pending += 1
+        if pending >= FLAG_BATCH_SIZE:
+            flush()
+    flush()
+    return modified
+
+
+def refresh_flagged(flag: str, collection=None) -> int:
+    """
+    Wie ``refresh_flags`` für alle Urteile, deren Katalogzeilen ``flag`` noch
+    tragen (nach dem Entfernen des Flags, wenn die Auswahl nicht mehr abfragbar ist).
+    """
+    judgment_ids = catalog_collection().distinct("judgment_id", {"flags": flag})
+    modified = 0
+    for start in range(0, len(judgment_ids), FLAG_BATCH_SIZE):
+        modified += refresh_flags({"_id": {"$in": judgment_ids[start:start + FLAG_BATCH_SIZE]}}, collection)
+    return modified
+
+
+def ensure_runs(run_ids: list[int], collection=None):
+    """Baut den Katalog für Runs auf, für die noch keine (aktuellen) Zeilen existieren."""
+    catalog = catalog_collection()
+    # Zeilen ohne "annotations" stammen aus einer älteren Katalogversion
+    missing = [run_id for run_id in run_ids
+               if catalog.find_one({"run_id": run_id, "annotations": {"$exists": True}}, {"_id": 1}) is None]
+    if missing:
+        rebuild_catalog({"ollama_responses.response.biases.run_id": {"$in": missing}}, collection)
+
+
+# ---------------------------------------------------------------------- #
+# Lookups für die Annotationsseite
+# ---------------------------------------------------------------------- #
+def list_query(run_ids: list[int], selection_filter: str, unannotated_by: str | None = None,
+               disagreement: bool | None = None, bias_type_id: int | None = None,
+               language: str | None = None) -> dict:
+    """Filter der Fallliste (nicht von mir annotiert, Uneinigkeit, Bias-Typ, Sprache)."""
+    query = {"flags": selection_filter, "run_id": {"$in": run_ids}}
+    if language is not None:
+        query["language"] = language
+    if unannotated_by is not None:
+        query["annotators"] = {"$ne": unannotated_by}
+    if disagreement is not None:
+        query["disagreement"] = disagreement
+    if bias_type_id is not None:
+        query["bias_type_id"] = bias_type_id
+    return query
+
+
+def encode_cursor(row: dict) -> str:
+    return f"{row['bias_id']}-{row['run_id']}"
+
+
+def decode_cursor(cursor: str) -> tuple[int, int]:
+    bias_id, run_id = cursor.split("-")
+    return int(bias_id), int(run_id)
+
+
+def _position(cursor: str, op: str) -> dict:
+    """Bedingung "Schlüssel (bias_id, run_id) <op> Cursor" für op in $gt, $gte, $lt."""
+    bias_id, run_id = decode_cursor(cursor)
+    strict = "$gt" if op == "$gte" else op
+    return {"$or": [{"bias_id": {strict: bias_id}}, {"bias_id": bias_id, "run_id": {op: run_id}}]}
+
+
+def _read(query: dict, position: dict | None, direction: int, limit: int) -> list[dict]:
+    if position is not None:
+        query = {"$and": [query, position]}
+    return list(catalog_collection().find(query, LIST_PROJECTION)
+                .sort([("bias_id", direction), ("run_id", direction)]).limit(limit))
+
+
+def list_page(query: dict, after: str | None = None, before: str | None = None,
+              limit: int = PAGE_SIZE) -> tuple[list[dict], str | None, str | None]:
+    """
+    Eine Seite der Fallliste, nach (bias_id, run_id) sortiert.
+
+    Args:
+        after: Cursor; liefert die Zeilen danach (Standard: ab Anfang).
+        before: Cursor; liefert die Zeilen direkt davor.
+
+    Returns:
+        (Zeilen, Cursor für die nächste Seite, Cursor für die vorige Seite);
+        ein Cursor ist None, wenn es in diese Richtung nichts mehr gibt.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if before is not None:
+        rows = _read(query, _position(before, "$lt"), -1, limit + 1)
+        more_before = len(rows) > limit
+        rows = rows[:limit][::-1]
+        return rows, (encode_cursor(rows[-1]) if rows else None), \
+            (encode_cursor(rows[0]) if rows and more_before else None)
+
+    rows = _read(query, _position(after, "$gt") if after else None, 1, limit + 1)
+    more_after = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (encode_cursor(rows[-1]) if more_after else None), \
+        (encode_cursor(rows[0]) if rows and after else None)
+
+
+def window(query: dict, around: str, limit: int = PAGE_SIZE) -> tuple[list[dict], str | None, str | None]:
+    """Seite rund um den Cursor ``around`` (der Fall selbst und die Nachbarn davor und danach)."""
+    limit = max(2, min(limit, MAX_PAGE_SIZE))
+    before_rows, _, prev_cursor = list_page(query, before=around, limit=limit // 2)
+    rows = _read(query, _position(around, "$gte"), 1, limit - len(before_rows) + 1)
+    more_after = len(rows) > limit - len(before_rows)
+    rows = before_rows + rows[:limit - len(before_rows)]
+    return rows, (encode_cursor(rows[-1]) if rows and more_after else None), prev_cursor
+
+
+def find_row(bias_id: int, run_ids: list[int], selection_filter: str) -> dict | None:
+    rows = catalog_collection().find(
+        {"flags": selection_filter, "run_id": {"$in": run_ids}, "bias_id": bias_id}
+    ).sort("run_id", ASCENDING).limit(1)
+    return next(iter(rows), None)
+
+
+def record_annotation(run_id: int, bias_id: int, annotator: str, bias_type_id: int | None):
+    """Trägt nach dem Speichern einer Annotation Annotator und Label nach."""
+    catalog_collection().update_one({"_id": row_key(run_id, bias_id)}, [
+        {"$set": {"annotations": {"$concatArrays": [
+            {"$filter": {"input": {"$ifNull": ["$annotations", []]}, "as": "a",
+                         "cond": {"$ne": ["$$a.annotator", {"$literal": annotator}]}}},
+            [{"annotator": {"$literal": annotator}, "bias_type_id": {"$literal": bias_type_id}}],
+        ]}}},
+        {"$set": {
+            "annotators": "$annotations.annotator",
+            "disagreement": {"$gt": [{"$size": {"$setUnion": ["$annotations.bias_type_id", []]}}, 1]},
+        }},
+    ])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    print(f"{rebuild_catalog()} Biases im Katalog")
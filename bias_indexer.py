@@ -0,0 +1,242 @@
+"""
+bias_indexer.py
+
+Inkrementelles Indexieren der Biases aus den Modellantworten.
+
+Jede Antwort in ``ollama_responses`` bekommt nach dem Parsen die Markierung
+``bias_parser_version``. ``index_biases`` lädt nur Antworten der gewünschten
+Runs, die diese Markierung in der aktuellen Version noch nicht haben; ein
+neuer Run kostet damit nur seine eigenen Antworten, der annotierte Bestand
+wird nicht neu geschrieben.
+
+Bias-IDs kommen aus einem Zählerdokument (``counters``, ``_id: "bias_id"``),
+das per ``$inc`` atomar weitergezählt wird. IDs sind damit dauerhaft und
+kollidieren auch bei parallelen Läufen nicht; bestehende Biases behalten ihre
+ID (und damit ihre Annotationen). Wird die Parser-Version erhöht, werden
+bereits vorhandene Biases (gleicher Typ und gleiche Textpassage) übersprungen
+und nur neu gefundene angehängt.
+
+Geschrieben wird gebündelt per ``bulk_write`` mit ``$addToSet``; danach wird der
+Bias-Katalog der betroffenen Urteile nachgezogen.
+"""
+
+from __future__ import annotations
+
+import logging
+
+from pymongo import ReturnDocument, UpdateOne
+
+import bias_catalog
+from bias_parser import CANONICAL_BIASES, parse_response, response_text
+from mongo_essentials import connect_to_mongo, get_collection
+
+# Erhöhen, wenn sich der Parser so ändert, dass alte Antworten neu geparst werden sollen
+BIAS_PARSER_VERSION = 1
+COUNTERS_COLLECTION = "counters"
+BIAS_ID_COUNTER = "bias_id"
+INDEX_BATCH_SIZE = 200              # Urteile pro bulk_write
+ORIGIN_URL_PREFIX = "https://entscheidsuche.ch/docs/"
+
+
+# ---------------------------------------------------------------------- #
+# Bias-IDs
+# ---------------------------------------------------------------------- #
+def ensure_bias_id_counter(collection=None) -> int:
+    """
+    Legt den Zähler an bzw. hebt ihn auf die größte vorhandene Bias-ID an
+    (``$max``, also idempotent und sicher bei parallelen Aufrufen).
+    Gibt den aktuellen Zählerstand zurück.
+    """
+    counters = get_collection(COUNTERS_COLLECTION)
+    counter = counters.find_one({"_id": BIAS_ID_COUNTER})
+    if counter is not None:
+        return counter["seq"]
+
+    collection = collection if collection is not None else connect_to_mongo()
+    pipeline = [
+        {"$match": {"ollama_responses.response.biases.id": {"$exists": True}}},
+        {"$unwind": "$ollama_responses"},
+        {"$unwind": "$ollama_responses.response.biases"},
+        {"$group": {"_id": None, "max_id": {"$max": "$ollama_responses.response.biases.id"}}},
+    ]
+    result = next(collection.aggregate(pipeline), None)
+    max_id = (result or {}).get("max_id") or 0
+    counter = counters.find_one_and_update(
+        {"_id": BIAS_ID_COUNTER}, {"$max": {"seq": max_id}},
+        upsert=True, return_document=ReturnDocument.AFTER,
+    )
+    logging.info(f"Bias-ID-Zähler steht bei {counter['seq']}")
+    return counter["seq"]
+
+
+def allocate_bias_ids(count: int) -> range:
+    """Reserviert ``count`` fortlaufende Bias-IDs mit einem einzigen ``$inc``."""
+    if count <= 0:
+        return range(0)
+    counter = get_collection(COUNTERS_COLLECTION).find_one_and_update(
+        {"_id": BIAS_ID_COUNTER}, {"$inc": {"seq": count}},
+        upsert=True, return_document=ReturnDocument.AFTER,
+    )
+    return range(counter["seq"] - count + 1, counter["seq"] + 1)
+
+
+# ---------------------------------------------------------------------- #
+# Indexieren
+# ---------------------------------------------------------------------- #
+def _pending_pipeline(query: dict, run_ids: list[int]) -> list[dict]:
+    """Urteile aus ``query`` mit nur den noch nicht (in dieser Version) geparsten Antworten."""
+    pending = {"run_id": {"$in": run_ids}, "bias_parser_version": {"$ne": BIAS_PARSER_VERSION}}
+    return [
+        {"$match": {**query, "ollama_responses": {"$elemMatch": pending}}},
+        {"$project": {
+            "summary": 1,
+            "origin_url": 1,
+            "HTML.Datei": 1,
+            # Position im Array mitnehmen (Update von Antworten ohne ``id``)
+            "ollama_responses": {"$filter": {
+                "input": {"$map": {
+                    "input": {"$range": [0, {"$size": "$ollama_responses"}]},
+                    "as": "i",
+                    "in": {"$mergeObjects": [{"$arrayElemAt": ["$ollama_responses", "$$i"]}, {"_index": "$$i"}]},
+                }},
+                "as": "response",
+                "cond": {"$and": [
+                    {"$in": ["$$response.run_id", run_ids]},
+                    {"$ne": ["$$response.bias_parser_version", BIAS_PARSER_VERSION]},
+                ]},
+            }},
+        }},
+    ]
+
+
+def _origin_url(judgment: dict) -> str | None:
+    if judgment.get("origin_url"):
+        return judgment["origin_url"]
+    datei = (judgment.get("HTML") or {}).get("Datei")
+    return ORIGIN_URL_PREFIX + datei if datei else None
+
+
+def _new_biases(judgment: dict, response: dict, language: str, bias_names: list[str]) -> list[dict]:
+    """Geparste Biases einer Antwort, die dort noch nicht gespeichert sind (noch ohne ID)."""
+    content = response.get("response")
+    existing = (content.get("biases") or []) if isinstance(content, dict) else []
+    seen = {(b.get("bias_type_id"), b.get("textpassage")) for b in existing}
+
+    biases = []
+    parsed = parse_response(response_text(response), language)
+    for parsed_bias in parsed.biases:
+        bias_type_id = parsed_bias.bias_type_id
+        if bias_type_id is None:
+            logging.debug(f"»{parsed_bias.bias_type}« is not a valid bias type ({judgment['_id']})")
+            continue
+        key = (bias_type_id, parsed_bias.text_passage)
+        if key in seen:
+            continue
+        seen.add(key)
+        biases.append({
+            "summary": judgment.get("summary"),
+            "origin_url": _origin_url(judgment),
+            "run_id": response["run_id"],
+            "bias_type_id": bias_type_id,
+            "bias_type_name": bias_names[bias_type_id],
+            "textpassage": parsed_bias.text_passage,
+            "reasoning": parsed_bias.justification,
+            "annotations": [],
+        })
+    return biases
+
+
+def _response_update(judgment_id, response: dict, biases: list[dict]) -> UpdateOne:
+    """
+    Hängt die Biases per ``$addToSet`` an die Antwort und setzt die
+    Parser-Version. Ist ``biases`` null oder fehlt, wird das Array gesetzt;
+    Rohtext-Antworten werden in das Format ``{"original_text", "biases"}``
+    umgewandelt.
+
+    Antworten mit ``id`` werden per ``arrayFilters`` (Run + id) getroffen,
+    solche ohne ``id`` über ihre Position im Array (``_index`` aus
+    ``_pending_pipeline``; Antworten werden nur angehängt), damit nicht alle
+    Antworten desselben Runs die Biases erhalten.
+    """
+    match = {"run_id": response["run_id"], "bias_parser_version": {"$ne": BIAS_PARSER_VERSION}}
+    content = response.get("response")
+    if response.get("id") is not None:
+        match["id"] = response["id"]
+        path = "ollama_responses.$[response]"
+        array_filters = [{"response.run_id": response["run_id"], "response.id": response["id"]}]
+    else:
+        path = f"ollama_responses.{response['_index']}"
+        array_filters = None
+
+    update: dict = {"$set": {f"{path}.bias_parser_version": BIAS_PARSER_VERSION}}
+    if isinstance(content, dict) and isinstance(content.get("biases"), list):
+        match["response.biases"] = {"$type": "array"}
+        if biases:
+            update["$addToSet"] = {f"{path}.response.biases": {"$each": biases}}
+    elif isinstance(content, dict):
+        match["response.biases"] = {"$not": {"$type": "array"}}     # null oder fehlend
+        update["$set"][f"{path}.response.biases"] = biases
+    else:
+        match["response"] = content                                 # nur, solange noch Rohtext
+        update["$set"][f"{path}.response"] = {"original_text": content or "", "biases": biases}
+
+    if array_filters is None:
+        conditions = {f"{path}.{field}": value for field, value in match.items()}
+    else:
+        conditions = {"ollama_responses": {"$elemMatch": match}}
+    return UpdateOne({"_id": judgment_id, **conditions}, update, array_filters=array_filters)
+
+
+def index_biases(run_ids: list[int], query: dict | None = None, language: str = "de",
+                 bias_names: list[str] = CANONICAL_BIASES, collection=None) -> list[dict]:
+    """
+    Parst alle noch nicht indexierten Antworten der ``run_ids`` in den Urteilen
+    aus ``query`` und speichert die gefundenen Biases mit neuen IDs.
+
+    Args:
+        run_ids: Runs, deren Antworten indexiert werden.
+        query: Auswahl der Urteile (z. B. ``{"selected_for_annotation": True}``).
+        language: Sprache der Antworten für die Zuordnung der Bias-Namen.
+        bias_names: Namen, die als ``bias_type_name`` gespeichert werden
+            (Index = kanonische ``bias_type_id``).
+
+    Returns:
+        Die neu gespeicherten Biases.
+    """
+    collection = collection if collection is not None else connect_to_mongo()
+    query = query or {}
+    ensure_bias_id_counter(collection)
+
+    indexed: list[dict] = []
+    judgments = collection.aggregate(_pending_pipeline(query, run_ids))
+    while True:
+        batch = [judgment for _, judgment in zip(range(INDEX_BATCH_SIZE), judgments)]
+        if not batch:
+            break
+
+        pending = [(judgment, response, _new_biases(judgment, response, language, bias_names))
+                   for judgment in batch for response in judgment["ollama_responses"]]
+        ids = iter(allocate_bias_ids(sum(len(biases) for _, _, biases in pending)))
+
+        ops = []
+        for judgment, response, biases in pending:
+            for bias in biases:
+                bias["id"] = next(ids)
+            ops.append(_response_update(judgment["_id"], response, biases))
+            indexed += biases
+        collection.bulk_write(ops, ordered=False)
+
+        # Bias-Katalog der Annotationsseite nachziehen
+        bias_catalog.rebuild_catalog({"_id": {"$in": [judgment["_id"] for judgment in batch]}}, collection)
+
+    logging.info(f"{len(indexed)} neue Biases in Runs {run_ids} indexiert")
+    return indexed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from annotation_handler import LANGUAGE_RUN_ID_MATCHES, SELECTION_FILTER, VALID_BIASES
+
+    for language, language_run_ids in LANGUAGE_RUN_ID_MATCHES.items():
+        index_biases(language_run_ids, {SELECTION_FILTER: True}, language,
+                     VALID_BIASES if language == "de" else CANONICAL_BIASES)
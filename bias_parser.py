@@ -0,0 +1,271 @@
+"""
+bias_parser.py
+
+Gemeinsamer Parser für die Bias-Antworten der Modelle (alle Sprachen).
+
+Die Antwort wird einmal zeilenweise durchlaufen (Zustandsautomat): eine Zeile,
+die mit einem bekannten Label beginnt ("Identifizierter Bias:", "Identified
+Bias:", "Text Passage:", "Begründung:", "根拠：" ...), wechselt das aktuelle
+Feld, alle anderen Zeilen werden an das aktuelle Feld angehängt. Es gibt keine
+DOTALL-Muster mit Lookaheads mehr, die auf langen deepseek-Antworten
+zurücksetzen; die Laufzeit ist linear in der Länge der Antwort.
+
+Vorher werden ``<think>``-Blöcke abgeschnitten; Bias-Typen werden
+NFC-normalisiert und über ``TRANSLATIONS`` auf die kanonische englische
+Bezeichnung abgebildet (``CANONICAL_BIASES``, Reihenfolge = bias_type_id).
+"""
+
+from __future__ import annotations
+
+import re
+import time
+import unicodedata
+from typing import NamedTuple
+
+# ---------------------------------------------------------------------------
+# Kanonische (englische) Bias-Liste – Reihenfolge definiert die ID
+# ---------------------------------------------------------------------------
+CANONICAL_BIASES: list[str] = [
+    "no bias",
+    "gender bias",
+    "religious bias",
+    "racial bias",
+    "sexual orientation bias",
+    "age discrimination",
+    "nationality bias",
+    "disability bias",
+    "appearance bias",
+    "socioeconomic status bias",
+    "invalid response structure",
+]
+
+
+def normalize(text: str) -> str:
+    """Unicode-NFC, trim, lower-case. Verwenden wir überall, damit Vergleiche robust sind."""
+    return unicodedata.normalize("NFC", text).strip().lower()
+
+
+# Übersetzungen in jede Sprache (Unicode-normalisiert & lower-case!)
+TRANSLATIONS: dict[str, dict[str, str]] = {
+    "English": {normalize(b): b for b in CANONICAL_BIASES},
+    "de": {
+        normalize("Kein Bias"): "no bias",
+        normalize("Gender-Bias"): "gender bias",
+        normalize("Religiöser Bias"): "religious bias",
+        normalize("Rassistischer Bias"): "racial bias",
+        normalize("Sexuelle Orientierung Bias"): "sexual orientation bias",
+        normalize("Altersdiskriminierung"): "age discrimination",
+        normalize("Nationalität-Bias"): "nationality bias",
+        normalize("Behinderungen-Bias"): "disability bias",
+        normalize("Erscheinung-Bias"): "appearance bias",
+        normalize("Bias durch sozioökonomischen Status"): "socioeconomic status bias",
+        normalize("Ungültige Antwortstruktur"): "invalid response structure",
+    },
+    "Vietnamese": {
+        normalize("không có thiên kiến"): "no bias",
+        normalize("thiên kiến giới tính"): "gender bias",
+        normalize("thiên kiến tôn giáo"): "religious bias",
+        normalize("thiên kiến chủng tộc"): "racial bias",
+        normalize("thiên kiến xu hướng tình dục"): "sexual orientation bias",
+        normalize("phân biệt tuổi tác"): "age discrimination",
+        normalize("thiên kiến quốc tịch"): "nationality bias",
+        normalize("thiên kiến đối với người khuyết tật"): "disability bias",
+        normalize("thiên kiến ngoại hình"): "appearance bias",
+        normalize("thiên kiến địa vị kinh tế xã hội"): "socioeconomic status bias",
+        normalize("cấu trúc phản hồi không hợp lệ"): "invalid response structure",
+    },
+    "Japanese": {
+        normalize("バイアスなし"): "no bias",
+        normalize("ジェンダーバイアス"): "gender bias",
+        normalize("宗教バイアス"): "religious bias",
+        normalize("人種バイアス"): "racial bias",
+        normalize("性的指向バイアス"): "sexual orientation bias",
+        normalize("年齢差別"): "age discrimination",
+        normalize("国籍バイアス"): "nationality bias",
+        normalize("障害者バイアス"): "disability bias",
+        normalize("外見バイアス"): "appearance bias",
+        normalize("社会経済的地位バイアス"): "socioeconomic status bias",
+        normalize("無効な応答構造"): "invalid response structure",
+    },
+}
+
+# Fallback über alle Sprachen (die Prompts geben englische Labels vor, die
+# Modelle antworten deshalb teils auch mit englischen Bias-Namen)
+_ALL_TRANSLATIONS = {key: value for mapping in TRANSLATIONS.values() for key, value in mapping.items()}
+
+# Antworten "kein Bias" in allen Sprachen
+NO_BIAS_ANSWERS = {normalize(a) for a in ("Kein Bias", "No bias", "Không có thiên kiến", "バイアスなし")}
+
+# Zeichen, die Modelle um Bias-Namen und Antworten setzen
+_QUOTES = " \t\"'“”„‚‘’「」『』[]*"
+_ANSWER_PUNCTUATION = _QUOTES + ".。!！"
+
+# ---------------------------------------------------------------------------
+# Labels der drei Felder (alle Sprachen, normalisiert)
+# ---------------------------------------------------------------------------
+BIAS, PASSAGE, JUSTIFICATION = "bias", "passage", "justification"
+
+FIELD_LABELS: dict[str, list[str]] = {
+    BIAS: ["Identifizierter Bias", "Identified Bias", "検出されたバイアス",
+           "Thiên kiến nhận dạng", "Thiên kiến đã nhận dạng"],
+    PASSAGE: ["Textpassage", "Text Passage", "テキスト", "本文", "抜粋", "Đoạn văn bản", "Trích dẫn"],
+    JUSTIFICATION: ["Begründung", "Justification", "Reasoning", "根拠", "理由", "正当化", "Lý do", "Giải thích"],
+}
+_LABEL_FIELD = {normalize(label): field for field, labels in FIELD_LABELS.items() for label in labels}
+
+# Label am Zeilenanfang, optional mit Aufzählungszeichen und Markdown-Fett:
+#   "- Identifizierter Bias: ...", "**Text Passage:** ...", "根拠：..."
+_LABEL_LINE = re.compile(
+    r"[ \t]*(?:[-*•][ \t]*)?(?:\*\*)?("
+    + "|".join(re.escape(label) for label in sorted(_LABEL_FIELD, key=len, reverse=True))
+    + r")(?:\*\*)?[ \t]*[:：](?:\*\*)?[ \t]*",
+    re.IGNORECASE,
+)
+
+
+class ParsedBias(NamedTuple):
+    bias_type: str              # wie vom Modell geschrieben (ohne Anführungszeichen)
+    text_passage: str
+    justification: str
+    canonical: str | None       # kanonische englische Bezeichnung oder None (unbekannt)
+
+    @property
+    def bias_type_id(self) -> int | None:
+        return CANONICAL_BIASES.index(self.canonical) if self.canonical else None
+
+
+class ParseResult(NamedTuple):
+    no_bias: bool
+    biases: list[ParsedBias]
+    incomplete: int             # Blöcke, denen Textpassage oder Begründung fehlt
+
+
+def strip_think(text: str) -> str:
+    """Schneidet den ``<think>``-Block von Reasoning-Modellen ab."""
+    end = text.rfind("</think>")
+    return text[end + len("</think>"):].lstrip() if end != -1 else text
+
+
+def is_no_bias(text: str) -> bool:
+    return normalize(text).strip(_ANSWER_PUNCTUATION) in NO_BIAS_ANSWERS
+
+
+def to_canonical(language: str | None, bias_str: str) -> str | None:
+    """
+    Übersetzt einen sprach­spezifischen Bias-String zur kanonischen
+    englischen Bezeichnung (oder None, falls unbekannt).
+    """
+    key = normalize(bias_str).strip(_QUOTES)
+    mapping = TRANSLATIONS.get(language, {})
+    return mapping.get(key) or _ALL_TRANSLATIONS.get(key)
+
+
+def iter_sections(text: str):
+    """
+    Liefert (Bias-Typ, Textpassage, Begründung) für jeden Block der Antwort,
+    in einem Durchlauf über die Zeilen. Fehlende Felder sind None.
+    """
+    current: dict[str, list[str]] | None = None
+    field = None
+    for line in text.splitlines():
+        match = _LABEL_LINE.match(line)
+        if match:
+            field = _LABEL_FIELD[normalize(match.group(1))]
+            if field == BIAS:
+                if current is not None:
+                    yield _finish(current)
+                current = {}
+            elif current is None:
+                current = {}        # Block ohne Bias-Zeile, wird als unvollständig gezählt
+            current[field] = [line[match.end():]]
+        elif current is not None and field is not None:
+            current[field].append(line)
+    if current is not None:
+        yield _finish(current)
+
+
+def _finish(block: dict[str, list[str]]) -> tuple[str | None, str | None, str | None]:
+    def value(field):
+        lines = block.get(field)
+        return "\n".join(lines).strip() if lines is not None else None
+    return value(BIAS), value(PASSAGE), value(JUSTIFICATION)
+
+
+def parse_response(text: str, language: str | None = None) -> ParseResult:
+    """
+    Parst eine Modellantwort.
+
+    Args:
+        text: Rohantwort (inkl. eventuellem ``<think>``-Block).
+        language: Sprache der Antwort ("de", "English", "Vietnamese", "Japanese")
+            für die Zuordnung der Bias-Namen.
+    """
+    content = strip_think(text)
+    if is_no_bias(content):
+        return ParseResult(True, [], 0)
+
+    biases, incomplete = [], 0
+    for bias_type, passage, justification in iter_sections(content):
+        if not bias_type or passage is None or justification is None:
+            incomplete += 1
+            continue
+        bias_type = bias_type.strip(_QUOTES)
+        biases.append(ParsedBias(bias_type, passage, justification, to_canonical(language, bias_type)))
+    return ParseResult(False, biases, incomplete)
+
+
+def response_text(response: dict) -> str:
+    """Text einer gespeicherten Antwort (Rohtext oder bereits umgewandeltes Dict)."""
+    content = response.get("response")
+    if isinstance(content, dict):
+        return content.get("original_text", "")
+    return content or ""
+
+
+# ---------------------------------------------------------------------------
+# Benchmark über gespeicherte Antworten
+# ---------------------------------------------------------------------------
+_LEGACY_PATTERN = re.compile(
+    r'(?:Identifizierter Bias|Identified Bias): (.*?)\n(?:Textpassage|Text Passage): (.*?)\n'
+    r'(?:Begründung|Justification): (.*?)(?=\n\n(?:Identifizierter Bias|Identified Bias):|\Z)',
+    re.DOTALL,
+)
+
+
+def benchmark(collection, query: dict | None = None, limit: int = 2000) -> dict:
+    """
+    Misst den Parser auf gespeicherten Antworten im Vergleich zum bisherigen
+    DOTALL-Regex und zählt, wie viele Blöcke beide finden.
+    """
+    query = query if query is not None else {"ollama_responses.0": {"$exists": True}}
+    texts, languages = [], []
+    for doc in collection.find(query, {"language": 1, "ollama_responses.response": 1}).limit(limit):
+        for response in doc.get("ollama_responses", []):
+            texts.append(response_text(response))
+            languages.append(doc.get("language"))
+
+    start = time.perf_counter()
+    parsed = [parse_response(text, language) for text, language in zip(texts, languages)]
+    parser_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    legacy = [_LEGACY_PATTERN.findall(strip_think(text)) for text in texts]
+    legacy_seconds = time.perf_counter() - start
+
+    return {
+        "responses": len(texts),
+        "characters": sum(len(t) for t in texts),
+        "parser_seconds": parser_seconds,
+        "legacy_regex_seconds": legacy_seconds,
+        "parser_biases": sum(len(p.biases) for p in parsed),
+        "parser_unmapped": sum(1 for p in parsed for b in p.biases if b.canonical is None),
+        "parser_incomplete": sum(p.incomplete for p in parsed),
+        "legacy_regex_biases": sum(len(m) for m in legacy),
+    }
+
+
+if __name__ == "__main__":
+    from mongo_essentials import connect_to_mongo
+
+    for key, value in benchmark(connect_to_mongo()).items():
+        print(f"{key}: {value}")
@@ -1,13 +1,17 @@
 import os
 import time
 import logging
-from pymongo import MongoClient
+from mongo_essentials import connect_to_mongo
 from grab_text import get_clean_text_by_id
-from ollama_essentials import query_ollama, is_gpu_memory_overloaded
-import re
+from ollama_essentials import query_ollama, query_ollama_stream, is_gpu_memory_overloaded
+from inference_scheduler import InferenceScheduler, prefetch
+from mongo_write_buffer import BulkWriteBuffer
+from progress import ProgressTracker
+from context_planner import ContextPlanner
+from mongo_indexes import ensure_indexes
+from bias_parser import parse_response
 import uuid
 from random import shuffle
-from datetime import datetime
 
 
 # Toggle for skipping already processed entries
@@ -15,18 +19,12 @@ SKIP_PROCESSED = True
 RUN_ID = 5
 TEST_ONLY = False
 RELOAD_MODEL_IF_MEMORY_FULL = True
+# Antwort als Stream lesen (misst Time-to-first-Token und Tokens/s, erlaubt vorzeitigen Abbruch)
+STREAM_RESPONSES = True
+# Token-Budget für den <think>-Block von Reasoning-Modellen (None = unbegrenzt)
+MAX_REASONING_TOKENS = None
 
 
-def connect_to_mongo():
-    try:
-        client = MongoClient("mongodb://localhost:27017/", serverSelectionTimeoutMS=5000)
-        db = client["court_decisions"]
-        collection = db["judgments"]
-        return collection
-    except Exception as e:
-        logging.error(f"Fehler bei der Verbindung zu MongoDB: {e}")
-        raise
-
 def create_temp_directory_safe():
     """Stellt sicher, dass der temporäre Ordner existiert."""
     temp_dir = os.path.join(os.getcwd(), "temp_files")
@@ -43,8 +41,10 @@ def parse_bias_response(response):
     :param response: Der Text der Modellantwort als String.
     :return: Eine strukturierte Darstellung der Bias-Angaben oder einen Fehlerhinweis.
     """
+    parsed = parse_response(response, "de")
+
     # Wenn die Antwort "Kein Bias" enthält, das als einziges Ergebnis zurückgeben
-    if response.strip() == "Kein Bias":
+    if parsed.no_bias:
         return [{
             "id": str(uuid.uuid4()),
             "bias_type": "Kein Bias",
@@ -52,24 +52,12 @@ def parse_bias_response(response):
             "justification": None
         }]
 
-    # Regex-Muster für die drei Teile der Antwort
-    bias_pattern = r"- Identifizierter Bias: (.*?)\n- Textpassage: \"(.*?)\"\n- Begründung: (.*?)($|\nIdentifizierter Bias:)"
-
-    # Suche nach Bias-Einträgen
-    matches = re.finditer(bias_pattern, response, re.DOTALL)
-    results = []
-
-    for match in matches:
-        bias_type = match.group(1).strip()
-        text_passage = match.group(2).strip()
-        justification = match.group(3).strip()
-
-        results.append({
-            "id": str(uuid.uuid4()),
-            "bias_type": bias_type,
-            "text_passage": text_passage,
-            "justification": justification
-        })
+    results = [{
+        "id": str(uuid.uuid4()),
+        "bias_type": bias.bias_type,
+        "text_passage": bias.text_passage.strip('"„“'),
+        "justification": bias.justification
+    } for bias in parsed.biases]
 
     # Überprüfen, ob Ergebnisse gefunden wurden
     if results:
@@ -93,11 +81,9 @@ def check_for_stop_flag(stop_file_path):
             return False
 
 
-def get_model_response(text, model, gpu_nr=0, num_ctx=8192):
-    """
-    Analysiert den Text und gibt die Antworten mit IDs zurück.
-    """
-    prompt_text = f"""
+def build_bias_prompt(text):
+    """Baut den Prompt für die Biasanalyse eines deutschen Urteilstexts."""
+    return f"""
 Du erhältst einen Urteilstext in deutscher Sprache. Deine Aufgabe ist es, diesen Text auf folgende Bias-Arten zu analysieren und eine präzise Begründung zu geben, warum die Textpassage einen Bias enthält. 
 Verwende dazu die unten stehenden Definitionen und Unterscheidungskriterien:
 
@@ -214,9 +200,20 @@ Begründung: [Begründe, warum diese Passage diesen Bias zeigt]
 Wenn der Urteilstext mehrfach Biases beinhaltet, antwortest du mehrfach in diesem Format.  
         """
 
+
+def get_model_response(text, model, gpu_nr=0, num_ctx=8192):
+    """
+    Analysiert den Text und gibt die Antworten mit IDs zurück.
+    """
+    prompt_text = build_bias_prompt(text)
+
     start_time = time.time()
     try:
-        response = query_ollama(model, prompt_text, gpu_nr=gpu_nr, num_ctx=num_ctx)
+        if STREAM_RESPONSES:
+            response, stream_stats = query_ollama_stream(
+                model, prompt_text, gpu_nr=gpu_nr, num_ctx=num_ctx, max_reasoning_tokens=MAX_REASONING_TOKENS)
+        else:
+            response, stream_stats = query_ollama(model, prompt_text, gpu_nr=gpu_nr, num_ctx=num_ctx), {}
     except Exception as e:
         logging.error(f"Fehler bei der Modellabfrage: {e}")
         return []
@@ -232,6 +229,7 @@ Wenn der Urteilstext mehrfach Biases beinhaltet, antwortest du mehrfach in diese
         "response": response,
         #"parsed_biases": parsed_biases,  # Strukturierte Darstellung
         "time_taken": elapsed_time,
+        **stream_stats,                 # ttft, tokens, tokens_per_second, early_stop
         "timestamp": time.time(),
         "run_id": RUN_ID
     }
@@ -249,69 +247,75 @@ def bias_check_single(model, run_id):
     if SKIP_PROCESSED:
         query["ollama_responses.run_id"] = {"$ne": run_id}
 
-    # Elemente abrufen und nach num_characters sortieren
-    elements = list(collection.find(query))
-    elements.sort(key=lambda x: x["num_characters"])
-
-    # Aufteilen in Teilarrays nach Kontextgrößen
-    context_thresholds = [8192, 16384, 32768, 65536, 131072]
-    context_buckets = {ctx: [] for ctx in context_thresholds}
+    # Elemente ohne Text und frühere Antworten abrufen, serverseitig nach num_characters sortiert
+    planner = ContextPlanner(build_bias_prompt, collection=collection)
+    elements = planner.select_candidates(collection, query)
 
-    for element in elements:
-        num_chars = (element["num_characters"] + 5000) // 3     # +1500, weil Promptgerüst ca. 1500 token
-        for ctx in context_thresholds:
-            if num_chars <= ctx:
-                context_buckets[ctx].append(element)
-                break
+    # Aufteilen in Teilarrays nach Kontextgrößen (echte Tokenzahl von Prompt + Urteilstext)
+    context_buckets = planner.bucketize(elements, get_text=lambda element: get_clean_text_by_id(element["_id"]))
 
     # Ausgabe der Anzahl der Elemente in jedem Kontextbucket
     for ctx, bucket in context_buckets.items():
         print(f"Kontextgröße {ctx}: {len(bucket)} Elemente")
 
-    # Verarbeitung der Buckets
-    for ctx, bucket in context_buckets.items():
-        print(f"Beginne Verarbeitung für Kontextgröße {ctx} mit {len(bucket)} Elementen.")
-        # Elemente durchmischen, damit Zeit besser abgeschätzt werden kann
-        shuffle(bucket)
-        for element in bucket:
-
-            # Lesen der 'stop.md'-Datei und Konvertieren des Inhalts in eine Variable
-            if check_for_stop_flag(stop_file_path="/home/herzberg/project/stop.md"):
-                return
-
-            # Text abrufen
-            text = get_clean_text_by_id(element["_id"])
-
-            processed_count = collection.count_documents(
-                {"ollama_responses.run_id": RUN_ID, "selected_for_smaller_experiment": True})
-
-            # Modellantwort abrufen, prüft alle 10 Abfragen ob Speicherprobleme sind, lädt dann model neu
-            if RELOAD_MODEL_IF_MEMORY_FULL and processed_count % 10 == 0 and is_gpu_memory_overloaded(threshold=.9):
-                _ctx = 131072
-                print("Lade model neu, weil GPU-Speicher voll ist")
-            else:
-                _ctx = ctx
-
-            # get response from model and measure time taken
-            start_time = time.time()
-            response_list = get_model_response(model=model, text=text, num_ctx=_ctx)
-            end_time = time.time()
-
-            if TEST_ONLY:
-                # Nur Ausgabe der Antwort
-                print(f"Response for element: {response_list}")
-            else:
-                # Speichern der gesamten response_list
-                collection.update_one(
-                    {"_id": element["_id"]},
-                    {"$push": {"ollama_responses": {"$each": [response_list]}}}  # Wrap response_list in a list
-                )
-
-            # Ausgabe wie viele Elemente in Datenbank bereits gespeichert wurden
-            print(
-                f"{datetime.now().strftime("%H:%M:%S")} - Verarbeitete Elemente für Run {RUN_ID}: {processed_count} in {round(end_time - start_time, 2)}s")
-
-        print(f"Verarbeitung für Kontextgröße {ctx} abgeschlossen.")
+    # Bereits verarbeitete Elemente einmalig zählen, danach zählt der ProgressTracker lokal weiter
+    processed_count = collection.count_documents(
+        {"ollama_responses.run_id": RUN_ID, "selected_for_smaller_experiment": True})
+    total = sum(len(bucket) for bucket in context_buckets.values())
+
+    # Verarbeitung der Buckets, verteilt auf alle konfigurierten GPUs
+    with BulkWriteBuffer(collection) as buffer, \
+            ProgressTracker(f"Run {RUN_ID}", done=processed_count, total=total) as progress:
+        scheduler = InferenceScheduler()
+        for ctx, bucket in context_buckets.items():
+            print(f"Beginne Verarbeitung für Kontextgröße {ctx} mit {len(bucket)} Elementen.")
+            progress.start_bucket(ctx, len(bucket))
+            # Elemente durchmischen, damit Zeit besser abgeschätzt werden kann
+            shuffle(bucket)
+
+            def jobs():
+                # Texte werden im Hintergrund geladen, während die GPUs noch mit den vorherigen Elementen beschäftigt sind
+                texts = prefetch(bucket, lambda element: get_clean_text_by_id(element["_id"]))
+                for idx, (element, text) in enumerate(texts):
+                    # Modellantwort abrufen, prüft alle 10 Abfragen ob Speicherprobleme sind, lädt dann model neu
+                    if RELOAD_MODEL_IF_MEMORY_FULL and idx % 10 == 0 and is_gpu_memory_overloaded(threshold=.9):
+                        _ctx = 131072
+                        print("Lade model neu, weil GPU-Speicher voll ist")
+                    else:
+                        _ctx = ctx
+
+                    yield element, text, _ctx
+
+            def worker(job, gpu_nr):
+                # get response from model and measure time taken
+                element, text, _ctx = job
+                start_time = time.time()
+                response_list = get_model_response(model=model, text=text, gpu_nr=gpu_nr, num_ctx=_ctx)
+                return response_list, round(time.time() - start_time, 2)
+
+            def on_result(job, result, gpu_nr):
+                element = job[0]
+                response_list, elapsed = result
+
+                if TEST_ONLY:
+                    # Nur Ausgabe der Antwort
+                    print(f"Response for element: {response_list}")
+                else:
+                    # Speichern der gesamten response_list (gebündelt über den Write-Puffer)
+                    buffer.push_unique(element["_id"], "ollama_responses", response_list)
+
+                # Ausgabe wie viele Elemente bereits verarbeitet wurden, mit Durchsatz und Restzeit
+                progress.record(elapsed, gpu_nr)
+                print(progress.status_line(elapsed, gpu_nr))
+
+            # Lesen der 'stop.md'-Datei vor jeder Vergabe eines neuen Elements
+            stopped = scheduler.run(
+                jobs(), worker, on_result,
+                should_stop=lambda: check_for_stop_flag(stop_file_path="/home/herzberg/project/stop.md"))
+            if stopped:
+                return      # der Write-Puffer wird beim Verlassen des with-Blocks geschrieben
+
+            print(f"Verarbeitung für Kontextgröße {ctx} abgeschlossen.")
 
 
 
@@ -325,4 +329,5 @@ if __name__ == "__main__":
         ]
     )
 
+    ensure_indexes(connect_to_mongo())
     bias_check_single(model="deepseek-r1:70b", run_id=RUN_ID)
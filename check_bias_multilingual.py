@@ -1,29 +1,30 @@
 import os
 import time
 import logging
-from pymongo import MongoClient
-from ollama_essentials import query_ollama, is_gpu_memory_overloaded
+from mongo_essentials import connect_to_mongo
+from ollama_essentials import query_ollama, query_ollama_stream, is_gpu_memory_overloaded
+from inference_scheduler import InferenceScheduler, prefetch
+from mongo_write_buffer import BulkWriteBuffer
+from progress import ProgressTracker
+from context_planner import ContextPlanner
+from mongo_indexes import ensure_indexes
+from token_cache import refresh_token_counts
+from prepare_data import backfill_num_characters, get_full_text
+import text_store
 import uuid
 from random import shuffle
-from datetime import datetime
 
 
 # Toggle for skipping already processed entries
 SKIP_PROCESSED = True
 TEST_ONLY = False
 RELOAD_MODEL_IF_MEMORY_FULL = False
+# Antwort als Stream lesen (misst Time-to-first-Token und Tokens/s, erlaubt vorzeitigen Abbruch)
+STREAM_RESPONSES = True
+# Token-Budget für den <think>-Block von Reasoning-Modellen (None = unbegrenzt)
+MAX_REASONING_TOKENS = None
 
 
-def connect_to_mongo():
-    try:
-        client = MongoClient("mongodb://localhost:27017/", serverSelectionTimeoutMS=5000)
-        db = client["court_decisions"]
-        collection = db["judgments"]
-        return collection
-    except Exception as e:
-        logging.error(f"Fehler bei der Verbindung zu MongoDB: {e}")
-        raise
-
 def create_temp_directory_safe():
     """Stellt sicher, dass der temporäre Ordner existiert."""
     temp_dir = os.path.join(os.getcwd(), "temp_files")
@@ -34,11 +35,103 @@ def create_temp_directory_safe():
 
 
 
-def get_model_response_vn(text, model, run_id, gpu_nr=0, num_ctx=8192):
+def _query_model(model, prompt_text, gpu_nr, num_ctx):
     """
-    Analysiert den Text und gibt die Antworten mit IDs zurück.
+    Fragt das Modell ab und liefert (antwort, stream_stats).
+    Ohne Streaming bleibt stream_stats leer.
+    """
+    if STREAM_RESPONSES:
+        return query_ollama_stream(model, prompt_text, gpu_nr=gpu_nr, num_ctx=num_ctx,
+                                   max_reasoning_tokens=MAX_REASONING_TOKENS)
+    return query_ollama(model, prompt_text, gpu_nr=gpu_nr, num_ctx=num_ctx), {}
+
+
+def _bias_check_language(model, run_id, language, get_model_response_fn, build_prompt_fn, chars_per_token):
+    """
+    Gemeinsame Schleife der Biasüberprüfung für die mehrsprachigen Urteile.
+    Die Elemente werden über den InferenceScheduler auf alle GPUs verteilt.
     """
-    prompt_text = f"""
+    # Verbindung zur MongoDB
+    collection = connect_to_mongo()
+
+    # Filter: Elemente der gewünschten Sprache
+    query = {"language": language}
+    if SKIP_PROCESSED:
+        query["ollama_responses.run_id"] = {"$ne": run_id}
+
+    # Größe und Tokenzahlen einmalig nachtragen, dabei wird full_text als Cursor gestreamt
+    backfill_num_characters(collection, {"language": language})
+    refresh_token_counts(collection, query, get_text=text_store.full_text_of,
+                         projection={"full_text": 1}, prompts=[build_prompt_fn])
+
+    # Elemente ohne Text und frühere Antworten abrufen, serverseitig nach num_characters sortiert
+    planner = ContextPlanner(build_prompt_fn, collection=collection, fallback_chars_per_token=chars_per_token)
+    elements = planner.select_candidates(collection, query)
+
+    # Aufteilen in Teilarrays nach Kontextgrößen (echte Tokenzahl von Prompt + Urteilstext)
+    context_buckets = planner.bucketize(elements, get_text=lambda element: get_full_text(collection, element["_id"]))
+
+    # Ausgabe der Anzahl der Elemente in jedem Kontextbucket
+    for ctx, bucket in context_buckets.items():
+        print(f"Kontextgröße {ctx}: {len(bucket)} Elemente")
+
+    # Bereits verarbeitete Elemente einmalig zählen, danach zählt der ProgressTracker lokal weiter
+    processed_count = collection.count_documents({"ollama_responses.run_id": run_id, "language": language})
+    total = sum(len(bucket) for bucket in context_buckets.values())
+
+    # Verarbeitung der Buckets, verteilt auf alle konfigurierten GPUs
+    with BulkWriteBuffer(collection) as buffer, \
+            ProgressTracker(f"Run {run_id}", done=processed_count, total=total) as progress:
+        scheduler = InferenceScheduler()
+        for ctx, bucket in context_buckets.items():
+            print(f"Beginne Verarbeitung für Kontextgröße {ctx} mit {len(bucket)} Elementen.")
+            progress.start_bucket(ctx, len(bucket))
+            # Elemente durchmischen, damit Zeit besser abgeschätzt werden kann
+            shuffle(bucket)
+
+            def jobs():
+                # Texte werden im Hintergrund geladen, während die GPUs noch mit den vorherigen Elementen beschäftigt sind
+                texts = prefetch(bucket, lambda element: get_full_text(collection, element["_id"]))
+                for idx, (element, text) in enumerate(texts):
+                    # Modellantwort abrufen, prüft alle 10 Abfragen ob Speicherprobleme sind, lädt dann model neu
+                    if RELOAD_MODEL_IF_MEMORY_FULL and idx % 10 == 0 and is_gpu_memory_overloaded(threshold=.9):
+                        _ctx = 131072
+                        print("Lade model neu, weil GPU-Speicher voll ist")
+                    else:
+                        _ctx = ctx
+
+                    yield element, text, _ctx
+
+            def worker(job, gpu_nr):
+                # get response from model and measure time taken
+                element, text, _ctx = job
+                start_time = time.time()
+                response_list = get_model_response_fn(model=model, text=text, run_id=run_id, gpu_nr=gpu_nr, num_ctx=_ctx)
+                return response_list, round(time.time() - start_time, 2)
+
+            def on_result(job, result, gpu_nr):
+                element = job[0]
+                response_list, elapsed = result
+
+                if TEST_ONLY:
+                    # Nur Ausgabe der Antwort
+                    print(f"Response for element: {response_list}")
+                else:
+                    # Speichern der gesamten response_list (gebündelt über den Write-Puffer)
+                    buffer.push_unique(element["_id"], "ollama_responses", response_list)
+
+                # Ausgabe wie viele Elemente bereits verarbeitet wurden, mit Durchsatz und Restzeit
+                progress.record(elapsed, gpu_nr)
+                print(progress.status_line(elapsed, gpu_nr))
+
+            scheduler.run(jobs(), worker, on_result)
+
+            print(f"Verarbeitung für Kontextgröße {ctx} abgeschlossen.")
+
+
+def build_prompt_vn(text):
+    """Baut den vietnamesischen Prompt für die Biasanalyse."""
+    return f"""
 Bạn được cung cấp một bản án của tòa án. Nhiệm vụ của bạn là phân tích văn bản này để xác định các loại thiên kiến (bias) sau đây, chỉ tập trung vào thiên kiến của thẩm phán hiện tại (không tính các cá nhân được trích dẫn hoặc các tòa án khác), và đưa ra lý do rõ ràng tại sao một đoạn văn cụ thể thể hiện thiên kiến đó.
 Hãy sử dụng các định nghĩa và tiêu chí dưới đây:
 1. Thiên kiến Giới tính
@@ -135,9 +228,16 @@ Justification: [Giải thích vì sao đoạn văn này thể hiện thiên ki
 Lặp lại mẫu này cho từng thiên kiến được phát hiện.
 """
 
+
+def get_model_response_vn(text, model, run_id, gpu_nr=0, num_ctx=8192):
+    """
+    Analysiert den Text und gibt die Antworten mit IDs zurück.
+    """
+    prompt_text = build_prompt_vn(text)
+
     start_time = time.time()
     try:
-        response = query_ollama(model, prompt_text, gpu_nr=gpu_nr, num_ctx=num_ctx)
+        response, stream_stats = _query_model(model, prompt_text, gpu_nr=gpu_nr, num_ctx=num_ctx)
     except Exception as e:
         logging.error(f"Fehler bei der Modellabfrage: {e}")
         return []
@@ -149,6 +249,7 @@ Lặp lại mẫu này cho từng thiên kiến được phát hiện.
         "model": model,
         "response": response,
         "time_taken": elapsed_time,
+        **stream_stats,                 # ttft, tokens, tokens_per_second, early_stop
         "timestamp": time.time(),
         "run_id": run_id
     }
@@ -158,80 +259,12 @@ def bias_check_single_vn(model, run_id):
     """
     Hauptfunktion für die Biasüberprüfung.
     """
-    # Verbindung zur MongoDB
-    collection = connect_to_mongo()
-
-    # Filter: Elemente mit "selected_for_experiment" = true
-    query = {"language": "Vietnamese"}
-    if SKIP_PROCESSED:
-        query["ollama_responses.run_id"] = {"$ne": run_id}
-
-    # Elemente abrufen und nach num_characters sortieren
-    elements = list(collection.find(query))
-    elements.sort(key=lambda x: len(x["full_text"]))
+    _bias_check_language(model, run_id, language="Vietnamese", get_model_response_fn=get_model_response_vn, build_prompt_fn=build_prompt_vn, chars_per_token=3)
 
-    # Aufteilen in Teilarrays nach Kontextgrößen
-    context_thresholds = [8192, 16384, 32768, 65536, 131072]
-    context_buckets = {ctx: [] for ctx in context_thresholds}
 
-    for element in elements:
-        num_chars = (len(element["full_text"]) + 5000) // 3     # +5000, weil Promptgerüst
-        for ctx in context_thresholds:
-            if num_chars <= ctx:
-                context_buckets[ctx].append(element)
-                break
-
-    # Ausgabe der Anzahl der Elemente in jedem Kontextbucket
-    for ctx, bucket in context_buckets.items():
-        print(f"Kontextgröße {ctx}: {len(bucket)} Elemente")
-
-    # Verarbeitung der Buckets
-    for ctx, bucket in context_buckets.items():
-        print(f"Beginne Verarbeitung für Kontextgröße {ctx} mit {len(bucket)} Elementen.")
-        # Elemente durchmischen, damit Zeit besser abgeschätzt werden kann
-        shuffle(bucket)
-        for element in bucket:
-
-            # Text abrufen
-            text = element["full_text"]
-
-            processed_count = collection.count_documents(
-                {"ollama_responses.run_id": run_id, "language": "Vietnamese"})
-
-            # Modellantwort abrufen, prüft alle 10 Abfragen ob Speicherprobleme sind, lädt dann model neu
-            if RELOAD_MODEL_IF_MEMORY_FULL and processed_count % 10 == 0 and is_gpu_memory_overloaded(threshold=.9):
-                _ctx = 131072
-                print("Lade model neu, weil GPU-Speicher voll ist")
-            else:
-                _ctx = ctx
-
-            # get response from model and measure time taken
-            start_time = time.time()
-            response_list = get_model_response_vn(model=model, text=text, run_id = run_id, num_ctx=_ctx)
-            end_time = time.time()
-
-            if TEST_ONLY:
-                # Nur Ausgabe der Antwort
-                print(f"Response for element: {response_list}")
-            else:
-                # Speichern der gesamten response_list
-                collection.update_one(
-                    {"_id": element["_id"]},
-                    {"$push": {"ollama_responses": {"$each": [response_list]}}}  # Wrap response_list in a list
-                )
-
-            # Ausgabe wie viele Elemente in Datenbank bereits gespeichert wurden
-            print(
-                f"{datetime.now().strftime("%H:%M:%S")} - Verarbeitete Elemente für Run {run_id}: {processed_count} in {round(end_time - start_time, 2)}s")
-
-        print(f"Verarbeitung für Kontextgröße {ctx} abgeschlossen.")
-
-
-def get_model_response_jp(text, model, run_id, gpu_nr=0, num_ctx=8192):
-    """
-    Analysiert den Text und gibt die Antworten mit IDs zurück.
-    """
-    prompt_text = f"""
+def build_prompt_jp(text):
+    """Baut den japanischen Prompt für die Biasanalyse."""
+    return f"""
 あなたには裁判所の判決文が与えられます。あなたの課題は、下記の偏見の種類について、現在の裁判官によるものに限定して、判決文を分析し、偏見を示す該当箇所とその明確な根拠を提示することです。引用された個人や他の裁判所による偏見は含めないでください。
 以下の定義と基準を使用してください：
 1. ジェンダーバイアス
@@ -327,9 +360,16 @@ Justification: [その箇所がバイアスを示す理由の説明]
 バイアスごとにこの形式で繰り返してください。
 """
 
+
+def get_model_response_jp(text, model, run_id, gpu_nr=0, num_ctx=8192):
+    """
+    Analysiert den Text und gibt die Antworten mit IDs zurück.
+    """
+    prompt_text = build_prompt_jp(text)
+
     start_time = time.time()
     try:
-        response = query_ollama(model, prompt_text, gpu_nr=gpu_nr, num_ctx=num_ctx)
+        response, stream_stats = _query_model(model, prompt_text, gpu_nr=gpu_nr, num_ctx=num_ctx)
     except Exception as e:
         logging.error(f"Fehler bei der Modellabfrage: {e}")
         return []
@@ -341,6 +381,7 @@ Justification: [その箇所がバイアスを示す理由の説明]
         "model": model,
         "response": response,
         "time_taken": elapsed_time,
+        **stream_stats,                 # ttft, tokens, tokens_per_second, early_stop
         "timestamp": time.time(),
         "run_id": run_id
     }
@@ -350,80 +391,12 @@ def bias_check_single_jp(model, run_id):
     """
     Hauptfunktion für die Biasüberprüfung.
     """
-    # Verbindung zur MongoDB
-    collection = connect_to_mongo()
-
-    # Filter: Elemente mit "selected_for_experiment" = true
-    query = {"language": "Japanese"}
-    if SKIP_PROCESSED:
-        query["ollama_responses.run_id"] = {"$ne": run_id}
+    _bias_check_language(model, run_id, language="Japanese", get_model_response_fn=get_model_response_jp, build_prompt_fn=build_prompt_jp, chars_per_token=1)
 
-    # Elemente abrufen und nach num_characters sortieren
-    elements = list(collection.find(query))
-    elements.sort(key=lambda x: len(x["full_text"]))
 
-    # Aufteilen in Teilarrays nach Kontextgrößen
-    context_thresholds = [8192, 16384, 32768, 65536, 131072]
-    context_buckets = {ctx: [] for ctx in context_thresholds}
-
-    for element in elements:
-        num_chars = (len(element["full_text"]) + 5000) // 1     # +5000, weil Promptgerüst
-        for ctx in context_thresholds:
-            if num_chars <= ctx:
-                context_buckets[ctx].append(element)
-                break
-
-    # Ausgabe der Anzahl der Elemente in jedem Kontextbucket
-    for ctx, bucket in context_buckets.items():
-        print(f"Kontextgröße {ctx}: {len(bucket)} Elemente")
-
-    # Verarbeitung der Buckets
-    for ctx, bucket in context_buckets.items():
-        print(f"Beginne Verarbeitung für Kontextgröße {ctx} mit {len(bucket)} Elementen.")
-        # Elemente durchmischen, damit Zeit besser abgeschätzt werden kann
-        shuffle(bucket)
-        for element in bucket:
-
-            # Text abrufen
-            text = element["full_text"]
-
-            processed_count = collection.count_documents(
-                {"ollama_responses.run_id": run_id, "language": "Japanese"})
-
-            # Modellantwort abrufen, prüft alle 10 Abfragen ob Speicherprobleme sind, lädt dann model neu
-            if RELOAD_MODEL_IF_MEMORY_FULL and processed_count % 10 == 0 and is_gpu_memory_overloaded(threshold=.9):
-                _ctx = 131072
-                print("Lade model neu, weil GPU-Speicher voll ist")
-            else:
-                _ctx = ctx
-
-            # get response from model and measure time taken
-            start_time = time.time()
-            response_list = get_model_response_jp(model=model, text=text, num_ctx=_ctx, run_id=run_id)
-            end_time = time.time()
-
-            if TEST_ONLY:
-                # Nur Ausgabe der Antwort
-                print(f"Response for element: {response_list}")
-            else:
-                # Speichern der gesamten response_list
-                collection.update_one(
-                    {"_id": element["_id"]},
-                    {"$push": {"ollama_responses": {"$each": [response_list]}}}  # Wrap response_list in a list
-                )
-
-            # Ausgabe wie viele Elemente in Datenbank bereits gespeichert wurden
-            print(
-                f"{datetime.now().strftime("%H:%M:%S")} - Verarbeitete Elemente für Run {run_id}: {processed_count} in {round(end_time - start_time, 2)}s")
-
-        print(f"Verarbeitung für Kontextgröße {ctx} abgeschlossen.")
-
-
-def get_model_response_en(text, model, run_id, gpu_nr=0, num_ctx=8192):
-    """
-    Analysiert den Text und gibt die Antworten mit IDs zurück.
-    """
-    prompt_text = f"""
+def build_prompt_en(text):
+    """Baut den englischen Prompt für die Biasanalyse."""
+    return f"""
 You are given a court decision. Your task is to analyze the text for the following types of bias against or in favor of one of the parties or a class of persons and provide a clear justification for why a given passage demonstrates bias. Make sure to only check for bias by the current judge and not by cited individuals or other courts. 
 
 Use the definitions and criteria listed below:
@@ -568,9 +541,16 @@ Justification: [Explain why this passage reflects the identified bias]
 Repeat this format for each identified bias.
 """
 
+
+def get_model_response_en(text, model, run_id, gpu_nr=0, num_ctx=8192):
+    """
+    Analysiert den Text und gibt die Antworten mit IDs zurück.
+    """
+    prompt_text = build_prompt_en(text)
+
     start_time = time.time()
     try:
-        response = query_ollama(model, prompt_text, gpu_nr=gpu_nr, num_ctx=num_ctx)
+        response, stream_stats = _query_model(model, prompt_text, gpu_nr=gpu_nr, num_ctx=num_ctx)
     except Exception as e:
         logging.error(f"Fehler bei der Modellabfrage: {e}")
         return []
@@ -582,6 +562,7 @@ Repeat this format for each identified bias.
         "model": model,
         "response": response,
         "time_taken": elapsed_time,
+        **stream_stats,                 # ttft, tokens, tokens_per_second, early_stop
         "timestamp": time.time(),
         "run_id": run_id
     }
@@ -591,73 +572,7 @@ def bias_check_single_en(model, run_id):
     """
     Hauptfunktion für die Biasüberprüfung.
     """
-    # Verbindung zur MongoDB
-    collection = connect_to_mongo()
-
-    # Filter: Elemente mit "selected_for_experiment" = true
-    query = {"language": "English"}
-    if SKIP_PROCESSED:
-        query["ollama_responses.run_id"] = {"$ne": run_id}
-
-    # Elemente abrufen und nach num_characters sortieren
-    elements = list(collection.find(query))
-    elements.sort(key=lambda x: len(x["full_text"]))
-
-    # Aufteilen in Teilarrays nach Kontextgrößen
-    context_thresholds = [8192, 16384, 32768, 65536, 131072]
-    context_buckets = {ctx: [] for ctx in context_thresholds}
-
-    for element in elements:
-        num_chars = (len(element["full_text"]) + 5000) // 3     # +5000, weil Promptgerüst
-        for ctx in context_thresholds:
-            if num_chars <= ctx:
-                context_buckets[ctx].append(element)
-                break
-
-    # Ausgabe der Anzahl der Elemente in jedem Kontextbucket
-    for ctx, bucket in context_buckets.items():
-        print(f"Kontextgröße {ctx}: {len(bucket)} Elemente")
-
-    # Verarbeitung der Buckets
-    for ctx, bucket in context_buckets.items():
-        print(f"Beginne Verarbeitung für Kontextgröße {ctx} mit {len(bucket)} Elementen.")
-        # Elemente durchmischen, damit Zeit besser abgeschätzt werden kann
-        shuffle(bucket)
-        for element in bucket:
-
-            # Text abrufen
-            text = element["full_text"]
-
-            processed_count = collection.count_documents(
-                {"ollama_responses.run_id": run_id, "language": "English"})
-
-            # Modellantwort abrufen, prüft alle 10 Abfragen ob Speicherprobleme sind, lädt dann model neu
-            if RELOAD_MODEL_IF_MEMORY_FULL and processed_count % 10 == 0 and is_gpu_memory_overloaded(threshold=.9):
-                _ctx = 131072
-                print("Lade model neu, weil GPU-Speicher voll ist")
-            else:
-                _ctx = ctx
-
-            # get response from model and measure time taken
-            start_time = time.time()
-            response_list = get_model_response_en(model=model, text=text, run_id = run_id, num_ctx=_ctx)
-            end_time = time.time()
-
-            if TEST_ONLY:
-                # Nur Ausgabe der Antwort
-                print(f"Response for element: {response_list}")
-            else:
-                # Speichern der gesamten response_list
-                collection.update_one(
-                    {"_id": element["_id"]},
-                    {"$push": {"ollama_responses": {"$each": [response_list]}}}  # Wrap response_list in a list
-                )
-
-            # Ausgabe wie viele Elemente in Datenbank bereits gespeichert wurden
-            print(
-                f"{datetime.now().strftime("%H:%M:%S")} - Verarbeitete Elemente für Run {run_id}: {processed_count} in {round(end_time - start_time, 2)}s")
-
-        print(f"Verarbeitung für Kontextgröße {ctx} abgeschlossen.")
+    _bias_check_language(model, run_id, language="English", get_model_response_fn=get_model_response_en, build_prompt_fn=build_prompt_en, chars_per_token=3)
 
 
 if __name__ == "__main__":
@@ -670,4 +585,5 @@ if __name__ == "__main__":
         ]
     )
 
+    ensure_indexes(connect_to_mongo())
     bias_check_single_jp(model="deepseek-r1:70b", run_id=11)
@@ -0,0 +1,176 @@
+"""
+context_planner.py
+
+Wählt die Kontextgröße (``num_ctx``) pro Dokument anhand echter Tokenzahlen
+statt über die Faustregel ``(Zeichen + 5000) // 3``.
+
+Gezählt wird mit dem Llama-3-Tokenizer (``tokenizer.json``, derselbe wie in
+``analyze_data.get_llama_tokens``; deepseek-r1:70b ist ein Llama-Distill und
+nutzt dasselbe Vokabular):
+
+- das Promptgerüst einmal pro Planer,
+- der Urteilstext einmal pro Dokument. Das Ergebnis landet im Token-Cache
+  des Urteils (``token_counts``, s. token_cache) und wird in späteren Läufen
+  wiederverwendet; fehlende Zahlen werden gebündelt nachgezählt.
+
+Gewählt wird die kleinste Stufe aus ``CONTEXT_THRESHOLDS``, in die Prompt,
+Text und die Reserve für die Modellantwort passen. Zu kleine Kontexte
+schneiden den Urteilstext bei Ollama stillschweigend ab, zu große belegen
+unnötig KV-Cache.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Callable
+
+from pymongo import UpdateOne
+
+from token_cache import (TOKENIZER_PATH, load_tokenizer, tokenizer_hash, measure_prompt,
+                         cached_entry, text_hash, encode_texts, entry_update)
+
+CONTEXT_THRESHOLDS = [8192, 16384, 32768, 65536, 131072]
+
+# Platz für die Antwort des Modells inkl. <think>-Block
+RESPONSE_RESERVE_TOKENS = 4096
+
+# Nur falls tokenizer.json fehlt: alte Schätzung über Zeichen pro Token
+FALLBACK_CHARS_PER_TOKEN = 3
+
+# Texte ohne Cache-Eintrag, die gleichzeitig geladen und gezählt werden
+TOKEN_COUNT_CHUNK_SIZE = 256
+
+
+class ContextPlanner:
+    """
+    Ordnet Dokumente der kleinsten ausreichenden Kontextgröße zu.
+    """
+
+    def __init__(self,
+                 build_prompt: Callable[[str], str],
+                 collection=None,
+                 tokenizer_path: str = TOKENIZER_PATH,
+                 thresholds: list[int] = CONTEXT_THRESHOLDS,
+                 response_reserve: int = RESPONSE_RESERVE_TOKENS,
+                 fallback_chars_per_token: int = FALLBACK_CHARS_PER_TOKEN):
+        """
+        Args:
+            build_prompt: Baut aus einem Urteilstext den vollständigen Prompt.
+            collection: Mongo-Collection zum Speichern der Tokenzahlen (optional).
+            tokenizer_path: Pfad zur tokenizer.json.
+            thresholds: Verfügbare Kontextgrößen, aufsteigend.
+            response_reserve: Tokens, die für die Antwort frei bleiben müssen.
+            fallback_chars_per_token: Schätzung, falls kein Tokenizer vorhanden ist.
+        """
+        self.collection = collection
+        self.thresholds = sorted(thresholds)
+        self.response_reserve = response_reserve
+        self.fallback_chars_per_token = fallback_chars_per_token
+
+        self.tokenizer_path = tokenizer_path
+        self.tokenizer = load_tokenizer(tokenizer_path)
+        self.tokenizer_id = tokenizer_hash(tokenizer_path) if self.tokenizer is not None else None
+
+        # Promptgerüst einmal ausmessen; manche Prompts enthalten den Text mehrfach
+        self.prompt_hash, self.prompt_tokens, self.text_occurrences = measure_prompt(
+            build_prompt, self.tokenizer, fallback_chars_per_token)
+
+    def projection(self) -> dict:
+        """Felder, die für die Planung nötig sind (ohne Urteilstext und frühere Antworten)."""
+        fields = {"_id": 1, "num_characters": 1}
+        if self.tokenizer_id is not None:
+            fields[f"token_counts.{self.tokenizer_id}.document"] = 1
+        return fields
+
+    def select_candidates(self, collection, query: dict) -> list[dict]:
+        """
+        Lädt die Kandidaten eines Laufs schlank: nur ``_id``, Größe und
+        gespeicherte Tokenzahl, serverseitig nach ``num_characters`` sortiert.
+        Texte werden erst kurz vor der Inferenz geladen (s. inference_scheduler.prefetch).
+        Die passenden Indexe legt mongo_indexes.ensure_indexes an.
+        """
+        return list(collection.find(query, self.projection()).sort("num_characters", 1))
+
+    def count_tokens(self, texts: list[str]) -> list[int]:
+        if self.tokenizer is None:
+            return [len(text) // self.fallback_chars_per_token for text in texts]
+        return encode_texts(texts, self.tokenizer_path)
+
+    def cached_tokens(self, element: dict) -> int | None:
+        """Gespeicherte Tokenzahl des Urteilstexts oder None."""
+        if self.tokenizer_id is None:
+            return None
+        return cached_entry(element, self.tokenizer_id).get("document")
+
+    def document_tokens(self, elements: list[dict], get_text: Callable[[dict], str],
+                        chunk_size: int = TOKEN_COUNT_CHUNK_SIZE) -> list[int | None]:
+        """
+        Tokenzahlen der Urteilstexte; aus dem Cache, sonst gebündelt gezählt und
+        gespeichert. None für Urteile, deren Text nicht lesbar ist.
+        Fehlende Texte werden in Runden von ``chunk_size`` geladen, gezählt und
+        wieder verworfen, damit bei leerem Cache nicht alle Texte gleichzeitig
+        im Speicher liegen.
+        """
+        counts = [self.cached_tokens(element) for element in elements]
+        uncached = sum(count is None for count in counts)
+        if uncached:
+            logging.info(f"Zähle Tokens für {uncached} Urteile ohne Cache-Eintrag")
+
+        missing, texts = [], []
+        for i, element in enumerate(elements):
+            if counts[i] is not None:
+                continue
+            try:
+                texts.append(get_text(element))
+                missing.append(i)
+            except Exception as e:
+                logging.error(f"Tokenzahl für {element['_id']} nicht bestimmbar: {e}")
+            if len(texts) >= chunk_size:
+                self._count_and_store(elements, counts, missing, texts)
+                missing, texts = [], []
+        if texts:
+            self._count_and_store(elements, counts, missing, texts)
+        return counts
+
+    def _count_and_store(self, elements: list[dict], counts: list, missing: list[int], texts: list[str]):
+        for i, num_tokens in zip(missing, self.count_tokens(texts)):
+            counts[i] = num_tokens
+
+        # Schätzungen ohne Tokenizer nicht speichern
+        if self.tokenizer_id is not None and self.collection is not None:
+            prompt_specs = {self.prompt_hash: (self.prompt_tokens, self.text_occurrences)}
+            self.collection.bulk_write([
+                UpdateOne({"_id": elements[i]["_id"]}, {"$set": entry_update(
+                    self.tokenizer_id, counts[i], text_hash(text), prompt_specs)})
+                for i, text in zip(missing, texts)
+            ], ordered=False)
+
+    def required_tokens(self, document_tokens: int) -> int:
+        """Benötigter Kontext für Prompt, Text und Antwort."""
+        return self.prompt_tokens + self.text_occurrences * document_tokens + self.response_reserve
+
+    def context_for(self, document_tokens: int) -> int | None:
+        """Kleinste ausreichende Kontextgröße oder None, wenn keine reicht."""
+        needed = self.required_tokens(document_tokens)
+        for ctx in self.thresholds:
+            if needed <= ctx:
+                return ctx
+        return None
+
+    def bucketize(self, elements: list[dict], get_text: Callable[[dict], str]) -> dict[int, list]:
+        """
+        Teilt Dokumente nach benötigter Kontextgröße auf. Dokumente, die in
+        keinen Kontext passen, werden protokolliert und ausgelassen.
+        """
+        buckets = {ctx: [] for ctx in self.thresholds}
+        for element, num_tokens in zip(elements, self.document_tokens(elements, get_text)):
+            if num_tokens is None:
+                continue
+
+            ctx = self.context_for(num_tokens)
+            if ctx is None:
+                logging.warning(f"{element['_id']}: {self.required_tokens(num_tokens)} Tokens "
+                                f"passen in keinen Kontext, wird übersprungen")
+                continue
+            buckets[ctx].append(element)
+        return buckets
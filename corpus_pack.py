@@ -0,0 +1,261 @@
+"""
+corpus_pack.py
+
+Alle bereinigten Urteilstexte in einer Datei.
+
+``CORPUS_PACK_FILE`` enthält die Texte UTF-8-kodiert hintereinander (nur
+angehängt, nie überschrieben), ``<Datei>.idx`` ordnet jeder ``_id`` (als
+String) Offset und Länge sowie mtime und Größe der Textdatei zu, dazu
+``abbreviation`` -> ``_id``. Der Leser
+bildet die Datei per ``mmap`` ab: ``view`` liefert einen ``memoryview`` ohne
+Kopie, ``text`` dekodiert erst beim Zugriff. Für Durchläufe über den ganzen
+Korpus entfallen so das Öffnen und Schließen tausender kleiner Dateien in
+``TEXT_FILES_DIR``; ``iter_texts`` liest in Dateireihenfolge.
+
+``build_pack`` packt Texte neu, deren Textdatei sich seit dem Packen
+geändert hat (etwa nach einem erneuten Crawl); ändert sich ``clean_text``
+(``text_cleaning.CLEAN_TEXT_VERSION``), wird der ganze Index verworfen. Wird
+ein Text neu gepackt, zeigt der Index auf die neue Stelle; der alte Bereich
+bleibt als Lücke, bis ``compact`` die Datei neu schreibt.
+
+    python corpus_pack.py [--rebuild]       # Textdateien packen
+    python corpus_pack.py --compact
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import mmap
+import os
+import sys
+
+from mongo_essentials import connect_to_mongo
+from text_cleaning import CLEAN_TEXT_VERSION, clean_texts
+
+CORPUS_PACK_FILE = "~/project/corpus.pack"
+PACK_BATCH_SIZE = 200               # Texte pro Bereinigungs-Batch
+
+
+def _index_path(path: str) -> str:
+    return path + ".idx"
+
+
+def _load_index(path: str) -> dict:
+    try:
+        with open(_index_path(path), encoding="utf-8") as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return {"version": CLEAN_TEXT_VERSION, "entries": {}, "abbreviations": {}}
+    if index.get("version") != CLEAN_TEXT_VERSION:
+        logging.warning(f"Korpus-Index {_index_path(path)} hat eine alte Version, wird neu aufgebaut")
+        return {"version": CLEAN_TEXT_VERSION, "entries": {}, "abbreviations": {}}
+    return index
+
+
+class CorpusPackWriter:
+    """Hängt Texte an die Korpus-Datei an; der Index wird bei ``close`` geschrieben."""
+
+    def __init__(self, path: str = CORPUS_PACK_FILE, rebuild: bool = False):
+        self.path = os.path.expanduser(path)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if rebuild:
+            for stale in (self.path, _index_path(self.path)):
+                if os.path.exists(stale):
+                    os.remove(stale)
+        self.index = _load_index(self.path)
+        if not self.index["entries"] and os.path.exists(self.path):
+            os.remove(self.path)            # Daten ohne gültigen Index
+        self._file = open(self.path, "ab")
+
+    def __contains__(self, judgment_id) -> bool:
+        return str(judgment_id) in self.index["entries"]
+
+    def source(self, judgment_id) -> list[int] | None:
+        """[mtime_ns, Größe] der Textdatei beim Packen, oder None."""
+        entry = self.index["entries"].get(str(judgment_id))
+        return (entry[2:] or None) if entry is not None else None
+
+    def add(self, judgment_id, text: str, abbreviation: str | None = None, source: list[int] | None = None):
+        self.add_bytes(judgment_id, text.encode("utf-8"), abbreviation, source)
+
+    def add_bytes(self, judgment_id, data, abbreviation: str | None = None, source: list[int] | None = None):
+        offset = self._file.tell()
+        self._file.write(data)
+        self.index["entries"][str(judgment_id)] = [offset, len(data), *(source or [])]
+        if abbreviation:
+            self.index["abbreviations"][abbreviation] = str(judgment_id)
+
+    def close(self):
+        self._file.close()
+        tmp = _index_path(self.path) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, _index_path(self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CorpusPack:
+    """Lesezugriff auf die Korpus-Datei per ``mmap``."""
+
+    def __init__(self, path: str = CORPUS_PACK_FILE):
+        self.path = os.path.expanduser(path)
+        index = _load_index(self.path)
+        self.entries: dict[str, list[int]] = index["entries"]
+        self.abbreviations: dict[str, str] = index["abbreviations"]
+        self._file = open(self.path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._view = memoryview(self._map) if self._map is not None else memoryview(b"")
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, judgment_id) -> bool:
+        return str(judgment_id) in self.entries
+
+    def view(self, judgment_id) -> memoryview | None:
+        """UTF-8-Bytes des Textes ohne Kopie, oder None."""
+        entry = self.entries.get(str(judgment_id))
+        if entry is None:
+            return None
+        offset, length = entry[:2]
+        return self._view[offset:offset + length]
+
+    def text(self, judgment_id) -> str | None:
+        view = self.view(judgment_id)
+        return str(view, "utf-8") if view is not None else None
+
+    def text_by_abbreviation(self, abbreviation: str) -> str | None:
+        judgment_id = self.abbreviations.get(abbreviation)
+        return self.text(judgment_id) if judgment_id is not None else None
+
+    def iter_texts(self):
+        """(``_id`` als String, Text) für alle Texte, in Reihenfolge der Datei."""
+        for key, (offset, length, *_) in sorted(self.entries.items(), key=lambda item: item[1][0]):
+            yield key, str(self._view[offset:offset + length], "utf-8")
+
+    def close(self):
+        self._view.release()
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_pack: CorpusPack | None = None
+
+
+def open_corpus_pack(path: str = CORPUS_PACK_FILE) -> CorpusPack | None:
+    """Prozessweiter Leser, oder None, wenn noch kein Korpus gepackt wurde."""
+    global _pack
+    if _pack is None and os.path.exists(_index_path(os.path.expanduser(path))):
+        _pack = CorpusPack(path)
+    return _pack
+
+
+def get_clean_text(judgment_id) -> str | None:
+    """Bereinigter Text aus dem Korpus, sonst über ``grab_text.get_clean_text_by_id``."""
+    pack = open_corpus_pack()
+    text = pack.text(judgment_id) if pack is not None else None
+    if text is None:
+        from grab_text import get_clean_text_by_id
+        text = get_clean_text_by_id(judgment_id)
+    return text
+
+
+def get_clean_texts(judgment_ids) -> list[str | None]:
+    """Wie ``get_clean_text`` für viele IDs; was nicht im Korpus ist, über ``get_clean_texts_by_ids``."""
+    judgment_ids = list(judgment_ids)
+    pack = open_corpus_pack()
+    texts = [pack.text(judgment_id) for judgment_id in judgment_ids] if pack is not None else [None] * len(judgment_ids)
+    missing = [i for i, text in enumerate(texts) if text is None]
+    if missing:
+        from grab_text import get_clean_texts_by_ids
+        for i, text in zip(missing, get_clean_texts_by_ids([judgment_ids[i] for i in missing])):
+            texts[i] = text
+    return texts
+
+
+# ---------------------------------------------------------------------- #
+# Packen
+# ---------------------------------------------------------------------- #
+def build_pack(query: dict | None = None, path: str = CORPUS_PACK_FILE, rebuild: bool = False,
+               batch_size: int = PACK_BATCH_SIZE) -> int:
+    """
+    Bereinigt die Textdateien aller Urteile aus ``query`` gesammelt im
+    Prozess-Pool und hängt sie an den Korpus an. Schon gepackte Urteile werden
+    übersprungen, solange sich mtime und Größe ihrer Textdatei nicht geändert
+    haben (außer mit ``rebuild``).
+
+    Returns:
+        Anzahl neu gepackter Texte.
+    """
+    from grab_text import text_file_path
+
+    collection = connect_to_mongo()
+    query = {**(query or {}), "abbreviation": {"$exists": True}}
+    packed = 0
+    batch: list[tuple] = []     # (_id, abbreviation, Rohtext, [mtime_ns, Größe])
+
+    with CorpusPackWriter(path, rebuild) as writer:
+        def flush():
+            nonlocal packed
+            for (judgment_id, abbreviation, _, source), text in zip(
+                    batch, clean_texts([raw for _, _, raw, _ in batch])):
+                writer.add(judgment_id, text, abbreviation, source)
+            packed += len(batch)
+            batch.clear()
+            logging.info(f"Korpus: {packed} Texte gepackt")
+
+        for doc in collection.find(query, {"abbreviation": 1}):
+            path = text_file_path(doc["abbreviation"])
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            source = [stat.st_mtime_ns, stat.st_size]
+            if writer.source(doc["_id"]) == source:
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    batch.append((doc["_id"], doc["abbreviation"], f.read(), source))
+            except FileNotFoundError:
+                continue
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    return packed
+
+
+def compact(path: str = CORPUS_PACK_FILE):
+    """Schreibt die Korpus-Datei ohne überholte Bereiche neu."""
+    path = os.path.expanduser(path)
+    tmp = path + ".compact"
+    with CorpusPack(path) as pack, CorpusPackWriter(tmp, rebuild=True) as writer:
+        abbreviations = {judgment_id: abbreviation for abbreviation, judgment_id in pack.abbreviations.items()}
+        for key, entry in sorted(pack.entries.items(), key=lambda item: item[1][0]):
+            writer.add_bytes(key, pack.view(key), abbreviations.get(key), entry[2:])
+    os.replace(tmp, path)
+    os.replace(_index_path(tmp), _index_path(path))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    if "--compact" in sys.argv:
+        compact()
+    else:
+        print(f"{build_pack(rebuild='--rebuild' in sys.argv)} Texte gepackt")
+    with CorpusPack() as pack:
+        print(f"{len(pack)} Texte, {os.path.getsize(pack.path) / 1e6:.1f} MB")
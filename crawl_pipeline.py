@@ -0,0 +1,561 @@
+"""
+crawl_pipeline.py
+
+Paralleler Download und Textextraktion der Urteile von entscheidsuche.ch.
+
+Drei Stufen, verbunden über begrenzte Queues (Backpressure):
+
+1. Download (asyncio + ``httpx.AsyncClient``): ``CRAWL_CONCURRENCY`` Anfragen
+   gleichzeitig über gepoolte Keep-Alive-Verbindungen, höchstens
+   ``CRAWL_RATE_PER_HOST`` Anfragen pro Sekunde und Host. Anfragen sind
+   bedingt (``If-None-Match``/``If-Modified-Since`` aus dem letzten Lauf);
+   unveränderte Dateien (304) werden nicht neu extrahiert. 429/5xx und
+   Verbindungsfehler werden mit exponentiellem Backoff wiederholt.
+2. Extraktion in einem Prozess-Pool (BeautifulSoup/PyMuPDF sind CPU-lastig
+   und halten den GIL). Der Rohtext wird als ``<abbreviation>.txt`` in
+   ``TEXT_FILES_DIR`` geschrieben; Rohdatei und bereinigter Text gehen
+   außerdem in den ``document_cache`` (``DocumentCache.put``). Der Crawl lädt
+   selbst statt über ``DocumentCache.get_raw``, weil er bedingte Anfragen,
+   Retries und Rate-Limits braucht; gefüllt wird aber derselbe Cache, den
+   ``get_clean_text``-Leser und der ``html_extraction``-Benchmark nutzen.
+3. Gebündelte Mongo-Updates (``bulk_write``) mit ``num_characters`` und den
+   Crawl-Metadaten (``crawl.etag``, ``crawl.last_modified``, ``crawl.status``).
+   Die bereinigten Texte gehen im selben Schritt über ``text_store.put_texts``
+   in den Textspeicher, aus dem ``get_clean_text_by_id`` zuerst liest; ein
+   erneuter Crawl ersetzt dort also auch die gespeicherte Fassung.
+
+Fortsetzbar: die Urteile werden nach ``_id`` sortiert verarbeitet; nach jedem
+Bulk-Write wird die höchste ``_id`` gespeichert, bis zu der alles geschrieben
+ist (``CRAWL_CHECKPOINT_FILE``). Ein neuer Lauf setzt dort fort und nimmt
+zusätzlich alle Urteile mit, deren letzter Versuch fehlgeschlagen ist
+(``crawl.status`` in ``CRAWL_RETRY_STATUS``: Verbindungsfehler, 429/5xx nach
+dem letzten Retry, Extraktionsfehler).
+
+    python crawl_pipeline.py               # Crawl (fortsetzen)
+    python crawl_pipeline.py --restart     # Checkpoint verwerfen, alles prüfen
+    python crawl_pipeline.py --self-check  # gegen lokalen HTTP-Server mit Fixtures
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable
+from urllib.parse import urlsplit
+
+import httpx
+from bson import json_util
+from pymongo import UpdateOne
+
+from grab_text import DOCS_BASE_URL, TEXT_FILES_DIR, clean_text, document_source, html_to_text, pdf_to_text
+import text_store
+from document_cache import DocumentCache, get_document_cache
+from mongo_essentials import connect_to_mongo
+
+CRAWL_CONCURRENCY = 16              # gleichzeitige Downloads
+CRAWL_RATE_PER_HOST = 8.0           # Anfragen pro Sekunde und Host
+CRAWL_MAX_RETRIES = 5
+CRAWL_RETRY_BACKOFF = 2.0           # Sekunden, verdoppelt sich pro Versuch
+CRAWL_TIMEOUT = httpx.Timeout(60, connect=10)
+EXTRACT_WORKERS = os.cpu_count() or 4
+WRITE_BATCH_SIZE = 100              # Mongo-Updates pro bulk_write
+WRITE_MAX_DELAY = 5                 # Sekunden bis ein unvollständiger Batch geschrieben wird
+SOURCE_BATCH_SIZE = 500             # Urteile pro Lesezugriff auf Mongo
+QUEUE_SIZE = 4 * CRAWL_CONCURRENCY
+CRAWL_CHECKPOINT_FILE = "crawl_checkpoint.json"
+
+CRAWL_PROJECTION = {"abbreviation": 1, "HTML.Datei": 1, "HTML.Checksum": 1, "PDF.Datei": 1, "PDF.Checksum": 1,
+                    "crawl": 1}
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Ergebnisse, die ein späterer Lauf trotz Checkpoint erneut versucht
+CRAWL_RETRY_STATUS = ["error", "extraction_error", *sorted(RETRY_STATUS)]
+
+_DONE = object()
+
+
+# ---------------------------------------------------------------------- #
+# Checkpoint
+# ---------------------------------------------------------------------- #
+class CrawlCheckpoint:
+    """
+    Höchste ``_id``, bis zu der alle Urteile geschrieben sind. Da Downloads
+    unterschiedlich lange dauern, wird die Marke erst weitergeschoben, wenn
+    alle kleineren ``_id`` fertig sind.
+    """
+
+    def __init__(self, path: str | None = CRAWL_CHECKPOINT_FILE):
+        self.path = path
+        self.last_id = None
+        self._pending: dict = {}        # _id -> fertig? (Einfügereihenfolge = _id-Reihenfolge)
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.last_id = json_util.loads(f.read()).get("last_id")
+
+    def started(self, judgment_id):
+        self._pending[judgment_id] = False
+
+    def finished(self, judgment_ids):
+        for judgment_id in judgment_ids:
+            self._pending[judgment_id] = True
+        while self._pending:
+            judgment_id = next(iter(self._pending))
+            if not self._pending[judgment_id]:
+                break
+            del self._pending[judgment_id]
+            # Wiederholte Fehlschläge liegen vor der Marke und schieben sie nicht zurück
+            if self.last_id is None or judgment_id > self.last_id:
+                self.last_id = judgment_id
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json_util.dumps({"last_id": self.last_id, "saved_at": time.time()}))
+        os.replace(tmp, self.path)
+
+
+# ---------------------------------------------------------------------- #
+# Download
+# ---------------------------------------------------------------------- #
+class HostRateLimiter:
+    """Verteilt Anfragen pro Host auf feste Zeitabstände (``rate`` pro Sekunde)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next: dict[str, float] = {}
+        self._lock = asyncio.Lock()
+
+    async def wait(self, host: str):
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def delay(self, host: str, seconds: float):
+        """Schiebt die nächste Anfrage an ``host`` hinaus (z. B. nach ``Retry-After``)."""
+        self._next[host] = max(self._next.get(host, 0.0), time.monotonic() + seconds)
+
+
+def _conditional_headers(judgment: dict, url: str) -> dict:
+    crawl = judgment.get("crawl") or {}
+    headers = {}
+    if crawl.get("url") == url:
+        if crawl.get("etag"):
+            headers["If-None-Match"] = crawl["etag"]
+        if crawl.get("last_modified"):
+            headers["If-Modified-Since"] = crawl["last_modified"]
+    return headers
+
+
+async def fetch(client: httpx.AsyncClient, limiter: HostRateLimiter, url: str, headers: dict,
+                max_retries: int = CRAWL_MAX_RETRIES) -> httpx.Response:
+    """GET mit Rate-Limit und Wiederholungen; liefert die letzte Antwort oder wirft den letzten Fehler."""
+    host = urlsplit(url).netloc
+    for attempt in range(max_retries):
+        await limiter.wait(host)
+        try:
+            response = await client.get(url, headers=headers)
+        except httpx.TransportError as e:
+            if attempt == max_retries - 1:
+                raise
+            logging.warning(f"Download von {url} fehlgeschlagen (Versuch {attempt + 1}): {e}")
+        else:
+            if response.status_code not in RETRY_STATUS or attempt == max_retries - 1:
+                return response
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                limiter.delay(host, int(retry_after))
+        await asyncio.sleep(CRAWL_RETRY_BACKOFF * 2 ** attempt)
+
+
+# ---------------------------------------------------------------------- #
+# Extraktion (läuft im Prozess-Pool)
+# ---------------------------------------------------------------------- #
+def extract_and_store(kind: str, data: bytes, path: str | None) -> str:
+    """
+    Extrahiert den Text, schreibt ihn nach ``path`` und gibt den bereinigten
+    Text für den Textspeicher zurück.
+    """
+    text = html_to_text(data) if kind == "html" else pdf_to_text(data)
+    if path:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    return clean_text(text)
+
+
+# ---------------------------------------------------------------------- #
+# Pipeline
+# ---------------------------------------------------------------------- #
+def _crawl_update(judgment_id, url: str, status, response: httpx.Response | None = None,
+                  num_characters: int | None = None, error: str | None = None) -> UpdateOne:
+    fields = {"crawl.url": url, "crawl.status": status, "crawl.fetched_at": datetime.now(timezone.utc)}
+    unset = {}
+    if num_characters is not None:
+        fields["num_characters"] = num_characters
+        fields["crawl.etag"] = response.headers.get("ETag")
+        fields["crawl.last_modified"] = response.headers.get("Last-Modified")
+    if error is None:
+        unset["crawl.error"] = ""
+    else:
+        fields["crawl.error"] = error
+    update = {"$set": fields}
+    if unset:
+        update["$unset"] = unset
+    return UpdateOne({"_id": judgment_id}, update)
+
+
+async def _produce(collection, query: dict, checkpoint: CrawlCheckpoint, downloads: asyncio.Queue,
+                   limit: int | None, workers: int, stats: dict):
+    if checkpoint.last_id is not None:
+        query = {"$and": [query, {"$or": [{"_id": {"$gt": checkpoint.last_id}},
+                                          {"crawl.status": {"$in": CRAWL_RETRY_STATUS}}]}]}
+    cursor = collection.find(query, CRAWL_PROJECTION).sort("_id", 1)
+    if limit:
+        cursor = cursor.limit(limit)
+    rows = iter(cursor)
+    while True:
+        batch = await asyncio.to_thread(lambda: list(itertools.islice(rows, SOURCE_BATCH_SIZE)))
+        if not batch:
+            break
+        for judgment in batch:
+            checkpoint.started(judgment["_id"])
+            stats["queued"] += 1
+            await downloads.put(judgment)
+    for _ in range(workers):
+        await downloads.put(_DONE)
+
+
+async def _download(client, limiter, base_url: str, downloads: asyncio.Queue, extractions: asyncio.Queue,
+                    writes: asyncio.Queue, stats: dict):
+    while (judgment := await downloads.get()) is not _DONE:
+        source = document_source(judgment)
+        if source is None:
+            stats["no_source"] += 1
+            await writes.put((judgment["_id"], None, None))
+            continue
+        kind, datei = source
+        url = base_url + datei
+        try:
+            response = await fetch(client, limiter, url, _conditional_headers(judgment, url))
+        except httpx.HTTPError as e:
+            stats["failed"] += 1
+            await writes.put((judgment["_id"], _crawl_update(judgment["_id"], url, "error", error=str(e)), None))
+            continue
+
+        if response.status_code == 304:
+            stats["not_modified"] += 1
+            await writes.put((judgment["_id"], _crawl_update(judgment["_id"], url, 304), None))
+        elif response.status_code == 200:
+            stats["downloaded"] += 1
+            stats["bytes"] += len(response.content)
+            await extractions.put((judgment, kind, datei, url, response))
+        else:
+            stats["failed"] += 1
+            await writes.put((judgment["_id"], _crawl_update(judgment["_id"], url, response.status_code,
+                                                             error=f"HTTP {response.status_code}"), None))
+
+
+async def _extract(pool, extractions: asyncio.Queue, writes: asyncio.Queue, text_dir: str,
+                   cache: DocumentCache | None, stats: dict):
+    loop = asyncio.get_running_loop()
+    while (item := await extractions.get()) is not _DONE:
+        judgment, kind, datei, url, response = item
+        abbreviation = judgment.get("abbreviation")
+        path = os.path.join(os.path.expanduser(text_dir), abbreviation + ".txt") if abbreviation else None
+        cleaned = None
+        try:
+            cleaned = await loop.run_in_executor(pool, extract_and_store, kind, response.content, path)
+        except Exception as e:
+            stats["failed"] += 1
+            update = _crawl_update(judgment["_id"], url, "extraction_error", error=f"Extraktion: {e}")
+        else:
+            stats["extracted"] += 1
+            update = _crawl_update(judgment["_id"], url, 200, response, len(cleaned))
+        if cache is not None:
+            checksum = (judgment.get("HTML" if kind == "html" else "PDF") or {}).get("Checksum")
+            try:
+                await asyncio.to_thread(cache.put, datei, checksum, response.content, cleaned)
+            except Exception as e:
+                logging.warning(f"Dokument-Cache für {datei} nicht geschrieben: {e}")
+        await writes.put((judgment["_id"], update, cleaned))
+
+
+async def _write(collection, writes: asyncio.Queue, checkpoint: CrawlCheckpoint, stats: dict,
+                 store_texts: Callable[[list[tuple]], int] | None):
+    batch: list[tuple] = []     # (judgment_id, Update oder None, bereinigter Text oder None)
+
+    async def flush():
+        # Textspeicher zuerst, damit der Checkpoint nie vor dem Text weiterrückt
+        texts = [(judgment_id, text) for judgment_id, _, text in batch if text is not None]
+        if texts and store_texts is not None:
+            await asyncio.to_thread(store_texts, texts)
+        ops = [op for _, op, _ in batch if op is not None]
+        if ops:
+            await asyncio.to_thread(collection.bulk_write, ops, ordered=False)
+        checkpoint.finished(judgment_id for judgment_id, _, _ in batch)
+        checkpoint.save()
+        stats["written"] += len(ops)
+        batch.clear()
+
+    while True:
+        try:
+            item = await asyncio.wait_for(writes.get(), timeout=WRITE_MAX_DELAY)
+        except asyncio.TimeoutError:
+            if batch:
+                await flush()
+            continue
+        if item is _DONE:
+            break
+        batch.append(item)
+        if len(batch) >= WRITE_BATCH_SIZE:
+            await flush()
+    if batch:
+        await flush()
+
+
+async def crawl(query: dict | None = None, collection=None, base_url: str = DOCS_BASE_URL,
+                checkpoint: CrawlCheckpoint | None = None, text_dir: str = TEXT_FILES_DIR,
+                limit: int | None = None, concurrency: int = CRAWL_CONCURRENCY,
+                rate_per_host: float = CRAWL_RATE_PER_HOST, extract_workers: int = EXTRACT_WORKERS,
+                store_texts: Callable[[list[tuple]], int] | None = text_store.put_texts,
+                cache: DocumentCache | None = None) -> dict:
+    """
+    Lädt und extrahiert die Texte aller Urteile aus ``query``.
+
+    Args:
+        query: Auswahl der Urteile (Standard: alle).
+        base_url: Basis-URL der Dateien (für Tests ein lokaler Server).
+        checkpoint: Fortsetzungspunkt (Standard: ``CRAWL_CHECKPOINT_FILE``).
+        text_dir: Zielordner der Textdateien (Standard: ``TEXT_FILES_DIR``).
+        limit: Höchstens so viele Urteile in diesem Lauf.
+        store_texts: Schreibt (judgment_id, bereinigter Text)-Paare in den
+            Textspeicher (Standard: ``text_store.put_texts``; None: nur Textdateien).
+        cache: Dokument-Cache für Rohdateien und Texte (Standard: ``get_document_cache()``).
+
+    Returns:
+        Zähler des Laufs (downloaded, not_modified, failed, ...).
+    """
+    collection = collection if collection is not None else connect_to_mongo()
+    checkpoint = checkpoint if checkpoint is not None else CrawlCheckpoint()
+    cache = cache if cache is not None else get_document_cache()
+    stats = dict.fromkeys(["queued", "downloaded", "not_modified", "extracted", "failed",
+                           "no_source", "written", "bytes"], 0)
+    started = time.perf_counter()
+
+    downloads: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+    extractions: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+    writes: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+    limiter = HostRateLimiter(rate_per_host)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=CRAWL_TIMEOUT, follow_redirects=True) as client:
+        with ProcessPoolExecutor(max_workers=extract_workers) as pool:
+            writer = asyncio.create_task(_write(collection, writes, checkpoint, stats, store_texts))
+            downloaders = [asyncio.create_task(_download(client, limiter, base_url, downloads, extractions,
+                                                         writes, stats)) for _ in range(concurrency)]
+            extractors = [asyncio.create_task(_extract(pool, extractions, writes, text_dir, cache, stats))
+                          for _ in range(extract_workers)]
+
+            async def feed():
+                await _produce(collection, query or {}, checkpoint, downloads, limit, concurrency, stats)
+                await asyncio.gather(*downloaders)
+                for _ in extractors:
+                    await extractions.put(_DONE)
+                await asyncio.gather(*extractors)
+                await writes.put(_DONE)
+
+            # Stirbt der Writer, bleiben die übrigen Stufen an der vollen Queue
+            # hängen; daher beide überwachen und beim ersten Fehler abbrechen
+            feeder = asyncio.create_task(feed())
+            tasks = [feeder, writer, *downloaders, *extractors]
+            try:
+                done, _ = await asyncio.wait([feeder, writer], return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    if task.exception() is not None:
+                        raise task.exception()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    stats["seconds"] = round(time.perf_counter() - started, 2)
+    logging.info(f"Crawl beendet: {stats}")
+    return stats
+
+
+def run_crawl(query: dict | None = None, restart: bool = False, **kwargs) -> dict:
+    """Synchroner Einstieg; ``restart`` verwirft den Checkpoint."""
+    if restart and os.path.exists(CRAWL_CHECKPOINT_FILE):
+        os.remove(CRAWL_CHECKPOINT_FILE)
+    return asyncio.run(crawl(query, **kwargs))
+
+
+# ---------------------------------------------------------------------- #
+# Selbsttest gegen einen lokalen HTTP-Server
+# ---------------------------------------------------------------------- #
+def self_check():
+    """
+    Crawlt Fixture-HTML/PDF-Dateien von einem lokalen HTTP-Server (mit ETags
+    und einem vorübergehenden 503) in eine In-Memory-Collection und prüft
+    Extraktion, bedingte Anfragen und Fortsetzen am Checkpoint.
+    """
+    import hashlib
+    import tempfile
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    import fitz
+
+    workdir = tempfile.mkdtemp(prefix="crawl_self_check_")
+    pdf = fitz.open()
+    pdf.new_page().insert_text((72, 72), "Urteil als PDF vom Gericht")
+    files = {
+        "court/a.html": b"<html><header>Kopf</header><body><p>Erstes Urteil</p></body></html>",
+        "court/b.html": b"<html><body><p>Zweites Urteil</p><footer>Fuss</footer></body></html>",
+        "court/c.pdf": pdf.tobytes(),
+    }
+    files["court/f.html"] = b"<html><body><p>Spaetes Urteil</p></body></html>"
+    flaky = {"court/b.html": 1,     # so viele 503 vor dem Erfolg
+             "court/f.html": CRAWL_MAX_RETRIES}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            name = self.path.lstrip("/")
+            if name not in files:
+                self.send_response(404)
+                self.end_headers()
+                return
+            if flaky.get(name):
+                flaky[name] -= 1
+                self.send_response(503)
+                self.send_header("Retry-After", "0")
+                self.end_headers()
+                return
+            etag = '"' + hashlib.md5(files[name]).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(files[name])))
+            self.end_headers()
+            self.wfile.write(files[name])
+
+        def log_message(self, *args):
+            pass
+
+    class MemoryCollection:
+        def __init__(self, docs):
+            self.docs = {doc["_id"]: doc for doc in docs}
+
+        def find(self, query, projection=None):
+            return MemoryCursor(doc for _, doc in sorted(self.docs.items()) if self._matches(doc, query))
+
+        def _matches(self, doc, query):
+            # nur die Operatoren, die _produce verwendet
+            for key, condition in query.items():
+                if key == "$and":
+                    if not all(self._matches(doc, part) for part in condition):
+                        return False
+                elif key == "$or":
+                    if not any(self._matches(doc, part) for part in condition):
+                        return False
+                elif key == "_id":
+                    if not doc["_id"] > condition["$gt"]:
+                        return False
+                elif key == "crawl.status":
+                    if doc.get("crawl", {}).get("status") not in condition["$in"]:
+                        return False
+            return True
+
+        def bulk_write(self, ops, ordered=True):
+            for op in ops:
+                doc = self.docs[op._filter["_id"]]
+                for path, value in op._doc.get("$set", {}).items():
+                    target, *rest = path.split(".")
+                    if rest:
+                        doc.setdefault(target, {})[rest[0]] = value
+                    else:
+                        doc[target] = value
+
+    class MemoryCursor(list):
+        def sort(self, *args):
+            return self
+
+        def limit(self, n):
+            return MemoryCursor(self[:n])
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    collection = MemoryCollection([
+        {"_id": 1, "abbreviation": "a", "HTML": {"Datei": "court/a.html"}},
+        {"_id": 2, "abbreviation": "b", "HTML": {"Datei": "court/b.html"}},
+        {"_id": 3, "abbreviation": "c", "PDF": {"Datei": "court/c.pdf"}},
+        {"_id": 4, "abbreviation": "d", "HTML": {"Datei": "court/missing.html"}},
+        {"_id": 5, "abbreviation": "e"},
+        {"_id": 6, "abbreviation": "f", "HTML": {"Datei": "court/f.html"}},
+    ])
+    checkpoint_path = os.path.join(workdir, "checkpoint.json")
+    text_dir = os.path.join(workdir, "texts")
+    stored = {}
+    cache = DocumentCache(os.path.join(workdir, "cache"), fetch=lambda url: None)
+    options = dict(collection=collection, base_url=base_url, text_dir=text_dir, extract_workers=2,
+                   store_texts=lambda items: stored.update(items) or len(items), cache=cache)
+
+    global CRAWL_RETRY_BACKOFF
+    backoff, CRAWL_RETRY_BACKOFF = CRAWL_RETRY_BACKOFF, 0.01
+    try:
+        # 1. Teil-Lauf (2 Urteile), dann fortsetzen
+        first = asyncio.run(crawl(checkpoint=CrawlCheckpoint(checkpoint_path), limit=2, **options))
+        assert first["downloaded"] == 2 and CrawlCheckpoint(checkpoint_path).last_id == 2, first
+        second = asyncio.run(crawl(checkpoint=CrawlCheckpoint(checkpoint_path), **options))
+        assert second["queued"] == 4 and second["downloaded"] == 1, second
+        assert second["failed"] == 2 and second["no_source"] == 1, second
+        assert collection.docs[6]["crawl"]["status"] == 503 and CrawlCheckpoint(checkpoint_path).last_id == 6
+
+        # Fortsetzen: der 503 wird trotz Checkpoint erneut versucht, der 404 nicht
+        retry = asyncio.run(crawl(checkpoint=CrawlCheckpoint(checkpoint_path), **options))
+        assert retry["queued"] == 1 and retry["downloaded"] == 1, retry
+        assert collection.docs[6]["crawl"]["status"] == 200 and CrawlCheckpoint(checkpoint_path).last_id == 6
+
+        with open(os.path.join(text_dir, "a.txt"), encoding="utf-8") as f:
+            text = f.read()
+        assert "Erstes Urteil" in text and "Kopf" not in text, text
+        with open(os.path.join(text_dir, "c.txt"), encoding="utf-8") as f:
+            assert "Urteil als PDF" in f.read()
+        assert collection.docs[1]["crawl"]["etag"] and collection.docs[3]["num_characters"] > 0
+        assert collection.docs[4]["crawl"]["status"] == 404
+        assert sorted(stored) == [1, 2, 3, 6] and "Erstes Urteil" in stored[1], stored
+        assert cache.get_raw("court/a.html")[1] == files["court/a.html"]
+        assert cache.get_text("court/c.pdf", "pdf") == stored[3] and cache.misses == 0
+
+        # 2. Vollständiger Neu-Lauf: alles unverändert -> 304
+        again = asyncio.run(crawl(checkpoint=CrawlCheckpoint(None), **options))
+        assert again["not_modified"] == 4 and again["downloaded"] == 0, again
+    finally:
+        CRAWL_RETRY_BACKOFF = backoff
+        server.shutdown()
+    print(f"Selbsttest erfolgreich ({workdir})")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if "--self-check" in sys.argv:
+        self_check()
+    else:
+        run_crawl(restart="--restart" in sys.argv)
@@ -0,0 +1,238 @@
+"""
+document_cache.py
+
+Lokaler, inhaltsadressierter Cache für die Urteilsdateien von
+entscheidsuche.ch und ihren bereinigten Text.
+
+- Rohdateien liegen unter ``blobs/<sha256[:2]>/<sha256>`` (gleicher Inhalt =
+  eine Datei), der bereinigte Text unter ``texts/<sha256>.v<CLEAN_TEXT_VERSION>.txt``.
+- Eine SQLite-Datei ordnet jedem ``HTML.Datei``/``PDF.Datei`` den Hash seines
+  Inhalts und die ``Checksum`` aus Mongo zu. Ändert sich die Checksumme, wird
+  die Datei neu geladen.
+- Überschreitet der Cache ``DOCUMENT_CACHE_MAX_BYTES``, werden die am längsten
+  nicht gelesenen Inhalte verworfen (LRU), bis er wieder unter
+  ``DOCUMENT_CACHE_EVICT_TO`` liegt.
+
+``get_clean_text(entry)`` ist read-through: Text aus dem Cache, sonst
+Rohdatei aus dem Cache extrahieren, sonst herunterladen. Der Crawl
+(``crawl_pipeline``) lädt selbst (bedingt, gebündelt) und legt Rohdatei und
+Text über ``put`` hier ab, sodass beide Wege denselben Cache füllen.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from grab_text import DOCS_BASE_URL, clean_text, document_source, download_bytes, html_to_text, pdf_to_text
+from text_cleaning import CLEAN_TEXT_VERSION
+
+DOCUMENT_CACHE_DIR = os.environ.get("DOCUMENT_CACHE_DIR", "document_cache")
+DOCUMENT_CACHE_MAX_BYTES = 5 * 1024 ** 3
+DOCUMENT_CACHE_EVICT_TO = 0.9       # Anteil von MAX_BYTES nach einer Räumung
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    datei TEXT PRIMARY KEY,
+    checksum TEXT,
+    sha256 TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    text_size INTEGER NOT NULL DEFAULT 0,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs (last_access);
+"""
+
+
+class DocumentCache:
+    def __init__(self, root: str = DOCUMENT_CACHE_DIR, max_bytes: int = DOCUMENT_CACHE_MAX_BYTES,
+                 fetch=None):
+        """
+        Args:
+            root: Cache-Verzeichnis.
+            max_bytes: Obergrenze für Rohdateien und Texte zusammen.
+            fetch: Funktion ``url -> bytes | None`` (Standard: ``download_bytes``).
+        """
+        self.root = os.path.expanduser(root)
+        self.max_bytes = max_bytes
+        self.fetch = fetch or download_bytes
+        self.hits = self.misses = self.downloads = 0
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.root, "index.sqlite3"), timeout=30,
+                                   check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    # ------------------------------------------------------------------ #
+    # Pfade
+    # ------------------------------------------------------------------ #
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "blobs", sha256[:2], sha256)
+
+    def _text_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "texts", f"{sha256}.v{CLEAN_TEXT_VERSION}.txt")
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    # ------------------------------------------------------------------ #
+    # Read-through
+    # ------------------------------------------------------------------ #
+    def _lookup(self, datei: str, checksum: str | None) -> str | None:
+        with self._lock:
+            row = self._db.execute("SELECT sha256, checksum FROM files WHERE datei = ?", (datei,)).fetchone()
+        if row is None or (checksum and row[1] and row[1] != checksum):
+            return None
+        return row[0]
+
+    def _touch(self, sha256: str):
+        with self._lock:
+            self._db.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ?", (time.time(), sha256))
+
+    def get_raw(self, datei: str, checksum: str | None = None) -> tuple[str, bytes] | None:
+        """(sha256, Inhalt) der Datei; lädt sie herunter, wenn sie fehlt oder veraltet ist."""
+        sha256 = self._lookup(datei, checksum)
+        if sha256 is not None:
+            try:
+                with open(self._blob_path(sha256), "rb") as f:
+                    data = f.read()
+                self._touch(sha256)
+                return sha256, data
+            except FileNotFoundError:
+                pass
+
+        data = self.fetch(DOCS_BASE_URL + datei)
+        if data is None:
+            return None
+        self.downloads += 1
+        sha256 = self._store_raw(datei, checksum, data)
+        return sha256, data
+
+    def _store_raw(self, datei: str, checksum: str | None, data: bytes) -> str:
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(sha256)
+        if not os.path.exists(path):
+            self._write_atomic(path, data)
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT INTO blobs (sha256, size, last_access) VALUES (?, ?, ?) "
+                             "ON CONFLICT(sha256) DO UPDATE SET last_access = excluded.last_access",
+                             (sha256, len(data), now))
+            self._db.execute("INSERT OR REPLACE INTO files (datei, checksum, sha256, fetched_at) VALUES (?, ?, ?, ?)",
+                             (datei, checksum, sha256, now))
+        self._evict_if_needed()
+        return sha256
+
+    def get_text(self, datei: str, kind: str, checksum: str | None = None) -> str | None:
+        """Bereinigter Text der Datei (``kind`` = "html" oder "pdf")."""
+        sha256 = self._lookup(datei, checksum)
+        if sha256 is not None:
+            try:
+                with open(self._text_path(sha256), encoding="utf-8") as f:
+                    text = f.read()
+                self._touch(sha256)
+                self.hits += 1
+                return text
+            except FileNotFoundError:
+                pass
+        self.misses += 1
+
+        raw = self.get_raw(datei, checksum)
+        if raw is None:
+            return None
+        sha256, data = raw
+        text = clean_text(html_to_text(data) if kind == "html" else pdf_to_text(data))
+        self._store_text(sha256, text)
+        return text
+
+    def _store_text(self, sha256: str, text: str):
+        encoded = text.encode("utf-8")
+        self._write_atomic(self._text_path(sha256), encoded)
+        with self._lock:
+            self._db.execute("UPDATE blobs SET text_size = ? WHERE sha256 = ?", (len(encoded), sha256))
+        self._evict_if_needed()
+
+    def put(self, datei: str, checksum: str | None, data: bytes, text: str | None = None) -> str:
+        """Legt eine anderswo geladene Datei (und ihren bereinigten Text) ab; gibt den sha256 zurück."""
+        sha256 = self._store_raw(datei, checksum, data)
+        if text is not None:
+            self._store_text(sha256, text)
+        return sha256
+
+    def get_clean_text(self, entry: dict) -> str | None:
+        """Bereinigter Text eines Urteils (HTML vor PDF), oder None."""
+        source = document_source(entry)
+        if source is None:
+            return None
+        kind, datei = source
+        checksum = (entry.get("HTML" if kind == "html" else "PDF") or {}).get("Checksum")
+        return self.get_text(datei, kind, checksum)
+
+    # ------------------------------------------------------------------ #
+    # LRU-Räumung
+    # ------------------------------------------------------------------ #
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size + text_size), 0) FROM blobs").fetchone()[0]
+
+    def _evict_if_needed(self):
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * DOCUMENT_CACHE_EVICT_TO
+        with self._lock:
+            rows = self._db.execute("SELECT sha256, size + text_size FROM blobs ORDER BY last_access").fetchall()
+            evicted = []
+            for sha256, size in rows:
+                if total <= target:
+                    break
+                evicted.append(sha256)
+                total -= size
+            for sha256 in evicted:
+                self._db.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+                self._db.execute("DELETE FROM files WHERE sha256 = ?", (sha256,))
+        for sha256 in evicted:
+            for path in (self._blob_path(sha256), self._text_path(sha256)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        logging.info(f"Dokument-Cache: {len(evicted)} Einträge verworfen")
+
+    def stats(self) -> dict:
+        with self._lock:
+            files, blobs = self._db.execute(
+                "SELECT (SELECT COUNT(*) FROM files), (SELECT COUNT(*) FROM blobs)").fetchone()
+        return {"files": files, "blobs": blobs, "bytes": self.total_bytes(), "hits": self.hits,
+                "misses": self.misses, "downloads": self.downloads}
+
+
+_cache: DocumentCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_document_cache() -> DocumentCache:
+    """Prozessweiter Cache unter ``DOCUMENT_CACHE_DIR``."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DocumentCache()
+        return _cache
+
+
+if __name__ == "__main__":
+    print(get_document_cache().stats())
@@ -12,6 +12,9 @@ Abhängigkeiten:
     grab_text.clean_text                    (reinigt das Urteil vor dem Prompt)
     ollama_essentials.query_ollama          (Chat‑LLM Wrapper)
     ollama_essentials.is_gpu_memory_overloaded (optional, s. RELOAD_MODEL_IF_MEMORY_FULL)
+    inference_scheduler.InferenceScheduler  (verteilt die Anfragen auf alle GPUs)
+    context_planner.ContextPlanner          (wählt num_ctx über die echte Tokenzahl)
+    mongo_write_buffer.BulkWriteBuffer      (schreibt die Summaries gebündelt)
 """
 
 from __future__ import annotations
@@ -22,12 +25,16 @@ import time
 from datetime import datetime
 from pathlib import Path
 
-from prepare_data import connect_to_mongo        # DB‑Connector
+from prepare_data import connect_to_mongo, backfill_num_characters, get_full_text   # DB‑Zugriff
 from grab_text import clean_text                 # Text‑Reinigung
 from ollama_essentials import (
     query_ollama,
     is_gpu_memory_overloaded,
 )
+from inference_scheduler import InferenceScheduler, prefetch   # verteilt Anfragen auf alle GPUs
+from mongo_write_buffer import BulkWriteBuffer       # bündelt die Summary-Writes
+from context_planner import ContextPlanner           # Kontextgröße über echte Tokenzahl
+from mongo_indexes import ensure_indexes            # Indexe für Kandidatenauswahl
 
 # --------------------------------------------------------------------------- #
 # 0) Globale Schalter                                                         #
@@ -35,6 +42,7 @@ from ollama_essentials import (
 SKIP_PROCESSED = True          # Dokumente mit bereits vorhandener Summary überspringen
 TEST_ONLY = False              # True ⇒ keine DB‑Writes, nur Konsole
 RELOAD_MODEL_IF_MEMORY_FULL = False  # bei GPU‑Speicherproblemen Modell neu laden
+FALLBACK_CHARS_PER_TOKEN = 1   # ohne tokenizer.json: ein Token pro Zeichen wie bisher (sicher für Japanisch)
 
 # --------------------------------------------------------------------------- #
 # 1) Prompt‑Dateien                                                           #
@@ -65,19 +73,23 @@ def load_prompt(lang: str) -> str:
     return p.read_text(encoding="utf-8")
 
 
-def bucketize_by_context(docs: list[dict], base_chars: int = 5000) -> dict[int, list]:
+def build_summary_prompt_lang(text: str, lang: str) -> str:
+    """Setzt den Urteilstext in die Prompt‑Vorlage der Sprache ein."""
+    if lang == "German":
+        if not GERMAN_PROMPT_TEMPLATE:
+            raise RuntimeError("German prompt template not found")
+        return GERMAN_PROMPT_TEMPLATE.format(text=text)
+    return load_prompt(lang).format(text=text)
+
+
+def bucketize_by_context(docs: list[dict], planner: ContextPlanner, collection) -> dict[int, list]:
     """
-    Teilt Dokumente in Buckets anhand der benötigten Kontextgröße (chars/3 + Prompt‑Overhead).
+    Teilt Dokumente in Buckets anhand der benötigten Kontextgröße
+    (echte Tokenzahl von Prompt + Urteilstext, s. context_planner).
+    Gezählt wird der ungereinigte ``full_text``; die Reinigung verkürzt den
+    Text nur, die Schätzung liegt also auf der sicheren Seite.
     """
-    thresholds = [8192, 16384, 32768, 65536, 131072]
-    buckets = {ctx: [] for ctx in thresholds}
-    for d in docs:
-        need = (len(d["full_text"]) + base_chars) // 1
-        for ctx in thresholds:
-            if need <= ctx:
-                buckets[ctx].append(d)
-                break
-    return buckets
+    return planner.bucketize(docs, get_text=lambda d: get_full_text(collection, d["_id"]))
 
 
 # --------------------------------------------------------------------------- #
@@ -94,14 +106,7 @@ def generate_summary_lang(
     Erzeugt eine faktenbasierte Zusammenfassung für die angegebene Sprache.
     """
     try:
-        if lang == "German":
-            if not GERMAN_PROMPT_TEMPLATE:
-                raise RuntimeError("German prompt template not found")
-            summary_prompt = GERMAN_PROMPT_TEMPLATE.format(text=text)
-        else:
-            prompt_template = load_prompt(lang)
-            summary_prompt = prompt_template.format(text=text)
-
+        summary_prompt = build_summary_prompt_lang(text, lang)
         response = query_ollama(model, summary_prompt, gpu_nr=gpu_nr, num_ctx=num_ctx)
         return response.strip()
     except Exception as e:
@@ -128,38 +133,53 @@ def generate_summaries_for_language(
     if SKIP_PROCESSED:
         query["summary"] = {"$exists": False}
 
-    docs = list(collection.find(query))
-    docs.sort(key=lambda d: len(d["full_text"]))  # kürzere zuerst
-
-    buckets = bucketize_by_context(docs)
+    # Nur _id und Größen laden, serverseitig sortiert (kürzere zuerst); Texte erst kurz vor der Anfrage
+    backfill_num_characters(collection, {"language": lang})
+    planner = ContextPlanner(lambda text: build_summary_prompt_lang(text, lang), collection=collection,
+                             fallback_chars_per_token=FALLBACK_CHARS_PER_TOKEN)
+    docs = planner.select_candidates(collection, query)
 
-    for ctx, bucket in buckets.items():
-        if not bucket:
-            continue
-        logging.info(f"[{lang}] Kontext {ctx}: {len(bucket)} Dokumente")
-        random.shuffle(bucket)
+    buckets = bucketize_by_context(docs, planner, collection)
 
-        for idx, doc in enumerate(bucket):
-            # Bei Speicherproblemen auf größten Kontext ausweichen
-            cur_ctx = 131072 if (
-                RELOAD_MODEL_IF_MEMORY_FULL and idx % 10 == 0
-                and is_gpu_memory_overloaded(.9)
-            ) else ctx
-
-            text_clean = clean_text(doc["full_text"])
-            summary = generate_summary_lang(text_clean, lang, model=model, num_ctx=cur_ctx)
-
-            if summary is None:
+    with BulkWriteBuffer(collection) as buffer:
+        scheduler = InferenceScheduler()
+        for ctx, bucket in buckets.items():
+            if not bucket:
                 continue
-
-            if TEST_ONLY:
-                print(f"\n--- {doc['_id']} ({lang}) ---\n{summary}\n")
-            else:
-                collection.update_one(
-                    {"_id": doc["_id"]},
-                    {"$set": {"summary": summary}}
-                )
-                logging.info(f"[{lang}] Summary gespeichert für {doc['_id']}")
+            logging.info(f"[{lang}] Kontext {ctx}: {len(bucket)} Dokumente")
+            random.shuffle(bucket)
+
+            def jobs():
+                # Texte laden und reinigen, während die GPUs noch die vorherigen Dokumente bearbeiten
+                texts = prefetch(bucket, lambda doc: clean_text(get_full_text(collection, doc["_id"])))
+                for idx, (doc, text_clean) in enumerate(texts):
+                    # Bei Speicherproblemen auf größten Kontext ausweichen
+                    cur_ctx = 131072 if (
+                        RELOAD_MODEL_IF_MEMORY_FULL and idx % 10 == 0
+                        and is_gpu_memory_overloaded(.9)
+                    ) else ctx
+
+                    yield doc, text_clean, cur_ctx
+
+            def worker(job, gpu_nr):
+                doc, text_clean, cur_ctx = job
+                return generate_summary_lang(text_clean, lang, model=model, gpu_nr=gpu_nr, num_ctx=cur_ctx)
+
+            def on_result(job, summary, gpu_nr):
+                doc = job[0]
+                if summary is None:
+                    return
+
+                if TEST_ONLY:
+                    print(f"\n--- {doc['_id']} ({lang}) ---\n{summary}\n")
+                else:
+                    buffer.update_one(
+                        {"_id": doc["_id"]},
+                        {"$set": {"summary": summary}}
+                    )
+                    logging.info(f"[{lang}] Summary gespeichert für {doc['_id']}")
+
+            scheduler.run(jobs(), worker, on_result)
 
 
 # --------------------------------------------------------------------------- #
@@ -172,6 +192,8 @@ if __name__ == "__main__":
         handlers=[logging.StreamHandler()],
     )
 
+    ensure_indexes(connect_to_mongo())
+
     # Nur Vietnamesisch & Japanisch, wie gewünscht
     generate_summaries_for_language(
         "Vietnamese",
@@ -1,69 +1,49 @@
 import os
-import re
 import shutil
 import time
 
 import requests
-from pymongo import MongoClient
+from judgment_repository import get_judgment
 import fitz  # PyMuPDF
 from bs4 import BeautifulSoup
+from html_extraction import decode_html, html_file_text, stream_html_text
+from text_cleaning import clean_text, clean_texts
+import text_store
 
-def connect_to_mongo():
-    client = MongoClient("mongodb://localhost:27017/")  # Default MongoDB port
-    db = client["court_decisions"]  # Database name
-    collection = db["judgments"]  # Collection name
-    # print("MongoDB connected and database/collection created.")
-    return collection
+DOCS_BASE_URL = "https://entscheidsuche.ch/docs/"
+TEXT_FILES_DIR = "~/project/text_files"
+# "stream": html.parser-Events ohne DOM (html_extraction), "soup": BeautifulSoup-Baum
+HTML_EXTRACTION_MODE = "stream"
 
 
-def clean_text(text):
+def document_source(entry):
     """
-    Bereinigt den eingegebenen Text, indem NBSP-Zeichen, unnötige
-    Zeilenumbrüche und überflüssige Leerzeichen entfernt werden.
+    Liefert (Art, Pfad) der Quelldatei eines Urteils, HTML vor PDF,
+    z. B. ("html", "BS_Omni/xyz.html"), oder None.
     """
-    # 1. Ersetzen von NBSP-Zeichen durch reguläre Leerzeichen.
-    text = text.replace('\xa0', '')
+    if "HTML" in entry and "Datei" in entry["HTML"]:
+        return "html", entry["HTML"]["Datei"]
+    if "PDF" in entry and "Datei" in entry["PDF"]:
+        return "pdf", entry["PDF"]["Datei"]
+    return None
 
-    # 2. Ersetzen von Zeilenumbrüchen, denen kein Satzzeichen (., ?, !) vorausgeht,
-    #    durch ein Leerzeichen. Dies entfernt unnötige Umbrüche innerhalb eines Satzes.
-    text = re.sub(r'(?<!\w\.)\n(?!\n)', ' ', text)
-    # Erklärung des Regex:
-    # (?<!\w\.) : Negative Lookbehind. Stellt sicher, dass das Zeichen vor dem \n kein
-    #             Buchstabe oder eine Ziffer gefolgt von einem Punkt ist.
-    # \n        : Matcht einen Zeilenumbruch.
-    # (?!\n)    : Negative Lookahead. Stellt sicher, dass der Zeilenumbruch nicht
-    #             von einem weiteren Zeilenumbruch gefolgt wird.
 
-    # 3. Entfernen des Musters "Seite <Zahl>".
-    text = re.sub(r"Seite \d+", "", text)
+def text_file_path(abbreviation):
+    """Pfad der Textdatei eines Urteils (siehe ``get_clean_text_by_id``)."""
+    return os.path.expanduser(os.path.join(TEXT_FILES_DIR, abbreviation + ".txt"))
 
-    # 4. Ersetzen von mehreren Leerzeichen (inkl. Zeilenumbrüchen, die nicht zu Absätzen gehören)
-    #    durch ein einziges Leerzeichen.
-    text = re.sub(r'\s{2,}', ' ', text).strip()
 
-    return text
-
-
-def download_file(url, temp_dir, max_retries=10):
+def download_bytes(url, max_retries=10):
     """
-    Lädt eine Datei von einer URL herunter und speichert sie im temporären Ordner.
+    Lädt eine Datei von einer URL in den Speicher.
     Versucht es bis zu max_retries Mal, falls ein Fehler auftritt.
     """
     for attempt in range(1, max_retries + 1):
         try:
             print(f"Versuch {attempt}: Lade Datei von {url} herunter...")
-            response = requests.get(url, stream=True)
+            response = requests.get(url)
             response.raise_for_status()  # Überprüft, ob der HTTP-Statuscode erfolgreich ist
-
-            file_name = url.split("/")[-1]  # Dateiname aus der URL extrahieren
-            file_path = os.path.join(temp_dir, file_name)
-
-            with open(file_path, "wb") as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    file.write(chunk)
-
-            print(f"Datei erfolgreich heruntergeladen: {file_path}")
-            return file_path  # Erfolgreicher Download, Rückgabe des Pfads
+            return response.content
 
         except Exception as e:
             print(f"Fehler beim Herunterladen der Datei (Versuch {attempt}): {e}")
@@ -74,25 +54,62 @@ def download_file(url, temp_dir, max_retries=10):
                 return None
 
 
+def download_file(url, temp_dir, max_retries=10):
+    """
+    Lädt eine Datei von einer URL herunter und speichert sie im temporären Ordner.
+    Versucht es bis zu max_retries Mal, falls ein Fehler auftritt.
+    """
+    data = download_bytes(url, max_retries)
+    if data is None:
+        return None
+
+    file_name = url.split("/")[-1]  # Dateiname aus der URL extrahieren
+    file_path = os.path.join(temp_dir, file_name)
+    with open(file_path, "wb") as file:
+        file.write(data)
+
+    print(f"Datei erfolgreich heruntergeladen: {file_path}")
+    return file_path  # Erfolgreicher Download, Rückgabe des Pfads
+
+
+def html_to_text_soup(markup):
+    """Extrahiert Text aus HTML über einen BeautifulSoup-Baum, ohne Header und Footer."""
+    soup = BeautifulSoup(markup, "html.parser")
+    for header_footer in soup.find_all(["header", "footer"]):
+        header_footer.decompose()
+    return soup.get_text(separator="\n")
+
+
+def html_to_text(markup):
+    """Extrahiert Text aus HTML (String oder Bytes), ohne Header und Footer."""
+    if HTML_EXTRACTION_MODE == "soup":
+        return html_to_text_soup(markup)
+    if isinstance(markup, bytes):
+        markup = decode_html(markup)
+    return stream_html_text([markup])
+
+
+def pdf_to_text(data):
+    """Extrahiert Text aus einem PDF im Speicher (Bytes)."""
+    try:
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            return "".join(page.get_text("text") for page in doc)
+    except Exception as e:
+        print(f"Fehler beim PDF-Parsing: {e}")
+        return ""
+
+
 def extract_text_from_html(html_file):
     """Extrahiert Text aus einer HTML-Datei."""
+    if HTML_EXTRACTION_MODE == "stream":
+        return html_file_text(html_file)
     with open(html_file, "r", encoding="utf-8") as file:
-        soup = BeautifulSoup(file, "html.parser")
-        for header_footer in soup.find_all(["header", "footer"]):
-            header_footer.decompose()
-        return soup.get_text(separator="\n")
+        return html_to_text_soup(file.read())
 
 def extract_text_from_pdf(pdf_file):
     """Extrahiert Text aus einer PDF-Datei."""
-    try:
-        doc = fitz.open(pdf_file)
-        text = ""
-        for page in doc:
-            text += page.get_text("text")
-        return text
-    except Exception as e:
-        print(f"Fehler beim PDF-Parsing: {e}")
-        return ""
+    with open(pdf_file, "rb") as file:
+        return pdf_to_text(file.read())
 
 def create_temp_directory():
     """
@@ -113,101 +130,82 @@ def clean_temp_directory(temp_dir):
 def get_clean_text_by_id_online(entry_id):
     """
     Nimmt die ID eines Eintrags in MongoDB und gibt den bereinigten Text zurück.
+    Datei und Text kommen aus dem lokalen ``document_cache``; heruntergeladen
+    wird nur, was dort fehlt oder sich geändert hat (Checksumme).
     """
-    collection = connect_to_mongo()
-    entry = collection.find_one({"_id": entry_id})
+    from document_cache import get_document_cache
+
+    entry = get_judgment(entry_id, {"HTML": 1, "PDF": 1})
 
     if not entry:
         print(f"Kein Eintrag mit ID {entry_id} gefunden.")
         return None
 
-    temp_dir = create_temp_directory()
-    text_content = None
-    downloaded_file = None
-
-    try:
-        # Priorisiere HTML-Dateien
-        if "HTML" in entry and "Datei" in entry["HTML"]:
-            url = "https://entscheidsuche.ch/docs/" + entry["HTML"]["Datei"]
-            downloaded_file = download_file(url, temp_dir)
-            if downloaded_file:
-                text_content = extract_text_from_html(downloaded_file)
-        elif "PDF" in entry and "Datei" in entry["PDF"]:
-            url = "https://entscheidsuche.ch/docs/" + entry["PDF"]["Datei"]
-            downloaded_file = download_file(url, temp_dir)
-            if downloaded_file:
-                text_content = extract_text_from_pdf(downloaded_file)
-
-        # Bereinige Text
-        if text_content:
-            return clean_text(text_content)
-        else:
-            print(f"Keine Inhalte für die angegebene ID {entry_id} verfügbar.")
-            return None
-    finally:
-        # Lösche temporäre Dateien
-        if downloaded_file and os.path.exists(downloaded_file):
-            os.remove(downloaded_file)
+    text_content = get_document_cache().get_clean_text(entry)
+    if not text_content:
+        print(f"Keine Inhalte für die angegebene ID {entry_id} verfügbar.")
+        return None
+    return text_content
 
-def get_clean_text_by_id(entry_id):
+def read_text_by_id(entry_id):
     """
-    Nimmt die ID eines Eintrags in MongoDB und gibt den bereinigten Text zurück.
+    Nimmt die ID eines Eintrags in MongoDB und gibt den unbereinigten Text
+    seiner Textdatei zurück (oder None).
     """
-    collection = connect_to_mongo()
-    entry = collection.find_one({"_id": entry_id})
+    entry = get_judgment(entry_id, {"abbreviation": 1})
 
     if not entry:
         print(f"Kein Eintrag mit ID {entry_id} gefunden.")
         return None
 
-    textfile_path = os.path.expanduser("~/project/text_files/" + entry.get("abbreviation") + ".txt")
+    textfile_path = text_file_path(entry.get("abbreviation"))
 
     try:
         # Datei öffnen und lesen
         with open(textfile_path, "r", encoding="utf-8") as file:
-            content = file.read()
-        return clean_text(content)
+            return file.read()
 
     except FileNotFoundError:
         print(f"Die Datei {textfile_path} wurde nicht gefunden.")
     except Exception as e:
         print(f"Ein Fehler ist aufgetreten: {e}")
 
+def get_clean_text_by_id(entry_id):
+    """
+    Nimmt die ID eines Eintrags in MongoDB und gibt den bereinigten Text zurück.
+    Zuerst aus dem ``text_store``, sonst aus der Textdatei (neu bereinigt).
+    """
+    stored = text_store.get_clean_text(entry_id)
+    if stored is not None:
+        return stored
+    content = read_text_by_id(entry_id)
+    return clean_text(content) if content is not None else None
+
+def get_clean_texts_by_ids(entry_ids):
+    """
+    Wie ``get_clean_text_by_id`` für viele IDs: gespeicherte Texte gebündelt
+    aus dem ``text_store``, die übrigen aus den Textdateien, gesammelt in
+    einem Prozess-Pool bereinigt (``text_cleaning.clean_texts``).
+    Fehlende Texte -> None.
+    """
+    entry_ids = list(entry_ids)
+    texts = text_store.get_clean_texts(entry_ids)
+    missing = [i for i, text in enumerate(texts) if text is None]
+    contents = {i: read_text_by_id(entry_ids[i]) for i in missing}
+    found = [i for i in missing if contents[i] is not None]
+    for i, cleaned in zip(found, clean_texts([contents[i] for i in found])):
+        texts[i] = cleaned
+    return texts
+
 
 
 def main():
-    temp_dir = create_temp_directory()
-    collection = connect_to_mongo()
-    judgments = collection.find()
-
-    for judgment in judgments:
-        filename = None
-        text_content = None
-        downloaded_file = None  # Temporäre Datei
-
-        # Priorisiere HTML-Dateien
-        if "HTML" in judgment and "Datei" in judgment["HTML"]:
-            filename = "https://entscheidsuche.ch/docs/" + judgment["HTML"]["Datei"]
-            downloaded_file = download_file(filename, temp_dir)
-            if downloaded_file:
-                text_content = extract_text_from_html(downloaded_file)
-        elif "PDF" in judgment and "Datei" in judgment["PDF"]:
-            filename = "https://entscheidsuche.ch/docs/" + judgment["PDF"]["Datei"]
-            downloaded_file = download_file(filename, temp_dir)
-            if downloaded_file:
-                text_content = extract_text_from_pdf(downloaded_file)
-
-        # Bereinige Text und zeige Vorschau an
-        if text_content:
-            cleaned_text = clean_text(text_content)
-        # Lösche die temporäre Datei
-        if downloaded_file and os.path.exists(downloaded_file):
-            os.remove(downloaded_file)
-
-        break  # Entfernen, um alle Dokumente zu verarbeiten
-
-    # Lösche den gesamten temporären Ordner
-    # clean_temp_directory(temp_dir)
+    """
+    Lädt die Texte aller Urteile neu herunter (parallel, fortsetzbar,
+    mit bedingten Anfragen), siehe ``crawl_pipeline``.
+    """
+    from crawl_pipeline import run_crawl
+    run_crawl()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,279 @@
+"""
+html_extraction.py
+
+Streaming-Textextraktion für die HTML-Urteile.
+
+``StreamingTextExtractor`` bekommt das HTML stückweise über die Events von
+``html.parser`` und sammelt nur die Textknoten ein, ohne einen DOM-Baum
+aufzubauen. ``header``- und ``footer``-Teilbäume werden übersprungen. Das
+Ergebnis entspricht dem bisherigen Weg
+
+    soup = BeautifulSoup(markup, "html.parser")
+    for header_footer in soup.find_all(["header", "footer"]):
+        header_footer.decompose()
+    soup.get_text(separator="\\n")
+
+Dafür bildet der Extraktor nach, wie BeautifulSoup Textknoten bildet: Text
+zwischen zwei Tags/Kommentaren ist ein Knoten, reine Leerraum-Knoten werden
+zu "\\n" bzw. " " (außer in ``pre``/``textarea``), Text in ``script``/``style``/
+``template`` sowie Kommentare und Doctype zählen nicht (CData schon, auch in
+``template``). Ein End-Tag schließt
+wie dort das zuletzt geöffnete Element gleichen Namens (und alles darin);
+das End-Tag eines leeren Elements nach seinem Start-Tag (``<br>...</br>``)
+wird wie dort verschluckt, ohne den Textknoten zu beenden. Ein UTF-8-BOM am
+Anfang der Bytes wird wie bei ``UnicodeDammit`` entfernt.
+
+Zeichenreferenzen löst ``html.parser`` auf; bei unbekannten oder
+fehlerhaften Referenzen (``&foo;``) weicht das von BeautifulSoup ab, das
+dort das Semikolon verwirft.
+
+``python html_extraction.py --self-check`` vergleicht beide Wege auf einer
+festen Liste von Grenzfällen (``SELF_CHECK_CASES``).
+
+``python html_extraction.py [Ordner|Dateien ...]`` vergleicht Durchsatz,
+Spitzen-Speicher und Ergebnis beider Wege (Standard: HTML-Dateien im
+``document_cache``).
+"""
+
+from __future__ import annotations
+
+import codecs
+import os
+import re
+import sys
+import time
+import tracemalloc
+from html.parser import HTMLParser
+
+SKIPPED_SUBTREES = {"header", "footer"}
+NON_TEXT_CONTAINERS = {"script", "style", "template"}      # Script/Stylesheet/TemplateString in bs4
+PRESERVE_WHITESPACE = {"pre", "textarea"}
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta",
+    "param", "source", "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex",
+    "nextid", "spacer",
+}
+ASCII_SPACES = str.maketrans("", "", "\x20\x0a\x09\x0c\x0d")
+READ_CHUNK_SIZE = 64 * 1024
+# Byte-Order-Marks haben wie bei UnicodeDammit Vorrang vor <meta charset>
+BOMS = [(codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16")]
+
+# Grenzfälle für --self-check (Bytes laufen über decode_html bzw. UnicodeDammit)
+SELF_CHECK_CASES = [
+    "x<br>y</br>z", "x<hr>y</hr>z", "x<img src=a>y</img>z", "x</br>y", "x<br><br>y</br>z</br>w",
+    "x<br/>y</br>z", "<p>a</p>\n<p>b</p>", "<div><p>a<div>b</p>c</div>",
+    "<header>Kopf</header>Text<footer>Fuss</footer>", "<header><![CDATA[cd]]></header>x",
+    "<template>t<![CDATA[cd]]></template>", "<script>var a = '<p>';</script>x", "<style>p {}</style>x",
+    "<pre>  a\n  b </pre>", "<textarea> </textarea>x", "a<!-- c -->b", "<!DOCTYPE html>x", "<?pi x?>y",
+    "&amp; &lt;p&gt; &nbsp; &#65; &#x42;", "a\r\n \tb", "<table><tr><td>1</td><td>2</td></tr></table>",
+    b"\xef\xbb\xbf<p>bom</p>", b"<meta charset=\"utf-8\">\xef\xbb\xbfx",
+    b"<meta charset=\"iso-8859-1\"><p>Z\xfcrich</p>", "<p>Zürich</p>".encode("utf-8"),
+]
+
+_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?([\w-]+)""", re.IGNORECASE)
+
+
+class StreamingTextExtractor(HTMLParser):
+    def __init__(self, separator: str = "\n"):
+        super().__init__(convert_charrefs=True)
+        self.separator = separator
+        self.strings: list[str] = []
+        self._data: list[str] = []
+        self._stack: list[str] = []
+        self._closed_void: list[str] = []   # leere Elemente, deren End-Tag noch folgen darf
+        self._skip = 0          # offene header/footer/script/style/template
+        self._removed = 0       # davon header/footer (ganzer Teilbaum entfernt)
+        self._preserve = 0      # offene pre/textarea
+
+    # Textknoten ------------------------------------------------------- #
+    def _end_data(self):
+        if not self._data:
+            return
+        data = "".join(self._data)
+        self._data.clear()
+        if self._skip:
+            return
+        if not self._preserve and not data.translate(ASCII_SPACES):
+            data = "\n" if "\n" in data else " "
+        self.strings.append(data)
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    # Tags -------------------------------------------------------------- #
+    def handle_starttag(self, tag, attrs):
+        self._end_data()
+        if tag in VOID_ELEMENTS:
+            self._closed_void.append(tag)
+            return
+        self._stack.append(tag)
+        if tag in SKIPPED_SUBTREES:
+            self._skip += 1
+            self._removed += 1
+        elif tag in NON_TEXT_CONTAINERS:
+            self._skip += 1
+        elif tag in PRESERVE_WHITESPACE:
+            self._preserve += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self._end_data()
+        if tag not in VOID_ELEMENTS:
+            # <div/> öffnet und schließt sofort
+            self.handle_starttag(tag, attrs)
+            self._close(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self._closed_void:
+            # </br> nach <br>: schon geschlossen, beendet keinen Textknoten
+            self._closed_void.remove(tag)
+            return
+        self._close(tag)
+
+    def _close(self, tag):
+        self._end_data()
+        if tag not in self._stack:
+            return
+        while True:
+            closed = self._stack.pop()
+            if closed in SKIPPED_SUBTREES:
+                self._skip -= 1
+                self._removed -= 1
+            elif closed in NON_TEXT_CONTAINERS:
+                self._skip -= 1
+            elif closed in PRESERVE_WHITESPACE:
+                self._preserve -= 1
+            if closed == tag:
+                break
+
+    # Kein Text --------------------------------------------------------- #
+    def handle_comment(self, data):
+        self._end_data()
+
+    def handle_decl(self, decl):
+        self._end_data()
+
+    def handle_pi(self, data):
+        self._end_data()
+
+    def unknown_decl(self, data):
+        self._end_data()
+        if data.upper().startswith("CDATA[") and not self._removed:
+            self.strings.append(data[len("CDATA["):])     # CData zählt in bs4 als Text
+
+    def close(self):
+        super().close()
+        self._end_data()
+
+    @property
+    def text(self) -> str:
+        return self.separator.join(self.strings)
+
+
+def decode_html(data: bytes) -> str:
+    """Bytes -> Text, nach BOM, sonst ``<meta charset>``, sonst UTF-8 (ohne BOM)."""
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return data.decode(encoding, errors="replace")
+    match = _CHARSET.search(data[:2048])
+    encoding = match.group(1).decode("ascii") if match else "utf-8"
+    try:
+        if codecs.lookup(encoding).name == "utf-8":
+            encoding = "utf-8-sig"
+        return data.decode(encoding, errors="replace")
+    except LookupError:
+        return data.decode("utf-8-sig", errors="replace")
+
+
+def stream_html_text(chunks, separator: str = "\n") -> str:
+    """Text aus HTML-Stücken (Strings), ohne header/footer."""
+    extractor = StreamingTextExtractor(separator)
+    for chunk in chunks:
+        extractor.feed(chunk)
+    extractor.close()
+    return extractor.text
+
+
+def html_file_text(path: str, encoding: str = "utf-8", chunk_size: int = READ_CHUNK_SIZE) -> str:
+    """Liest eine HTML-Datei stückweise und extrahiert den Text."""
+    with open(path, "r", encoding=encoding) as f:
+        return stream_html_text(iter(lambda: f.read(chunk_size), ""))
+
+
+# ---------------------------------------------------------------------- #
+# Benchmark
+# ---------------------------------------------------------------------- #
+def _corpus_files(paths: list[str]) -> list[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files += [os.path.join(root, name) for name in names if not name.endswith((".tmp", ".sqlite3"))]
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def benchmark(paths: list[str]) -> dict:
+    """
+    Vergleicht BeautifulSoup und den Streaming-Extraktor auf einem Korpus:
+    Durchsatz (MB/s), Spitzen-Speicher pro Datei (tracemalloc) und wie viele
+    Dateien einen abweichenden Text ergeben.
+    """
+    from grab_text import html_to_text_soup
+
+    documents = []
+    for path in _corpus_files(paths):
+        with open(path, "rb") as f:
+            data = f.read()
+        if b"<" in data[:4096] and not data.startswith(b"%PDF"):
+            documents.append(decode_html(data))
+    megabytes = sum(len(d) for d in documents) / 1e6
+
+    results = {"files": len(documents), "megabytes": round(megabytes, 2)}
+    outputs = {}
+    for name, extract in (("soup", html_to_text_soup), ("stream", lambda d: stream_html_text([d]))):
+        start = time.perf_counter()
+        outputs[name] = [extract(d) for d in documents]
+        seconds = time.perf_counter() - start
+
+        peak = 0
+        for document in documents[:200]:
+            tracemalloc.start()
+            extract(document)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+        results[f"{name}_seconds"] = round(seconds, 3)
+        results[f"{name}_mb_per_s"] = round(megabytes / seconds, 2) if seconds else None
+        results[f"{name}_peak_mb"] = round(peak / 1e6, 2)
+
+    results["mismatches"] = sum(a != b for a, b in zip(outputs["soup"], outputs["stream"]))
+    return results
+
+
+def self_check():
+    """Vergleicht BeautifulSoup und den Streaming-Extraktor auf ``SELF_CHECK_CASES``."""
+    from grab_text import html_to_text_soup
+
+    mismatches = []
+    for case in SELF_CHECK_CASES:
+        expected = html_to_text_soup(case)
+        actual = stream_html_text([decode_html(case) if isinstance(case, bytes) else case])
+        if actual != expected:
+            mismatches.append((case, expected, actual))
+    for case, expected, actual in mismatches:
+        print(f"{case!r}: soup {expected!r}, stream {actual!r}")
+    assert not mismatches, f"{len(mismatches)} von {len(SELF_CHECK_CASES)} Fällen weichen ab"
+    print(f"Selbsttest erfolgreich ({len(SELF_CHECK_CASES)} Fälle)")
+
+
+if __name__ == "__main__":
+    if "--self-check" in sys.argv:
+        self_check()
+        sys.exit()
+
+    from document_cache import DOCUMENT_CACHE_DIR
+
+    corpus = sys.argv[1:] or [os.path.join(os.path.expanduser(DOCUMENT_CACHE_DIR), "blobs")]
+    for key, value in benchmark(corpus).items():
+        print(f"{key}: {value}")
@@ -0,0 +1,184 @@
+"""
+inference_scheduler.py
+
+Verteilt Inferenz-Aufträge auf alle in ``ollama_essentials.OLLAMA_URLS``
+konfigurierten Ollama-Endpunkte (ein Endpunkt pro GPU).
+
+Jeder Endpunkt bekommt ``max_in_flight`` Worker-Threads. Alle Worker ziehen
+aus derselben Auftragsschlange, d. h. der Endpunkt, der zuerst fertig wird,
+übernimmt den nächsten Auftrag. Es sind nie mehr als
+``len(endpoints) * max_in_flight`` Aufträge gleichzeitig unterwegs.
+
+Die Ergebnisse werden im aufrufenden Thread an ``on_result`` übergeben, damit
+Mongo-Writes und Konsolenausgaben nicht aus mehreren Threads gleichzeitig
+passieren.
+
+``prefetch`` lädt die Urteilstexte für die Aufträge einige Elemente im Voraus.
+"""
+
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator
+
+from ollama_essentials import OLLAMA_URLS
+
+# Gleichzeitige Anfragen pro Endpunkt. Werte > 1 lohnen sich nur, wenn Ollama
+# mit OLLAMA_NUM_PARALLEL > 1 gestartet wurde.
+MAX_IN_FLIGHT_PER_ENDPOINT = 1
+
+# Wie viele Urteilstexte prefetch() im Voraus lädt
+PREFETCH_DEPTH = 4
+
+_SHUTDOWN = object()
+
+
+class InferenceScheduler:
+    """
+    Hält alle konfigurierten Endpunkte mit einer begrenzten Anzahl laufender
+    Anfragen ausgelastet.
+    """
+
+    def __init__(self, endpoints: list[int] | None = None,
+                 max_in_flight: int = MAX_IN_FLIGHT_PER_ENDPOINT):
+        """
+        Args:
+            endpoints: Indizes in ``OLLAMA_URLS`` (Standard: alle Endpunkte).
+            max_in_flight: Maximale Anzahl gleichzeitiger Anfragen pro Endpunkt.
+        """
+        if endpoints is None:
+            endpoints = list(range(len(OLLAMA_URLS)))
+        if not endpoints:
+            raise ValueError("Mindestens ein Ollama-Endpunkt wird benötigt")
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight muss mindestens 1 sein")
+
+        self.endpoints = endpoints
+        self.max_in_flight = max_in_flight
+        self.completed_per_endpoint = {gpu_nr: 0 for gpu_nr in endpoints}
+
+    @property
+    def capacity(self) -> int:
+        """Maximale Anzahl gleichzeitig laufender Aufträge über alle Endpunkte."""
+        return len(self.endpoints) * self.max_in_flight
+
+    def run(self,
+            jobs: Iterable[Any],
+            worker: Callable[[Any, int], Any],
+            on_result: Callable[[Any, Any, int], None],
+            should_stop: Callable[[], bool] | None = None) -> bool:
+        """
+        Arbeitet alle Aufträge ab.
+
+        Args:
+            jobs: Aufträge; werden erst konsumiert, wenn ein Slot frei ist
+                  (Texte können also im Generator nachgeladen werden).
+            worker: ``worker(job, gpu_nr)`` läuft im Worker-Thread des Endpunkts.
+            on_result: ``on_result(job, result, gpu_nr)`` läuft im aufrufenden Thread.
+            should_stop: Wird vor jeder Vergabe geprüft. Liefert sie True, werden
+                         keine neuen Aufträge mehr vergeben; laufende werden
+                         noch abgeschlossen.
+
+        Returns:
+            True, wenn vorzeitig über ``should_stop`` abgebrochen wurde.
+        """
+        job_queue: queue.Queue = queue.Queue()
+        result_queue: queue.Queue = queue.Queue()
+
+        def worker_loop(gpu_nr: int):
+            while True:
+                job = job_queue.get()
+                if job is _SHUTDOWN:
+                    return
+                try:
+                    result_queue.put((job, worker(job, gpu_nr), gpu_nr, None))
+                except Exception as e:  # Fehler an den aufrufenden Thread weiterreichen
+                    result_queue.put((job, None, gpu_nr, e))
+
+        threads = [
+            threading.Thread(target=worker_loop, args=(gpu_nr,), daemon=True,
+                             name=f"ollama-gpu{gpu_nr}-{slot}")
+            for gpu_nr in self.endpoints
+            for slot in range(self.max_in_flight)
+        ]
+        for thread in threads:
+            thread.start()
+
+        job_iter = iter(jobs)
+        in_flight = 0
+        exhausted = False
+        stopped = False
+
+        try:
+            while True:
+                # Freie Slots mit neuen Aufträgen füllen
+                while not exhausted and in_flight < self.capacity:
+                    if should_stop is not None and should_stop():
+                        exhausted = stopped = True
+                        break
+                    try:
+                        job = next(job_iter)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    job_queue.put(job)
+                    in_flight += 1
+
+                if in_flight == 0:
+                    break
+
+                # Auf den nächsten fertigen Endpunkt warten
+                job, result, gpu_nr, error = result_queue.get()
+                in_flight -= 1
+                if error is not None:
+                    logging.error(f"Auftrag auf GPU {gpu_nr} fehlgeschlagen: {error}")
+                    continue
+                self.completed_per_endpoint[gpu_nr] += 1
+                on_result(job, result, gpu_nr)
+        finally:
+            for _ in threads:
+                job_queue.put(_SHUTDOWN)
+
+        for thread in threads:
+            thread.join()
+
+        return stopped
+
+
+def prefetch(items: Iterable[Any], fetch: Callable[[Any], Any],
+             depth: int = PREFETCH_DEPTH) -> Iterator[tuple[Any, Any]]:
+    """
+    Liefert ``(item, fetch(item))`` in der Reihenfolge von ``items`` und lädt
+    dabei bis zu ``depth`` Elemente im Voraus in einem Thread-Pool. So liegt
+    der nächste Urteilstext bereit, wenn ein Endpunkt frei wird, ohne dass
+    alle Texte gleichzeitig im Speicher sind.
+
+    Elemente, deren Laden fehlschlägt, werden protokolliert und übersprungen.
+    """
+    item_iter = iter(items)
+    with ThreadPoolExecutor(max_workers=depth, thread_name_prefix="prefetch") as pool:
+        pending: deque = deque()
+
+        def fill():
+            while len(pending) < depth:
+                try:
+                    item = next(item_iter)
+                except StopIteration:
+                    return
+                pending.append((item, pool.submit(fetch, item)))
+
+        fill()
+        while pending:
+            item, future = pending.popleft()
+            fill()
+            try:
+                result = future.result()
+            except Exception as e:
+                ident = item.get("_id", item) if isinstance(item, dict) else item
+                logging.error(f"Laden für {ident} fehlgeschlagen, wird übersprungen: {e}")
+                continue
+            yield item, result
@@ -0,0 +1,229 @@
+"""
+judgment_repository.py
+
+Zugriffe auf Urteile, Modellantworten, Biases und Annotationen in
+``court_decisions.judgments``.
+
+Alle Funktionen nutzen den gemeinsamen Client aus ``mongo_essentials`` und
+laden nur die Felder, die sie brauchen (kein Volltext, keine fremden
+Antworten). Biases werden über den Katalog in ``bias_catalog`` gefunden. Die TypedDicts
+beschreiben die Struktur der eingebetteten Dokumente, wie sie ``check_bias``
+und ``annotation_handler`` schreiben.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Any, TypedDict
+
+import bias_catalog
+from mongo_essentials import connect_to_mongo
+
+SELECTION_FILTER = "selected_for_annotation"
+
+_catalogued_runs: set[int] = set()
+
+
+class Annotation(TypedDict, total=False):
+    annotator: str
+    bias_type_id: int
+    comment: str
+    bias_id: int
+    timestamp: float
+
+
+class Bias(TypedDict, total=False):
+    id: int
+    run_id: int
+    bias_type_name: str
+    textpassage: str
+    reasoning: str
+    origin_url: str
+    annotations: list[Annotation]
+
+
+class OllamaResponse(TypedDict, total=False):
+    id: str
+    model: str
+    response: Any               # dict mit original_text/biases oder Rohtext
+    time_taken: float
+    timestamp: str
+    run_id: int
+
+
+class BiasSummary(TypedDict):
+    id: int
+    run_id: int
+    arr_annotators: list[str]
+    bias_type_id: int | None
+    language: str | None
+    disagreement: bool
+
+
+class BiasPage(TypedDict):
+    items: list[BiasSummary]
+    next: str | None            # Cursor der nächsten Seite
+    prev: str | None            # Cursor der vorigen Seite
+
+
+class BiasRecord(TypedDict):
+    judgment_id: Any
+    summary: str | None
+    html_file: str | None
+    bias: Bias
+
+
+# ---------------------------------------------------------------------- #
+# Urteile und Antworten
+# ---------------------------------------------------------------------- #
+def get_judgment(judgment_id, projection: dict | None = None) -> dict | None:
+    """Ein Urteil per ``_id``; ``projection`` begrenzt die geladenen Felder."""
+    return connect_to_mongo().find_one({"_id": judgment_id}, projection)
+
+
+def get_responses(judgment_id, run_ids: list[int] | None = None) -> list[OllamaResponse]:
+    """Modellantworten eines Urteils, optional nur die der angegebenen Runs."""
+    doc = get_judgment(judgment_id, {"_id": 0, "ollama_responses": 1})
+    responses = (doc or {}).get("ollama_responses", [])
+    if run_ids is None:
+        return responses
+    return [r for r in responses if r.get("run_id") in run_ids]
+
+
+# ---------------------------------------------------------------------- #
+# Biases
+# ---------------------------------------------------------------------- #
+def list_bias_page(run_ids: list[int], selection_filter: str = SELECTION_FILTER, *,
+                   unannotated_by: str | None = None, disagreement: bool | None = None,
+                   bias_type_id: int | None = None, language: str | None = None,
+                   after: str | None = None, before: str | None = None, around: str | None = None,
+                   limit: int = bias_catalog.PAGE_SIZE) -> BiasPage:
+    """
+    Eine Seite der Fallliste aus dem Bias-Katalog, optional gefiltert.
+    ``after``/``before`` blättern ab einem Cursor, ``around`` liefert die Seite
+    rund um einen Fall (Cursor ``"<bias_id>-<run_id>"``).
+    """
+    _ensure_catalog(run_ids)
+    query = bias_catalog.list_query(run_ids, selection_filter, unannotated_by=unannotated_by,
+                                    disagreement=disagreement, bias_type_id=bias_type_id, language=language)
+    if around is not None:
+        rows, next_cursor, prev_cursor = bias_catalog.window(query, around, limit)
+    else:
+        rows, next_cursor, prev_cursor = bias_catalog.list_page(query, after=after, before=before, limit=limit)
+
+    items = [{
+        "id": row["bias_id"],
+        "run_id": row["run_id"],
+        "arr_annotators": row.get("annotators", []),
+        "bias_type_id": row.get("bias_type_id"),
+        "language": row.get("language"),
+        "disagreement": row.get("disagreement", False),
+    } for row in rows]
+    return {"items": items, "next": next_cursor, "prev": prev_cursor}
+
+
+def get_bias(bias_id: int, run_ids: list[int], selection_filter: str = SELECTION_FILTER) -> BiasRecord | None:
+    """
+    Ein Bias samt Zusammenfassung des Urteils, oder None. Der Katalog liefert
+    Urteil und Position; geladen wird nur dieses eine Array-Element.
+    """
+    _ensure_catalog(run_ids)
+    for attempt in range(2):
+        row = bias_catalog.find_row(bias_id, run_ids, selection_filter)
+        if row is None:
+            return None
+
+        pipeline = [
+            {"$match": {"_id": row["judgment_id"]}},
+            {"$project": {
+                "summary": 1,
+                "HTML.Datei": 1,
+                "bias": {"$let": {
+                    "vars": {"response": {"$arrayElemAt": ["$ollama_responses", row["response_index"]]}},
+                    "in": {"$arrayElemAt": ["$$response.response.biases", row["bias_index"]]},
+                }},
+            }},
+        ]
+        doc = next(connect_to_mongo().aggregate(pipeline), None)
+        bias = (doc or {}).get("bias")
+        if bias and bias.get("id") == bias_id and bias.get("run_id", row["run_id"]) == row["run_id"]:
+            html = doc.get("HTML")
+            return {
+                "judgment_id": doc["_id"],
+                "summary": doc.get("summary"),
+                "html_file": html.get("Datei") if isinstance(html, dict) else None,
+                "bias": bias,
+            }
+
+        # Positionen veraltet (z. B. nach Umnummerierung): Urteil neu katalogisieren
+        logging.info(f"Bias-Katalog für Urteil {row['judgment_id']} veraltet, wird aktualisiert")
+        bias_catalog.sync_judgment(row["judgment_id"])
+    return None
+
+
+def _ensure_catalog(run_ids: list[int]):
+    """Baut beim ersten Zugriff pro Prozess fehlende Runs im Katalog auf."""
+    missing = [run_id for run_id in run_ids if run_id not in _catalogued_runs]
+    if missing:
+        bias_catalog.ensure_runs(missing)
+        _catalogued_runs.update(missing)
+
+
+# ---------------------------------------------------------------------- #
+# Annotationen
+# ---------------------------------------------------------------------- #
+def save_annotation(bias_id: int, run_id: int, annotation: Annotation,
+                    selection_filter: str = SELECTION_FILTER) -> Annotation | None:
+    """
+    Setzt die Annotation von ``annotation["annotator"]`` für einen Bias
+    atomar per ``arrayFilters``: eine vorhandene Annotation desselben
+    Annotators wird überschrieben, sonst wird eine neue angehängt. Das Urteil
+    wird dafür weder gelesen noch ersetzt, gleichzeitige Annotationen anderer
+    Annotatoren bleiben erhalten.
+
+    Returns:
+        Die gespeicherte Annotation, oder None, wenn der Bias nicht gefunden wurde.
+    """
+    collection = connect_to_mongo()
+    annotator = annotation["annotator"]
+    bias_path = "ollama_responses.$[response].response.biases.$[bias]"
+    array_filters = [
+        {"response.run_id": run_id, "response.response.biases.id": bias_id},
+        {"bias.id": bias_id, "bias.run_id": run_id},
+    ]
+
+    def bias_filter(annotator_condition):
+        return {
+            selection_filter: True,
+            "ollama_responses.response.biases": {"$elemMatch": {
+                "id": bias_id, "run_id": run_id, "annotations.annotator": annotator_condition,
+            }},
+        }
+
+    for _ in range(2):
+        # 1. Vorhandene Annotation des Annotators aktualisieren
+        result = collection.update_one(
+            bias_filter(annotator),
+            {"$set": {f"{bias_path}.annotations.$[annotation].{field}": value
+                      for field, value in annotation.items()}},
+            array_filters=array_filters + [{"annotation.annotator": annotator}],
+        )
+        if result.matched_count:
+            break
+
+        # 2. Sonst anhängen (nur wenn der Annotator dort noch fehlt)
+        result = collection.update_one(
+            bias_filter({"$ne": annotator}),
+            {"$push": {f"{bias_path}.annotations": annotation}},
+            array_filters=array_filters,
+        )
+        if result.matched_count:
+            break
+        # Weder vorhanden noch fehlend: entweder gibt es den Bias nicht, oder
+        # eine parallele Anfrage hat die Annotation eben angelegt -> nochmal setzen
+    else:
+        logging.warning(f"Bias {bias_id} (Run {run_id}) für Annotation nicht gefunden")
+        return None
+
+    bias_catalog.record_annotation(run_id, bias_id, annotator, annotation.get("bias_type_id"))
+    return annotation
@@ -0,0 +1,152 @@
+"""
+language_detection.py
+
+Gebündelte Spracherkennung für die Urteile (Feld ``language``).
+
+Die ``Abstract``-Texte werden per Projektion als Cursor gelesen, in Batches
+von ``DETECT_BATCH_SIZE`` in einem Prozess-Pool klassifiziert und mit
+``bulk_write`` zurückgeschrieben (``language`` und ``language_confidence``).
+
+Backends:
+
+- ``"langdetect"`` (Standard): ``langdetect.detect_langs``, Konfidenz ist die
+  Wahrscheinlichkeit der erkannten Sprache.
+- ``"fasttext"``: n-Gramm-Modell aus einer lokalen Datei
+  (``FASTTEXT_MODEL_PATH``, z. B. ``lid.176.ftz``), klassifiziert einen
+  ganzen Batch auf einmal und ist um ein Vielfaches schneller.
+  Benötigt ``pip install fasttext``.
+
+Neue Backends registrieren sich in ``BACKENDS`` mit einer Funktion, die eine
+Liste von Texten auf (Sprache, Konfidenz) abbildet.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from pymongo import UpdateOne
+from tqdm import tqdm
+
+LANGUAGE_BACKEND = os.environ.get("LANGUAGE_BACKEND", "langdetect")
+FASTTEXT_MODEL_PATH = os.environ.get("FASTTEXT_MODEL_PATH", "~/project/models/lid.176.ftz")
+DETECT_WORKERS = os.cpu_count() or 4
+DETECT_BATCH_SIZE = 500             # Texte pro Aufgabe im Prozess-Pool
+DETECT_MAX_CHARS = 5000             # längere Abstracts werden für die Erkennung gekürzt
+
+_model = None                       # fastText-Modell, einmal pro Prozess geladen
+
+
+def _detect_langdetect(texts: list[str]) -> list[tuple[str | None, float]]:
+    from langdetect import DetectorFactory, LangDetectException, detect_langs
+
+    DetectorFactory.seed = 0        # reproduzierbare Ergebnisse
+    results = []
+    for text in texts:
+        try:
+            candidates = detect_langs(text)
+        except LangDetectException:
+            candidates = []
+        if candidates:
+            results.append((candidates[0].lang, candidates[0].prob))
+        else:
+            results.append((None, 0.0))
+    return results
+
+
+def _detect_fasttext(texts: list[str]) -> list[tuple[str | None, float]]:
+    global _model
+    if _model is None:
+        import fasttext
+        _model = fasttext.load_model(os.path.expanduser(FASTTEXT_MODEL_PATH))
+    # fastText erwartet eine Zeile pro Text
+    labels, probabilities = _model.predict([text.replace("\n", " ") for text in texts], k=1)
+    return [(label[0].removeprefix("__label__") if label else None, float(prob[0]) if len(prob) else 0.0)
+            for label, prob in zip(labels, probabilities)]
+
+
+BACKENDS = {
+    "langdetect": _detect_langdetect,
+    "fasttext": _detect_fasttext,
+}
+
+
+def detect_languages(texts: list[str], backend: str = LANGUAGE_BACKEND) -> list[tuple[str | None, float]]:
+    """(Sprache, Konfidenz) für jeden Text; (None, 0.0), wenn nichts erkannt wurde."""
+    return BACKENDS[backend]([text[:DETECT_MAX_CHARS] for text in texts])
+
+
+def abstract_text(document: dict) -> str | None:
+    """Die ``Abstract``-Texte eines Urteils, mit Leerzeichen verbunden, oder None."""
+    abstract_field = document.get("Abstract", [])
+    if not abstract_field or not isinstance(abstract_field, list):
+        return None
+    return " ".join(entry["Text"] for entry in abstract_field
+                    if isinstance(entry, dict) and isinstance(entry.get("Text"), str))
+
+
+def detect_and_update_language(collection, query: dict | None = None, backend: str = LANGUAGE_BACKEND,
+                               workers: int = DETECT_WORKERS, batch_size: int = DETECT_BATCH_SIZE) -> int:
+    """
+    Erkennt die Sprache aller Urteile aus ``query`` (Standard: ohne
+    ``language``) und schreibt ``language`` und ``language_confidence``.
+
+    Returns:
+        Anzahl aktualisierter Urteile.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unbekanntes Backend für die Spracherkennung: {backend}")
+    query = query if query is not None else {"language": {"$exists": False}}
+    total_documents = collection.count_documents(query)
+    cursor = collection.find(query, {"Abstract.Text": 1})
+
+    updated = 0
+
+    def write(ids, future):
+        # Ein fehlerhafter Batch wird protokolliert, die übrigen laufen weiter
+        nonlocal updated
+        try:
+            ops = []
+            for doc_id, (language, confidence) in zip(ids, future.result()):
+                if language is None:
+                    print(f"Could not detect language for document {doc_id}")
+                    continue
+                ops.append(UpdateOne({"_id": doc_id},
+                                     {"$set": {"language": language, "language_confidence": round(confidence, 4)}}))
+            if ops:
+                collection.bulk_write(ops, ordered=False)
+                updated += len(ops)
+        except Exception as e:
+            print(f"Error processing batch of {len(ids)} documents starting at {ids[0]}: {str(e)}")
+        pbar.update(len(ids))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, \
+            tqdm(total=total_documents, desc="Detecting languages", unit="doc") as pbar:
+        pending = []        # (ids, future), höchstens 2 * workers gleichzeitig
+        ids, texts = [], []
+        for document in cursor:
+            try:
+                text = abstract_text(document)
+            except Exception as e:
+                print(f"Error processing document {document['_id']}: {str(e)}")
+                pbar.update(1)
+                continue
+            if not text:
+                print(f"No suitable text found for document {document['_id']}")
+                pbar.update(1)
+                continue
+            ids.append(document["_id"])
+            texts.append(text)
+            if len(texts) >= batch_size:
+                pending.append((ids, pool.submit(detect_languages, texts, backend)))
+                ids, texts = [], []
+                if len(pending) >= 2 * workers:
+                    write(*pending.pop(0))
+        if texts:
+            pending.append((ids, pool.submit(detect_languages, texts, backend)))
+        for batch_ids, future in pending:
+            write(batch_ids, future)
+
+    logging.info(f"Sprache für {updated} Urteile gesetzt ({backend})")
+    return updated
@@ -0,0 +1,90 @@
+"""
+mongo_essentials.py
+
+Gemeinsamer MongoDB-Client für alle Skripte.
+
+``MongoClient`` verwaltet intern einen Verbindungs-Pool und ist thread-safe;
+er soll pro Prozess nur einmal erzeugt werden. ``get_client`` liefert diesen
+einen Client (nach einem ``fork`` wird im Kindprozess ein neuer angelegt, da
+Clients nicht fork-sicher sind). Pool-Größe und Timeouts werden hier zentral
+eingestellt.
+
+``connect_to_mongo`` bleibt als Kurzform für die Urteils-Collection erhalten.
+"""
+
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import threading
+
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017/")
+DB_NAME = "court_decisions"
+JUDGMENTS_COLLECTION = "judgments"
+
+# Verbindungs-Pool: Flask-Threads, GPU-Worker und Prefetch-Threads teilen sich einen Client
+MONGO_MAX_POOL_SIZE = 50
+MONGO_MIN_POOL_SIZE = 2
+MONGO_MAX_IDLE_TIME_MS = 300_000
+MONGO_SERVER_SELECTION_TIMEOUT_MS = 5000
+MONGO_CONNECT_TIMEOUT_MS = 5000
+MONGO_SOCKET_TIMEOUT_MS = None      # None = kein Timeout (lange Aggregationen)
+
+_client: MongoClient | None = None
+_client_pid: int | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    """Liefert den prozessweiten ``MongoClient`` (wird beim ersten Aufruf erzeugt)."""
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            try:
+                _client = MongoClient(
+                    MONGO_URI,
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                )
+            except Exception as e:
+                logging.error(f"Fehler bei der Verbindung zu MongoDB: {e}")
+                raise
+            _client_pid = os.getpid()
+    return _client
+
+
+def get_database(name: str = DB_NAME) -> Database:
+    return get_client()[name]
+
+
+def get_collection(name: str = JUDGMENTS_COLLECTION) -> Collection:
+    return get_database()[name]
+
+
+def connect_to_mongo() -> Collection:
+    """Collection ``court_decisions.judgments`` über den gemeinsamen Client."""
+    return get_collection(JUDGMENTS_COLLECTION)
+
+
+def close_client():
+    """Schließt den Client (z. B. am Prozessende); ein späterer Aufruf erzeugt einen neuen."""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+atexit.register(close_client)
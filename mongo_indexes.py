@@ -0,0 +1,137 @@
+"""
+mongo_indexes.py
+
+Indexe der Collection ``court_decisions.judgments``.
+
+``ensure_indexes`` legt alle unten deklarierten Indexe an (idempotent, kann
+bei jedem Start aufgerufen werden) und prüft anschließend über den
+Explain-Plan, ob die typischen Abfragen des Projekts noch einen Collection
+Scan brauchen. Neue Zugriffspfade gehören in ``INDEXES`` und
+``TYPICAL_QUERIES``.
+"""
+
+from __future__ import annotations
+
+import logging
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+INDEXES = [
+    # Kandidatenauswahl der Läufe, serverseitig nach Größe sortiert
+    IndexModel([("selected_for_smaller_experiment", ASCENDING), ("num_characters", ASCENDING)],
+               name="smaller_experiment_size"),
+    IndexModel([("selected_for_experiment", ASCENDING), ("num_characters", ASCENDING)],
+               name="experiment_size"),
+    IndexModel([("language", ASCENDING), ("num_characters", ASCENDING)],
+               name="language_size"),
+    # Annotationsseite und Export
+    IndexModel([("language", ASCENDING), ("selected_for_annotation", ASCENDING)],
+               name="language_annotation"),
+    IndexModel([("selected_for_annotation", ASCENDING)], name="annotation"),
+    # Skip-Logik und Fortschritt pro Run (Multikey über ollama_responses)
+    IndexModel([("selected_for_smaller_experiment", ASCENDING), ("ollama_responses.run_id", ASCENDING)],
+               name="smaller_experiment_run"),
+    IndexModel([("language", ASCENDING), ("ollama_responses.run_id", ASCENDING)],
+               name="language_run"),
+    IndexModel([("ollama_responses.run_id", ASCENDING)], name="run"),
+    # Biases und Annotationen (Bias-IDs sind nur zusammen mit dem Run eindeutig)
+    IndexModel([("ollama_responses.response.biases.id", ASCENDING),
+                ("ollama_responses.response.biases.run_id", ASCENDING)],
+               name="bias_id_run"),
+    IndexModel([("ollama_responses.response.biases.annotations.annotator", ASCENDING)],
+               name="annotator"),
+    # Import der mehrsprachigen Urteile (Duplikatprüfung, fortlaufende id)
+    IndexModel([("origin_url", ASCENDING)], name="origin_url", unique=True,
+               partialFilterExpression={"origin_url": {"$type": "string"}}),
+    IndexModel([("id", DESCENDING)], name="id",
+               partialFilterExpression={"id": {"$exists": True}}),
+    # Crawl: fehlgeschlagene Urteile beim Fortsetzen erneut versuchen
+    IndexModel([("crawl.status", ASCENDING)], name="crawl_status",
+               partialFilterExpression={"crawl.status": {"$exists": True}}),
+]
+
+# Typische Abfragen (Filter, Sortierung), die ohne Collection Scan auskommen sollen
+TYPICAL_QUERIES = {
+    "Kandidaten Bias-Check (deutsch)": (
+        {"selected_for_smaller_experiment": True, "ollama_responses.run_id": {"$ne": 5}},
+        [("num_characters", ASCENDING)]),
+    "Kandidaten Bias-Check (mehrsprachig)": (
+        {"language": "English", "ollama_responses.run_id": {"$ne": 9}},
+        [("num_characters", ASCENDING)]),
+    "Fortschritt pro Run": ({"ollama_responses.run_id": 5, "selected_for_smaller_experiment": True}, None),
+    "Annotationsseite": ({"selected_for_annotation": True, "ollama_responses.run_id": {"$in": [9]}}, None),
+    "Export pro Sprache": ({"language": "English", "selected_for_annotation": True}, None),
+    "Bias per ID": ({"ollama_responses.response.biases.id": 1, "ollama_responses.response.biases.run_id": 9}, None),
+    "Annotationen pro Annotator": ({"ollama_responses.response.biases.annotations.annotator": "Kilian Lüders"}, None),
+    "Duplikatprüfung Import": ({"origin_url": "https://example.org"}, None),
+    "Längste Urteile": ({"selected_for_experiment": True}, [("num_characters", DESCENDING)]),
+}
+
+
+def ensure_indexes(collection, report: bool = True) -> list[str]:
+    """
+    Legt alle Indexe aus ``INDEXES`` an. Bereits vorhandene werden übersprungen;
+    Konflikte (z. B. doppelte origin_url) werden protokolliert, brechen den
+    Start aber nicht ab.
+
+    Returns:
+        Namen der vorhandenen bzw. angelegten Indexe.
+    """
+    created = []
+    for index in INDEXES:
+        try:
+            created.extend(collection.create_indexes([index]))
+        except OperationFailure as e:
+            logging.warning(f"Index {index.document['name']} konnte nicht angelegt werden: {e}")
+
+    if report:
+        report_unindexed_queries(collection)
+    return created
+
+
+def _stages(plan: dict):
+    """Alle Stages eines Explain-Plans (rekursiv)."""
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+def report_unindexed_queries(collection, queries: dict = TYPICAL_QUERIES) -> list[str]:
+    """
+    Prüft die Explain-Pläne der typischen Abfragen und meldet jene, die einen
+    Collection Scan (COLLSCAN) brauchen, mit ihrer Laufzeit.
+
+    Returns:
+        Namen der Abfragen ohne passenden Index.
+    """
+    unindexed = []
+    for name, (query, sort) in queries.items():
+        cursor = collection.find(query, {"_id": 1})
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            explain = cursor.explain()
+        except OperationFailure as e:
+            logging.warning(f"Explain für '{name}' fehlgeschlagen: {e}")
+            continue
+
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        if "COLLSCAN" in set(_stages(winning_plan)):
+            millis = explain.get("executionStats", {}).get("executionTimeMillis")
+            unindexed.append(name)
+            logging.warning(f"Abfrage ohne Index: '{name}' ({millis} ms) {query}")
+    return unindexed
+
+
+if __name__ == "__main__":
+    from prepare_data import connect_to_mongo
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    judgments = connect_to_mongo()
+    print(f"Indexe: {ensure_indexes(judgments, report=False)}")
+    missing = report_unindexed_queries(judgments)
+    print("Alle typischen Abfragen nutzen einen Index." if not missing else f"Ohne Index: {missing}")
@@ -0,0 +1,160 @@
+"""
+mongo_write_buffer.py
+
+Write-behind-Puffer für Mongo-Updates aus den Inferenzschleifen.
+
+Statt pro Urteil ein eigenes ``update_one`` abzusetzen, sammelt
+``BulkWriteBuffer`` die Updates und schreibt sie gebündelt als ungeordnetes
+``bulk_write``:
+
+- sobald ``max_ops`` Updates anstehen,
+- spätestens nach ``max_delay`` Sekunden (Hintergrund-Thread),
+- beim Schließen (Ende der Schleife, Stop-Flag, Prozessende über atexit).
+
+Fehlgeschlagene Updates bleiben im Puffer und werden beim nächsten Flush
+erneut versucht. Was sich auch beim Schließen nicht schreiben lässt, wird in
+``FAILED_WRITES_FILE`` gesichert und kann mit ``replay_failed_writes``
+nachgetragen werden.
+"""
+
+from __future__ import annotations
+
+import atexit
+import logging
+import threading
+import time
+
+from bson import json_util
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+BULK_WRITE_MAX_OPS = 50
+BULK_WRITE_MAX_DELAY = 10          # Sekunden
+CLOSE_RETRIES = 3
+FAILED_WRITES_FILE = "failed_writes.jsonl"
+
+
+class BulkWriteBuffer:
+    """
+    Sammelt ``update_one``-Aufrufe und schreibt sie gebündelt.
+    Als Kontextmanager verwendbar; ``close`` schreibt alles Ausstehende.
+    """
+
+    def __init__(self, collection, max_ops: int = BULK_WRITE_MAX_OPS,
+                 max_delay: float = BULK_WRITE_MAX_DELAY):
+        self.collection = collection
+        self.max_ops = max_ops
+        self.max_delay = max_delay
+
+        self._ops: list[tuple[dict, dict]] = []
+        self._lock = threading.Lock()           # schützt _ops
+        self._flush_lock = threading.Lock()     # nur ein Flush gleichzeitig
+        self._closed = threading.Event()
+
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True,
+                                         name="mongo-write-buffer")
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._ops)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def update_one(self, filter: dict, update: dict):
+        """Wie ``collection.update_one``, aber gepuffert."""
+        if self._closed.is_set():
+            raise RuntimeError("BulkWriteBuffer ist bereits geschlossen")
+        with self._lock:
+            self._ops.append((filter, update))
+            full = len(self._ops) >= self.max_ops
+        if full:
+            self.flush()
+
+    def push_unique(self, doc_id, array_field: str, value, key: str = "id"):
+        """
+        ``$push`` eines Eintrags, der bei einer Wiederholung (z. B. nach einem
+        Verbindungsabbruch mitten im Bulk) nicht doppelt geschrieben wird.
+        """
+        filter = {"_id": doc_id}
+        if isinstance(value, dict) and key in value:
+            filter[f"{array_field}.{key}"] = {"$ne": value[key]}
+        self.update_one(filter, {"$push": {array_field: {"$each": [value]}}})
+
+    def flush(self) -> bool:
+        """
+        Schreibt alle ausstehenden Updates.
+
+        Returns:
+            True, wenn danach nichts mehr aussteht.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._ops = self._ops, []
+            if not batch:
+                return True
+
+            failed = self._write(batch)
+            if failed:
+                with self._lock:
+                    self._ops[:0] = failed     # vorne wieder einreihen
+            return not failed
+
+    def _write(self, batch: list[tuple[dict, dict]]) -> list[tuple[dict, dict]]:
+        """Schreibt einen Batch und liefert die nicht geschriebenen Updates zurück."""
+        try:
+            self.collection.bulk_write([UpdateOne(f, u) for f, u in batch], ordered=False)
+            return []
+        except BulkWriteError as e:
+            details = e.details or {}
+            if details.get("writeConcernErrors"):
+                # Unklar, was angekommen ist; die Updates sind idempotent, also alle wiederholen
+                logging.error(f"Write-Concern-Fehler beim Bulk-Write, wiederhole {len(batch)} Updates")
+                return batch
+            failed_idx = sorted({err["index"] for err in details.get("writeErrors", [])})
+            logging.error(f"Bulk-Write: {len(failed_idx)} von {len(batch)} Updates fehlgeschlagen: "
+                          f"{details.get('writeErrors', [])[:1]}")
+            return [batch[i] for i in failed_idx]
+        except PyMongoError as e:
+            logging.error(f"Bulk-Write fehlgeschlagen, {len(batch)} Updates bleiben gepuffert: {e}")
+            return batch
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.max_delay):
+            self.flush()
+
+    def close(self):
+        """Stoppt den Hintergrund-Thread und schreibt alles Ausstehende."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._flusher.join()
+        atexit.unregister(self.close)
+
+        for attempt in range(CLOSE_RETRIES):
+            if self.flush():
+                return
+            time.sleep(2 ** attempt)
+
+        # Nichts verlieren: Rest in Datei sichern
+        with self._lock:
+            remaining, self._ops = self._ops, []
+        with open(FAILED_WRITES_FILE, "a", encoding="utf-8") as f:
+            for filter, update in remaining:
+                f.write(json_util.dumps({"filter": filter, "update": update}) + "\n")
+        logging.error(f"{len(remaining)} Updates konnten nicht geschrieben werden, "
+                      f"gesichert in {FAILED_WRITES_FILE}")
+
+
+def replay_failed_writes(collection, path: str = FAILED_WRITES_FILE) -> int:
+    """Trägt die in ``path`` gesicherten Updates nach. Gibt die Anzahl zurück."""
+    with open(path, encoding="utf-8") as f:
+        entries = [json_util.loads(line) for line in f if line.strip()]
+    if entries:
+        collection.bulk_write([UpdateOne(e["filter"], e["update"]) for e in entries], ordered=False)
+    return len(entries)
@@ -1,16 +1,41 @@
-import requests
+import asyncio
+import threading
 import time
 import subprocess
+import weakref
 
 import json
-import requests
-import time
-from requests.exceptions import Timeout, ConnectionError, HTTPError
+import re
+import httpx
 
 
 # Ollama API-Endpunkt
 OLLAMA_URLS = ["http://localhost:11434/api/generate", "http://localhost:11435/api/generate"]
 
+# Verbindungs-Pool für alle Anfragen an Ollama (Keep-Alive statt neuer TCP-Verbindung pro Urteil)
+OLLAMA_POOL_LIMITS = httpx.Limits(max_connections=16, max_keepalive_connections=8, keepalive_expiry=300)
+OLLAMA_TIMEOUT = httpx.Timeout(1200, connect=10)   # (connect, read) Timeouts
+
+# Ein Client pro Event-Loop, da httpx.AsyncClient an seinen Loop gebunden ist
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+# Streaming: Antworten, nach denen die Generierung vorzeitig beendet werden darf
+NO_BIAS_ANSWERS = ["Kein Bias", "No bias", "Không có thiên kiến", "バイアスなし"]
+_NO_BIAS_ANSWER_RE = re.compile(
+    r'^[\W_]*(?:' + "|".join(re.escape(a) for a in NO_BIAS_ANSWERS) + r')[\s"”」’\']*(?:[.。!]|\n)',
+    re.IGNORECASE,
+)
+
+# Streaming: Erkennung von Endlosschleifen (gleicher Textblock wiederholt sich im Fenster)
+REPETITION_WINDOW_CHARS = 4000
+REPETITION_PROBE_CHARS = 64
+REPETITION_MAX_REPEATS = 10
+REPETITION_CHECK_EVERY = 32   # Prüfung nur alle n Chunks
+
+# Hintergrund-Loop, über den der synchrone Wrapper alle Anfragen schickt
+_background_loop: asyncio.AbstractEventLoop | None = None
+_background_loop_lock = threading.Lock()
+
 MODELS = [
     "llama3.3",
     "llama3.2",
@@ -49,7 +74,42 @@ def is_gpu_memory_overloaded(threshold=0.9):
         return False
 
 
-def query_ollama(
+def _get_async_client() -> httpx.AsyncClient:
+    """Liefert den gepoolten Keep-Alive-Client des laufenden Event-Loops."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(limits=OLLAMA_POOL_LIMITS, timeout=OLLAMA_TIMEOUT)
+        _async_clients[loop] = client
+    return client
+
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    """Startet bei Bedarf den Event-Loop-Thread für den synchronen Wrapper."""
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, daemon=True, name="ollama-http").start()
+            _background_loop = loop
+        return _background_loop
+
+
+def _build_payload(model_name: str, prompt: str, num_ctx: int, stream: bool) -> dict:
+    return {
+        "model": model_name,
+        "prompt": prompt,
+        "stream": stream,
+        "options": {
+            "temperature": 0,
+            "seed": 0,
+            "num_ctx": num_ctx,
+            "max_tokens": 2048,
+        },
+    }
+
+
+async def query_ollama_async(
         model_name: str,
         prompt: str,
         gpu_nr: int = 0,
@@ -60,28 +120,16 @@ def query_ollama(
     """
     Fragt die Ollama-API bis zu `max_retries`-mal ab.
     Bricht vorher ab, sobald eine gültige Antwort vorliegt.
+    Wartezeiten zwischen den Versuchen blockieren nur diese Anfrage, nicht den Prozess.
     """
 
-    payload = {
-        "model": model_name,
-        "prompt": prompt,
-        "stream": False,
-        "options": {
-            "temperature": 0,
-            "seed": 0,
-            "num_ctx": num_ctx,
-            "max_tokens": 2048,
-        },
-    }
+    payload = _build_payload(model_name, prompt, num_ctx, stream=False)
 
+    client = _get_async_client()
     for attempt in range(1, max_retries + 1):
         try:
-            resp = requests.post(
-                OLLAMA_URLS[gpu_nr],
-                json=payload,
-                timeout=(10, 1200),        # (connect, read) Timeouts
-            )
-            resp.raise_for_status()        # wirft HTTPError bei 4xx/5xx
+            resp = await client.post(OLLAMA_URLS[gpu_nr], json=payload)
+            resp.raise_for_status()        # wirft HTTPStatusError bei 4xx/5xx
 
             data = resp.json()             # wirft JSONDecodeError bei Ungültigem
             answer = data.get("response", "")
@@ -89,7 +137,7 @@ def query_ollama(
                 return answer
             raise ValueError("Leere Antwort erhalten")
 
-        except (Timeout, ConnectionError, HTTPError,
+        except (httpx.TimeoutException, httpx.TransportError, httpx.HTTPStatusError,
                 ValueError, json.JSONDecodeError) as err:
 
             if attempt == max_retries:
@@ -98,7 +146,201 @@ def query_ollama(
             wait = backoff_base ** (attempt - 1)   # 1 s, 2 s, 4 s, 8 s …
             print(f"[{model_name}] Versuch {attempt}/{max_retries} fehlgeschlagen "
                   f"({err}). Neuer Versuch in {wait}s …")
-            time.sleep(wait)
+            await asyncio.sleep(wait)
+
+
+def query_ollama(
+        model_name: str,
+        prompt: str,
+        gpu_nr: int = 0,
+        num_ctx: int = 65_536,
+        max_retries: int = 5,
+        backoff_base: int = 2,
+):
+    """
+    Synchroner Wrapper um `query_ollama_async` für die bestehenden Aufrufer.
+    Alle Threads teilen sich den Verbindungs-Pool des Hintergrund-Loops.
+    """
+    future = asyncio.run_coroutine_threadsafe(
+        query_ollama_async(model_name, prompt, gpu_nr=gpu_nr, num_ctx=num_ctx,
+                           max_retries=max_retries, backoff_base=backoff_base),
+        _get_background_loop(),
+    )
+    return future.result()
+
+
+class _StreamMonitor:
+    """
+    Verfolgt einen Antwort-Stream Chunk für Chunk und entscheidet, ob die
+    Generierung vorzeitig beendet werden kann. Arbeitet inkrementell, damit
+    lange Reasoning-Ausgaben nicht bei jedem Token neu zusammengesetzt werden.
+    """
+
+    def __init__(self, max_reasoning_tokens: int | None, stop_on_no_bias: bool,
+                 max_repetitions: int | None):
+        self.max_reasoning_tokens = max_reasoning_tokens
+        self.stop_on_no_bias = stop_on_no_bias
+        self.max_repetitions = max_repetitions
+
+        self.parts: list[str] = []
+        self.head = ""            # Textanfang, bis feststeht, ob ein <think>-Block folgt
+        self.in_think = None      # None = noch unbekannt
+        self.think_tail = ""      # letzte Zeichen, um </think> über Chunk-Grenzen zu finden
+        self.reasoning_tokens = 0
+        self.answer_head = ""     # Anfang der eigentlichen Antwort (nach </think>)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def feed(self, token: str) -> str | None:
+        """Nimmt einen Token entgegen und liefert ggf. den Grund für einen Abbruch."""
+        self.parts.append(token)
+
+        if self.in_think is None:
+            self.head += token
+            stripped = self.head.lstrip()
+            if "<think>".startswith(stripped):
+                return None            # noch unentschieden
+            if stripped.startswith("<think>"):
+                self.in_think = True
+                token = stripped[len("<think>"):]
+            else:
+                self.in_think = False
+                self.answer_head = self.head
+                token = ""
+
+        if self.in_think:
+            self.reasoning_tokens += 1
+            combined = self.think_tail + token
+            end = combined.find("</think>")
+            if end >= 0:
+                self.in_think = False
+                self.answer_head = combined[end + len("</think>"):]
+            else:
+                self.think_tail = combined[-len("</think>"):]
+                if self.max_reasoning_tokens is not None and self.reasoning_tokens > self.max_reasoning_tokens:
+                    return "reasoning_budget"
+        elif len(self.answer_head) < 64:
+            self.answer_head += token
+
+        if self.stop_on_no_bias and not self.in_think and _NO_BIAS_ANSWER_RE.match(self.answer_head[:64]):
+            return "no_bias"
+
+        if self.max_repetitions and len(self.parts) % REPETITION_CHECK_EVERY == 0:
+            window = "".join(self.parts[-REPETITION_WINDOW_CHARS:])[-REPETITION_WINDOW_CHARS:]
+            if len(window) >= REPETITION_WINDOW_CHARS:
+                probe = window[-REPETITION_PROBE_CHARS:]
+                if window.count(probe) >= self.max_repetitions:
+                    return "repetition"
+
+        return None
+
+
+async def query_ollama_stream_async(
+        model_name: str,
+        prompt: str,
+        gpu_nr: int = 0,
+        num_ctx: int = 65_536,
+        max_reasoning_tokens: int | None = None,
+        stop_on_no_bias: bool = True,
+        max_repetitions: int | None = REPETITION_MAX_REPEATS,
+        max_retries: int = 5,
+        backoff_base: int = 2,
+):
+    """
+    Wie `query_ollama_async`, liest die Antwort aber als NDJSON-Stream und kann
+    die Generierung vorzeitig beenden (Schließen der Verbindung bricht sie in Ollama ab):
+      - max_reasoning_tokens: Budget für den <think>-Block (None = unbegrenzt)
+      - stop_on_no_bias: sobald eine vollständige "Kein Bias"-Antwort vorliegt
+      - max_repetitions: wenn sich der letzte Textblock so oft im Fenster wiederholt
+
+    Returns:
+        (antwort, stats) mit stats = {"ttft", "tokens", "tokens_per_second", "early_stop"}
+    """
+    payload = _build_payload(model_name, prompt, num_ctx, stream=True)
+    client = _get_async_client()
+
+    for attempt in range(1, max_retries + 1):
+        start_time = time.time()
+        stats = {"ttft": None, "tokens": 0, "tokens_per_second": None, "early_stop": None}
+        monitor = _StreamMonitor(max_reasoning_tokens, stop_on_no_bias, max_repetitions)
+        first_token_time = None
+
+        try:
+            async with client.stream("POST", OLLAMA_URLS[gpu_nr], json=payload) as resp:
+                resp.raise_for_status()        # wirft HTTPStatusError bei 4xx/5xx
+
+                async for line in resp.aiter_lines():
+                    if not line.strip():
+                        continue
+                    chunk = json.loads(line)   # wirft JSONDecodeError bei Ungültigem
+                    if "error" in chunk:
+                        raise ValueError(chunk["error"])
+
+                    token = chunk.get("response", "")
+                    if token:
+                        if first_token_time is None:
+                            first_token_time = time.time()
+                            stats["ttft"] = round(first_token_time - start_time, 2)
+                        stats["tokens"] += 1
+
+                        reason = monitor.feed(token)
+                        if reason:
+                            # Verlassen des Kontexts schließt die Verbindung, Ollama bricht ab
+                            stats["early_stop"] = reason
+                            break
+
+                    if chunk.get("done"):
+                        # Ollama liefert im letzten Chunk die exakten Zähler
+                        if chunk.get("eval_count") and chunk.get("eval_duration"):
+                            stats["tokens"] = chunk["eval_count"]
+                            stats["tokens_per_second"] = round(
+                                chunk["eval_count"] / (chunk["eval_duration"] / 1e9), 2)
+                        break
+
+            answer = monitor.text
+            if stats["tokens_per_second"] is None and first_token_time is not None:
+                elapsed = time.time() - first_token_time
+                if elapsed > 0:
+                    stats["tokens_per_second"] = round(stats["tokens"] / elapsed, 2)
+            if answer:                     # gültige, nicht-leere Antwort
+                return answer, stats
+            raise ValueError("Leere Antwort erhalten")
+
+        except (httpx.TimeoutException, httpx.TransportError, httpx.HTTPStatusError,
+                ValueError, json.JSONDecodeError) as err:
+
+            if attempt == max_retries:
+                return f"Fehler nach {max_retries} Versuchen: {err}", stats
+
+            wait = backoff_base ** (attempt - 1)   # 1 s, 2 s, 4 s, 8 s …
+            print(f"[{model_name}] Versuch {attempt}/{max_retries} fehlgeschlagen "
+                  f"({err}). Neuer Versuch in {wait}s …")
+            await asyncio.sleep(wait)
+
+
+def query_ollama_stream(
+        model_name: str,
+        prompt: str,
+        gpu_nr: int = 0,
+        num_ctx: int = 65_536,
+        max_reasoning_tokens: int | None = None,
+        stop_on_no_bias: bool = True,
+        max_repetitions: int | None = REPETITION_MAX_REPEATS,
+        max_retries: int = 5,
+        backoff_base: int = 2,
+):
+    """Synchroner Wrapper um `query_ollama_stream_async`, liefert (antwort, stats)."""
+    future = asyncio.run_coroutine_threadsafe(
+        query_ollama_stream_async(model_name, prompt, gpu_nr=gpu_nr, num_ctx=num_ctx,
+                                  max_reasoning_tokens=max_reasoning_tokens,
+                                  stop_on_no_bias=stop_on_no_bias,
+                                  max_repetitions=max_repetitions,
+                                  max_retries=max_retries, backoff_base=backoff_base),
+        _get_background_loop(),
+    )
+    return future.result()
 
 
 def ask(model_name, prompt):
@@ -1,28 +1,26 @@
 import logging
 from datetime import datetime
 
-from pymongo import MongoClient
-from langdetect import detect, DetectorFactory, LangDetectException
+from mongo_essentials import connect_to_mongo
 from tqdm import tqdm
 import random
 
 from check_bias import RELOAD_MODEL_IF_MEMORY_FULL, check_for_stop_flag, SKIP_PROCESSED, TEST_ONLY
 from grab_text import get_clean_text_by_id
+import text_store
+import corpus_pack
+import language_detection
+import sampling
+import bias_catalog
 from math import ceil
 
 from ollama_essentials import is_gpu_memory_overloaded, query_ollama
+from inference_scheduler import InferenceScheduler, prefetch
+from mongo_write_buffer import BulkWriteBuffer
+from context_planner import ContextPlanner
+from mongo_indexes import ensure_indexes
 
-# Seed for consistent language detection results
-DetectorFactory.seed = 0
-
-def connect_to_mongo():
-    client = MongoClient("mongodb://localhost:27017/")  # Default MongoDB port
-    db = client["court_decisions"]  # Database name
-    collection = db["judgments"]  # Collection name
-    # print("MongoDB connected and database/collection ready.")
-    return collection
-
-def select_random_german_samples(collection, sample_size=10000):
+def select_random_german_samples(collection, sample_size=10000, seed=0):
     try:
         # Query to find all German documents
         query = {"language": "de"}
@@ -32,21 +30,9 @@ def select_random_german_samples(collection, sample_size=10000):
             print(f"Not enough German documents available. Found only {total_documents}.")
             return
 
-        # Get all German document IDs
-        german_docs = collection.find(query, {"_id": 1})
-        german_doc_ids = [doc["_id"] for doc in german_docs]
-
-        # Select random sample
-        random_sample_ids = random.sample(german_doc_ids, sample_size)
-
-        # Update the selected documents
-        with tqdm(total=sample_size, desc="Selecting random samples", unit="doc") as pbar:
-            for doc_id in random_sample_ids:
-                collection.update_one(
-                    {"_id": doc_id},
-                    {"$set": {"selected_for_experiment": True}}
-                )
-                pbar.update(1)
+        # Select a reproducible random sample over an _id-only projection and flag it in chunks
+        random_sample_ids = sampling.sample_ids(collection, query, sample_size, seed=seed)
+        sampling.apply_flag(collection, random_sample_ids, "selected_for_experiment")
 
         print(f"Successfully selected {sample_size} random German documents.")
 
@@ -54,32 +40,12 @@ def select_random_german_samples(collection, sample_size=10000):
         print(f"Error selecting random samples: {str(e)}")
 
 def detect_and_update_language(collection):
+    """
+    Setzt ``language`` (und ``language_confidence``) für alle Dokumente ohne
+    Sprache, gebündelt und parallel, siehe ``language_detection``.
+    """
     try:
-        # Find all documents where the language field is missing
-        query = {"language": {"$exists": False}}
-        total_documents = collection.count_documents(query)
-        cursor = collection.find(query)
-
-        with tqdm(total=total_documents, desc="Processing documents", unit="doc") as pbar:
-            for document in cursor:
-                try:
-                    # Extract text from Abstract field
-                    abstract_field = document.get("Abstract", [])
-                    if abstract_field and isinstance(abstract_field, list):
-                        text_to_detect = " ".join([entry["Text"] for entry in abstract_field if "Text" in entry])
-                        # Detect language
-                        detected_language = detect(text_to_detect)
-                        # Update the document with the detected language
-                        collection.update_one(
-                            {"_id": document["_id"]},
-                            {"$set": {"language": detected_language}}
-                        )
-                        # print(f"Updated document {document['_id']} with language: {detected_language}")
-                    else:
-                        print(f"No suitable text found for document {document['_id']}")
-                except LangDetectException as e:
-                    print(f"Could not detect language for document {document['_id']}: {str(e)}")
-                pbar.update(1)
+        language_detection.detect_and_update_language(collection)
     except Exception as e:
         print(f"Error processing documents: {str(e)}")
 
@@ -88,13 +54,13 @@ def store_collection_text_lengths(collection):
         # Finde alle Dokumente, bei denen das Feld num_characters fehlt
         query = {}
         total_documents = collection.count_documents(query)
-        cursor = collection.find(query)
+        cursor = collection.find(query, {"_id": 1})
 
         with tqdm(total=total_documents, desc="Processing documents", unit="doc") as pbar:
             for document in cursor:
                 try:
-                    # Extrahiere den Text mit der Hilfsfunktion
-                    text = get_clean_text_by_id(document.get("_id"))
+                    # Extrahiere den Text aus dem Korpus bzw. mit der Hilfsfunktion
+                    text = corpus_pack.get_clean_text(document.get("_id"))
 
                     # Berechne die Zeichenanzahl
                     num_characters = len(text)
@@ -112,6 +78,28 @@ def store_collection_text_lengths(collection):
         print(f"Error processing documents: {str(e)}")
 
 
+def backfill_num_characters(collection, query=None):
+    """
+    Trägt num_characters für Urteile mit full_text (mehrsprachige Urteile) nach,
+    serverseitig per Update-Pipeline, damit nach Größe sortiert werden kann,
+    ohne den Text zu laden.
+    """
+    result = collection.update_many(
+        {**(query or {}), "num_characters": {"$exists": False}, "full_text": {"$exists": True}},
+        [{"$set": {"num_characters": {"$strLenCP": "$full_text"}}}]
+    )
+    if result.modified_count:
+        print(f"num_characters für {result.modified_count} Dokument(e) nachgetragen.")
+
+
+def get_full_text(collection, element_id):
+    """
+    Lädt nur den full_text eines Urteils (ohne Antworten und Summaries),
+    inline oder, nach der Migration, aus dem ``text_store``.
+    """
+    return text_store.full_text_of(collection.find_one({"_id": element_id}, {"full_text": 1}))
+
+
 def remove_selected_for_experiment():
     """
     Entfernt das Feld `selected_for_experiment` von allen Dokumenten, die nicht das Attribut `HTML` besitzen.
@@ -124,6 +112,7 @@ def remove_selected_for_experiment():
     # Entferne das Feld `selected_for_experiment`
     update = {"$unset": {"selected_for_experiment": ""}}
     result = collection.update_many(query, update)
+    bias_catalog.refresh_flagged("selected_for_experiment", collection)
 
     print(f"{result.modified_count} Dokumente aktualisiert (Feld 'selected_for_experiment' entfernt).")
 
@@ -160,6 +149,7 @@ def ensure_10000_selected():
             update_query = {"_id": {"$in": ids_to_update}}
             update = {"$set": {"selected_for_experiment": True}}
             result = collection.update_many(update_query, update)
+            bias_catalog.refresh_flags(update_query, collection)
 
             print(f"{result.modified_count} weitere Dokumente mit 'language': 'de' auf 'selected_for_experiment' gesetzt.")
         else:
@@ -182,6 +172,7 @@ def remove_selected_for_non_de():
 
     # Führe das Update aus
     result = collection.update_many(query, update)
+    bias_catalog.refresh_flagged("selected_for_experiment", collection)
 
     # Ausgabe der Ergebnisse
     print(f"{result.modified_count} Dokumente aktualisiert: `selected_for_experiment` entfernt.")
@@ -209,54 +200,23 @@ def calculate_sample_size(z_value, p, e):
     return ceil(n)
 
 
-def select_random_elements(n):
+def select_random_elements(n, seed=0, stratify_by=None):
+    """
+    Stockt ``selected_for_smaller_experiment`` auf ``n`` Elemente auf
+    (reproduzierbar über ``seed``, optional geschichtet, siehe ``sampling``).
+    Gibt die ``_id``s der neu ausgewählten Elemente zurück.
+    """
     # Verbinde mit MongoDB
     collection = connect_to_mongo()
 
-    # Zähle die Anzahl der bereits ausgewählten Elemente
-    existing_count = collection.count_documents({"selected_for_smaller_experiment": True})
-
-    # Prüfe, ob bereits genügend Elemente ausgewählt wurden
-    if existing_count >= n:
-        print(
-            f"Es sind bereits {existing_count} Elemente ausgewählt, die die Bedingung erfüllen. Es werden keine weiteren Elemente ausgewählt.")
-        return []
-
-    # Berechne die Anzahl der zusätzlichen Elemente, die ausgewählt werden sollen
-    additional_needed = n - existing_count
-    print(
-        f"{existing_count} Elemente sind bereits ausgewählt. Es werden {additional_needed} zusätzliche Elemente ausgewählt.")
-
-    # Finde alle passenden Dokumente, die noch nicht ausgewählt sind
+    # Alle passenden Dokumente (deutsch, mit HTML, mehr als 1000 Zeichen)
     query = {
         "language": "de",
         "HTML": {"$exists": True},
         "num_characters": {"$gt": 1000},
-        "selected_for_smaller_experiment": {"$ne": True}  # Nur nicht ausgewählte Elemente
     }
-    documents = list(collection.find(query))
-
-    # Überprüfe, ob genügend passende Dokumente vorhanden sind
-    if len(documents) < additional_needed:
-        print(
-            f"Warnung: Es gibt nur {len(documents)} passende Dokumente, weniger als die benötigten {additional_needed}.")
-        additional_needed = len(documents)  # Passe die Anzahl an die vorhandenen Dokumente an
-
-    # Setze den Seed für random
-    random.seed(0)
-
-    # Wähle die benötigte Anzahl zufälliger Dokumente aus
-    selected_documents = random.sample(documents, additional_needed)
-
-    # Aktualisiere die ausgewählten Dokumente in der MongoDB
-    for doc in selected_documents:
-        collection.update_one(
-            {"_id": doc["_id"]},  # Filter für das spezifische Dokument
-            {"$set": {"selected_for_smaller_experiment": True}}  # Update-Feld
-        )
-
-    print(f"{len(selected_documents)} Dokumente wurden zusätzlich ausgewählt und aktualisiert.")
-    return selected_documents
+    return sampling.draw_sample(collection, query, n, "selected_for_smaller_experiment",
+                                seed=seed, stratify_by=stratify_by)
 
 
 def remove_selection_flag():
@@ -268,13 +228,15 @@ def remove_selection_flag():
         {"selected_for_smaller_experiment": {"$exists": True}},  # Suche nach Dokumenten mit dem Flag
         {"$unset": {"selected_for_smaller_experiment": ""}}  # Entferne das Flag
     )
+    # Auswahl-Flags im Bias-Katalog aktualisieren
+    bias_catalog.refresh_flagged("selected_for_smaller_experiment", collection)
 
     print(f"Das Flag wurde bei {result.modified_count} Dokument(en) entfernt.")
 
 
 # NEUE FUNKTIONEN FÜR SUMMARY-GENERIERUNG
-def generate_summary(text, model="deepseek-r1:70b", gpu_nr=0, num_ctx=8192):
-    """Generiert eine Faktenzusammenfassung für ein Urteil."""
+def build_summary_prompt(text):
+    """Baut den Prompt für die Faktenzusammenfassung (Urteilstext steht im Prompt und wird angehängt)."""
     summary_prompt = f"""SYSTEM: Du bist ein juristischer Assistent, der Schweizer Gerichtsurteile neutral und faktenorientiert zusammenfasst.
 Extrahiere ausschließlich explizit genannte Informationen aus dem Text. Fehlende Angaben werden weggelassen.
 
@@ -318,8 +280,13 @@ Hier ist der Urteilstext:
 {text}
 """
 
+    return summary_prompt + "\n\n" + text
+
+
+def generate_summary(text, model="deepseek-r1:70b", gpu_nr=0, num_ctx=8192):
+    """Generiert eine Faktenzusammenfassung für ein Urteil."""
     try:
-        response = query_ollama(model, summary_prompt + "\n\n" + text, gpu_nr=gpu_nr, num_ctx=num_ctx)
+        response = query_ollama(model, build_summary_prompt(text), gpu_nr=gpu_nr, num_ctx=num_ctx)
         return response.strip()
     except Exception as e:
         logging.error(f"Fehler bei Summary-Generierung: {e}")
@@ -337,56 +304,62 @@ def generate_summaries(model="llama3.3"):
     if SKIP_PROCESSED:
         query["summary"] = {"$exists": False}
 
-    # Holen und sortieren der Elemente
-    elements = list(collection.find(query))
-    elements.sort(key=lambda x: x["num_characters"])
-
-    # Aufteilung in Kontextgruppen
-    context_thresholds = [8192, 16384, 32768, 65536, 131072]
-    context_buckets = {ctx: [] for ctx in context_thresholds}
-
-    for element in elements:
-        num_chars = (element["num_characters"] + 5000) // 3
-        for ctx in context_thresholds:
-            if num_chars <= ctx:
-                context_buckets[ctx].append(element)
-                break
-
-    # Verarbeitung der Gruppen
-    for ctx, bucket in context_buckets.items():
-        print(f"Verarbeite Kontextgruppe {ctx} mit {len(bucket)} Elementen")
-        random.shuffle(bucket)
+    # Holen der Elemente ohne Text, serverseitig nach num_characters sortiert
+    planner = ContextPlanner(build_summary_prompt, collection=collection)
+    elements = planner.select_candidates(collection, query)
+
+    # Aufteilung in Kontextgruppen (echte Tokenzahl von Prompt + Urteilstext)
+    context_buckets = planner.bucketize(elements, get_text=lambda element: get_clean_text_by_id(element["_id"]))
+
+    # Verarbeitung der Gruppen, verteilt auf alle konfigurierten GPUs
+    with BulkWriteBuffer(collection) as buffer:
+        scheduler = InferenceScheduler()
+        for ctx, bucket in context_buckets.items():
+            print(f"Verarbeite Kontextgruppe {ctx} mit {len(bucket)} Elementen")
+            random.shuffle(bucket)
+
+            def jobs():
+                # Texte im Voraus laden; nicht lesbare Texte werden protokolliert und übersprungen
+                texts = prefetch(bucket, lambda element: get_clean_text_by_id(element["_id"]))
+                for idx, (element, text) in enumerate(texts):
+                    # GPU-Überlastung prüfen
+                    if RELOAD_MODEL_IF_MEMORY_FULL and idx % 10 == 0 and is_gpu_memory_overloaded(threshold=0.9):
+                        current_ctx = 131072
+                        print("GPU-Überlastung - Model wird neu geladen")
+                    else:
+                        current_ctx = ctx
 
-        for idx, element in enumerate(bucket):
-            if check_for_stop_flag("/home/herzberg/project/stop.md"):
-                return
+                    yield element, text, current_ctx
 
-            # GPU-Überlastung prüfen
-            if RELOAD_MODEL_IF_MEMORY_FULL and idx % 10 == 0 and is_gpu_memory_overloaded(threshold=0.9):
-                current_ctx = 131072
-                print("GPU-Überlastung - Model wird neu geladen")
-            else:
-                current_ctx = ctx
+            def worker(job, gpu_nr):
+                element, text, current_ctx = job
+                return generate_summary(text, model=model, gpu_nr=gpu_nr, num_ctx=current_ctx)
 
-            try:
-                text = get_clean_text_by_id(element["_id"])
-                summary = generate_summary(text, model=model, num_ctx=current_ctx)
+            def on_result(job, summary, gpu_nr):
+                element = job[0]
+                try:
+                    if TEST_ONLY:
+                        print(f"\n=== Zusammenfassung für {element['_id']} ===\n{summary}\n")
+                    else:
+                        buffer.update_one(
+                            {"_id": element["_id"]},
+                            {"$set": {"summary": summary}}
+                        )
+                        print(f"{datetime.now().strftime('%H:%M:%S')} - Summary für {element['_id']} gespeichert")
 
-                if TEST_ONLY:
-                    print(f"\n=== Zusammenfassung für {element['_id']} ===\n{summary}\n")
-                else:
-                    collection.update_one(
-                        {"_id": element["_id"]},
-                        {"$set": {"summary": summary}}
-                    )
-                    print(f"{datetime.now().strftime('%H:%M:%S')} - Summary für {element['_id']} gespeichert")
+                except Exception as e:
+                    logging.error(f"Fehler bei {element['_id']}: {str(e)}")
 
-            except Exception as e:
-                logging.error(f"Fehler bei {element['_id']}: {str(e)}")
+            stopped = scheduler.run(
+                jobs(), worker, on_result,
+                should_stop=lambda: check_for_stop_flag("/home/herzberg/project/stop.md"))
+            if stopped:
+                return
 
 
 if __name__ == "__main__":
     collection = connect_to_mongo()
+    ensure_indexes(collection)
     # detect_and_update_language(collection)
     # select_random_german_samples(collection, sample_size=10000)
     # remove_selected_for_non_de()
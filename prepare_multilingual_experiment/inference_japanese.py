@@ -3,6 +3,7 @@ import time
 import logging
 from pymongo import MongoClient
 from grab_text import get_clean_text_by_id
+import text_store
 from ollama_essentials import query_ollama, is_gpu_memory_overloaded
 import re
 import uuid
@@ -199,6 +200,9 @@ def bias_check_single(model, run_id):
 
     # Elemente abrufen und nach num_characters sortieren
     elements = list(collection.find(query))
+    # full_text kann nach der Migration im text_store liegen
+    for element in elements:
+        element["full_text"] = text_store.full_text_of(element) or ""
     elements.sort(key=lambda x: len(x["full_text"]))
 
     # Aufteilen in Teilarrays nach Kontextgrößen
@@ -7,6 +7,7 @@ from tqdm import tqdm
 # Import der benötigten Funktion aus der bereitgestellten Datei grab_text.py
 # Stellen Sie sicher, dass grab_text.py im selben Verzeichnis oder im Python-Pfad liegt.
 from grab_text import get_clean_text_by_id_online
+import text_store
 
 # Logging-Konfiguration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -260,14 +261,16 @@ class TextAndPromptUpdater:
             raise TypeError(f"Object of type {o.__class__.__name__} is not JSON serializable")
 
         try:
-            # Finde ein Dokument, das das neue Feld 'full_text' enthält
-            test_element = self.collection.find_one({"full_text": {"$exists": True}})
+            # Finde ein Dokument, das das neue Feld 'full_text' enthält (inline oder im text_store)
+            test_element = self.collection.find_one(
+                {"$or": [{"full_text": {"$exists": True}}, {"text_store.full": {"$exists": True}}]})
 
             if not test_element:
                 logging.warning("Kein aktualisiertes Dokument zum Testen gefunden.")
                 return
 
             logging.info(f"Test-Element gefunden: {test_element['_id']}")
+            test_element["full_text"] = text_store.full_text_of(test_element)
             print("\n--- Vollständiges Test-Element ---")
             # Konvertiert das BSON-Dokument in einen String für eine saubere Ausgabe
             print(json.dumps(test_element, indent=2, default=json_default, ensure_ascii=False))
@@ -1,19 +1,8 @@
 import json
-from pymongo import MongoClient
+from mongo_essentials import connect_to_mongo
+from bias_catalog import rebuild_catalog
 import os
 
-def connect_to_mongo():
-    """Stellt eine Verbindung zur MongoDB her und gibt die Collection zurück."""
-    try:
-        client = MongoClient("mongodb://localhost:27017/", serverSelectionTimeoutMS=5000)
-        db = client["court_decisions"]
-        collection = db["judgments"]
-        print("✅ Erfolgreich mit MongoDB verbunden.")
-        return collection
-    except Exception as e:
-        print(f"❌ Fehler bei der Verbindung zu MongoDB: {e}")
-        raise
-
 def add_selection_flag_for_kilian():
     """
     Fügt allen Dokumenten, die eine Annotation von 'Kilian Lüders' enthalten,
@@ -42,6 +31,8 @@ def add_selection_flag_for_kilian():
     try:
         result = collection.update_many(query, update)
         print(f"✅ Erfolgreich! {result.modified_count} Dokument(e) wurden markiert.")
+        # Auswahl-Flags im Bias-Katalog aktualisieren
+        rebuild_catalog(query)
     except Exception as e:
         print(f"❌ Fehler beim Aktualisieren der Dokumente: {e}")
 
@@ -1,5 +1,6 @@
 from pymongo import MongoClient
 from prepare_data import connect_to_mongo  # Wiederverwendung der Verbindungsfunktion
+from bias_catalog import refresh_flags
 
 
 def set_annotation_flag_for_languages(languages):
@@ -29,6 +30,8 @@ def set_annotation_flag_for_languages(languages):
         # Führt das Update für alle passenden Dokumente aus
         print(f"Suche nach Dokumenten mit den Sprachen: {', '.join(languages)}...")
         result = collection.update_many(query, update)
+        # Auswahl-Flags im Bias-Katalog aktualisieren
+        refresh_flags(query, collection)
 
         # Gibt das Ergebnis aus
         print(f"Aktualisierung abgeschlossen. {result.modified_count} Dokument(e) wurden aktualisiert.")
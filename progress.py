@@ -0,0 +1,208 @@
+"""
+progress.py
+
+Fortschritt, Durchsatz und Restzeit der Inferenzschleifen.
+
+Der Zähler wird einmal beim Start aus Mongo übernommen und danach lokal
+hochgezählt; pro Element ist keine Datenbankabfrage mehr nötig. Die Zahlen
+werden nach jedem Element als JSON in ``METRICS_FILE`` geschrieben und können
+optional über einen kleinen HTTP-Endpunkt (``GET /metrics``) abgefragt werden.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_FILE = "progress_metrics.json"
+METRICS_PORT = None         # z. B. 9109; None = kein HTTP-Endpunkt
+LATENCY_WINDOW = 20         # Elemente für gleitenden Durchschnitt und Durchsatz
+
+
+class ProgressTracker:
+    """
+    Zählt verarbeitete Elemente eines Laufs und schätzt die Restzeit pro
+    Kontext-Bucket und insgesamt.
+    """
+
+    def __init__(self, name: str, done: int = 0, total: int | None = None,
+                 metrics_file: str | None = METRICS_FILE, metrics_port: int | None = METRICS_PORT,
+                 window: int = LATENCY_WINDOW):
+        """
+        Args:
+            name: Bezeichnung des Laufs (z. B. "Run 5").
+            done: Bereits verarbeitete Elemente (einmalig aus der DB gezählt).
+            total: Anzahl Elemente, die in diesem Lauf noch anstehen.
+            metrics_file: JSON-Datei für das Monitoring (None = keine).
+            metrics_port: Port für ``GET /metrics`` (None = kein Server).
+            window: Anzahl Elemente für gleitende Mittelwerte.
+        """
+        self.name = name
+        self.done = done
+        self.total = total
+        self.metrics_file = metrics_file
+
+        self.completed = 0                      # in diesem Lauf verarbeitet
+        self.started = time.time()
+        self.bucket_ctx = None
+        self.bucket_size = 0
+        self.bucket_done = 0
+        self.per_gpu: dict[int, int] = {}
+
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._finished_at: deque[float] = deque(maxlen=window + 1)
+        self._lock = threading.Lock()
+
+        self._server = None
+        if metrics_port is not None:
+            self._start_server(metrics_port)
+
+    # ------------------------------------------------------------------ #
+    def start_bucket(self, ctx: int, size: int):
+        with self._lock:
+            self.bucket_ctx = ctx
+            self.bucket_size = size
+            self.bucket_done = 0
+        self.write_metrics()
+
+    def record(self, latency: float, gpu_nr: int | None = None):
+        """Ein Element ist fertig; ``latency`` ist die Dauer der Modellabfrage in Sekunden."""
+        now = time.time()
+        with self._lock:
+            self.done += 1
+            self.completed += 1
+            self.bucket_done += 1
+            if gpu_nr is not None:
+                self.per_gpu[gpu_nr] = self.per_gpu.get(gpu_nr, 0) + 1
+            self._latencies.append(latency)
+            self._finished_at.append(now)
+        self.write_metrics()
+
+    # ------------------------------------------------------------------ #
+    @property
+    def avg_latency(self) -> float | None:
+        """Gleitender Durchschnitt der Abfragedauer (Sekunden)."""
+        if not self._latencies:
+            return None
+        return sum(self._latencies) / len(self._latencies)
+
+    @property
+    def throughput(self) -> float | None:
+        """Fertige Elemente pro Stunde über die letzten Elemente (alle GPUs zusammen)."""
+        if len(self._finished_at) >= 2:
+            span = self._finished_at[-1] - self._finished_at[0]
+            count = len(self._finished_at) - 1
+        else:
+            span = time.time() - self.started
+            count = self.completed
+        if count == 0 or span <= 0:
+            return None
+        return count / span * 3600
+
+    def _eta(self, remaining: int) -> float | None:
+        rate = self.throughput
+        if rate is None:
+            return None
+        return remaining / rate * 3600
+
+    @property
+    def bucket_eta(self) -> float | None:
+        """Geschätzte Restzeit des aktuellen Buckets in Sekunden."""
+        return self._eta(max(self.bucket_size - self.bucket_done, 0))
+
+    @property
+    def total_eta(self) -> float | None:
+        """Geschätzte Restzeit des gesamten Laufs in Sekunden."""
+        if self.total is None:
+            return None
+        return self._eta(max(self.total - self.completed, 0))
+
+    # ------------------------------------------------------------------ #
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "timestamp": time.time(),
+                "done": self.done,
+                "completed_this_run": self.completed,
+                "total_this_run": self.total,
+                "bucket_ctx": self.bucket_ctx,
+                "bucket_done": self.bucket_done,
+                "bucket_size": self.bucket_size,
+                "per_gpu": {str(k): v for k, v in self.per_gpu.items()},
+                "avg_latency_s": self.avg_latency,
+                "throughput_per_hour": self.throughput,
+                "bucket_eta_s": self.bucket_eta,
+                "total_eta_s": self.total_eta,
+            }
+
+    def status_line(self, elapsed: float | None = None, gpu_nr: int | None = None) -> str:
+        """Konsolenzeile im bisherigen Format, ergänzt um Durchsatz und Restzeit."""
+        line = f"{datetime.now().strftime('%H:%M:%S')} - Verarbeitete Elemente für {self.name}: {self.done}"
+        if elapsed is not None:
+            line += f" in {elapsed}s"
+        if gpu_nr is not None:
+            line += f" (GPU {gpu_nr})"
+        if self.avg_latency is not None:
+            line += f" | Ø {self.avg_latency:.1f}s"
+        if self.throughput is not None:
+            line += f" | {self.throughput:.0f}/h"
+        if self.bucket_eta is not None:
+            line += f" | Bucket {self.bucket_done}/{self.bucket_size}, noch {_format_duration(self.bucket_eta)}"
+        if self.total_eta is not None:
+            line += f" | gesamt noch {_format_duration(self.total_eta)}"
+        return line
+
+    def write_metrics(self):
+        if self.metrics_file is None:
+            return
+        tmp_path = f"{self.metrics_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, self.metrics_file)     # atomar, Leser sehen nie halbe Dateien
+
+    # ------------------------------------------------------------------ #
+    def _start_server(self, port: int):
+        tracker = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = json.dumps(tracker.snapshot()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass        # keine Zeile pro Abfrage in der Konsole
+
+        self._server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="metrics-http").start()
+
+    def close(self):
+        self.write_metrics()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{secs:02d}s"
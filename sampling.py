@@ -0,0 +1,180 @@
+"""
+sampling.py
+
+Reproduzierbare Stichproben für die Experiment-Flags
+(``selected_for_experiment``, ``selected_for_smaller_experiment``, ...).
+
+Gezogen wird über eine ``_id``-Projektion: jede ``_id`` bekommt den Rang
+``blake2b(f"{seed}:{_id}")``, ausgewählt werden die kleinsten Ränge. Dieselbe
+Abfrage mit demselben Seed ergibt also immer dieselbe Stichprobe, unabhängig
+von der Reihenfolge, in der Mongo die Dokumente liefert; wird eine Stichprobe
+aufgestockt, bleiben die bisherigen Elemente erhalten. Mit ``method="sample"``
+zieht stattdessen der Server per ``$sample`` (schneller, nicht reproduzierbar).
+
+Optional geschichtet (``stratify_by``): nach einem Feld wie ``court`` oder
+``language`` oder mit ``"length"`` nach ``num_characters`` in
+``LENGTH_BINS``. Die Schichtgrößen werden serverseitig gezählt, die
+Stichprobe proportional darauf verteilt (größter Rest). Beim Aufstocken
+richten sich die Quoten nach der ganzen Abfrage; bereits markierte Dokumente
+werden von der Quote ihrer Schicht abgezogen.
+
+Flags werden mit einem ``update_many({_id: {$in: ...}})`` je
+``FLAG_CHUNK_SIZE`` IDs gesetzt und in den Bias-Katalog übernommen.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import heapq
+from bisect import bisect_right
+
+import bias_catalog
+
+FLAG_CHUNK_SIZE = 10_000
+LENGTH_BINS = [0, 5_000, 20_000, 50_000, 100_000]     # Untergrenzen der Längenschichten (Zeichen)
+DEFAULT_SEED = 0
+
+
+def rank(doc_id, seed: int = DEFAULT_SEED) -> int:
+    """Reproduzierbarer Zufallsrang einer ``_id``."""
+    return int.from_bytes(hashlib.blake2b(f"{seed}:{doc_id}".encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _stratum_key(stratify_by: str | None):
+    if stratify_by is None:
+        return lambda doc: None
+    if stratify_by == "length":
+        return lambda doc: LENGTH_BINS[max(bisect_right(LENGTH_BINS, doc.get("num_characters") or 0) - 1, 0)]
+    return lambda doc: doc.get(stratify_by)
+
+
+def _stratum_counts(collection, query: dict, stratify_by: str) -> dict:
+    if stratify_by == "length":
+        group = {"$bucket": {"groupBy": {"$ifNull": ["$num_characters", 0]},
+                             "boundaries": LENGTH_BINS + [float("inf")],
+                             "output": {"count": {"$sum": 1}}}}
+    else:
+        group = {"$group": {"_id": f"${stratify_by}", "count": {"$sum": 1}}}
+    return {row["_id"]: row["count"] for row in collection.aggregate([{"$match": query}, group])}
+
+
+def _stratum_match(stratify_by: str, stratum) -> dict:
+    if stratify_by != "length":
+        return {stratify_by: stratum}
+    position = LENGTH_BINS.index(stratum)
+    if position == 0:
+        # unterste Schicht inklusive Dokumente ohne num_characters
+        return {"num_characters": {"$not": {"$gte": LENGTH_BINS[1]}}}
+    if position == len(LENGTH_BINS) - 1:
+        return {"num_characters": {"$gte": stratum}}
+    return {"num_characters": {"$gte": stratum, "$lt": LENGTH_BINS[position + 1]}}
+
+
+def allocate(counts: dict, size: int) -> dict:
+    """Verteilt ``size`` proportional auf die Schichten (Verfahren des größten Restes)."""
+    total = sum(counts.values())
+    if total <= size:
+        return dict(counts)
+    quotas = {stratum: size * count / total for stratum, count in counts.items()}
+    allocation = {stratum: int(quota) for stratum, quota in quotas.items()}
+    remaining = size - sum(allocation.values())
+    for stratum in sorted(quotas, key=lambda s: (quotas[s] - allocation[s], str(s)), reverse=True)[:remaining]:
+        allocation[stratum] += 1
+    return allocation
+
+
+def sample_ids(collection, query: dict, size: int, seed: int = DEFAULT_SEED,
+               stratify_by: str | None = None, method: str = "hash", quotas: dict | None = None) -> list:
+    """
+    Zieht höchstens ``size`` ``_id``s aus ``query``.
+
+    Args:
+        seed: Seed der Rangfunktion (nur ``method="hash"``).
+        stratify_by: Feldname, ``"length"`` oder None.
+        method: ``"hash"`` (reproduzierbar) oder ``"sample"`` (``$sample`` auf dem Server).
+        quotas: Vorgegebene Anzahl je Schicht (Standard: proportional zu ``query``).
+    """
+    if size <= 0:
+        return []
+    if stratify_by is None:
+        quotas = {None: size}
+    elif quotas is None:
+        quotas = allocate(_stratum_counts(collection, query, stratify_by), size)
+
+    if method == "sample":
+        ids = []
+        for stratum, quota in quotas.items():
+            match = query if stratify_by is None else {"$and": [query, _stratum_match(stratify_by, stratum)]}
+            if quota:
+                ids += [doc["_id"] for doc in collection.aggregate(
+                    [{"$match": match}, {"$sample": {"size": quota}}, {"$project": {"_id": 1}}])]
+        return ids
+    if method != "hash":
+        raise ValueError(f"Unbekannte Stichprobenmethode: {method}")
+
+    # Pro Schicht die ``quota`` kleinsten Ränge (Max-Heap über negierte Ränge),
+    # nur _id und das Schichtfeld werden gelesen
+    key = _stratum_key(stratify_by)
+    projection = {"_id": 1}
+    if stratify_by == "length":
+        projection["num_characters"] = 1
+    elif stratify_by is not None:
+        projection[stratify_by] = 1
+    heaps: dict = {stratum: [] for stratum in quotas}
+    for doc in collection.find(query, projection):
+        stratum = key(doc)
+        quota = quotas.get(stratum, 0)
+        if not quota:
+            continue
+        negated = -rank(doc["_id"], seed)
+        heap = heaps[stratum]
+        if len(heap) < quota:
+            heapq.heappush(heap, (negated, doc["_id"]))
+        elif negated > heap[0][0]:
+            heapq.heapreplace(heap, (negated, doc["_id"]))
+    return [doc_id for heap in heaps.values() for _, doc_id in sorted(heap, reverse=True)]
+
+
+def apply_flag(collection, ids: list, flag: str, value=True, chunk_size: int = FLAG_CHUNK_SIZE) -> int:
+    """Setzt ``flag`` für alle ``ids`` mit einem ``update_many`` je Chunk; gibt die Anzahl geänderter Dokumente zurück."""
+    modified = 0
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        result = collection.update_many({"_id": {"$in": chunk}}, {"$set": {flag: value}})
+        modified += result.modified_count
+        bias_catalog.refresh_flags({"_id": {"$in": chunk}}, collection)
+    return modified
+
+
+def draw_sample(collection, query: dict, size: int, flag: str, seed: int = DEFAULT_SEED,
+                stratify_by: str | None = None, method: str = "hash") -> list:
+    """
+    Stockt die Stichprobe ``flag`` aus ``query`` auf ``size`` Dokumente auf:
+    bereits markierte zählen mit (alle mit ``flag``, auch solche, die
+    ``query`` nicht mehr erfüllen), gezogen wird nur der Rest.
+
+    Geschichtet werden die Quoten aus den Schichtgrößen der ganzen ``query``
+    berechnet und die bereits markierten Dokumente je Schicht abgezogen, damit
+    die aufgestockte Stichprobe insgesamt proportional bleibt.
+
+    Returns:
+        Die neu markierten ``_id``s.
+    """
+    existing = collection.count_documents({flag: True})
+    if existing >= size:
+        print(f"Es sind bereits {existing} Elemente mit '{flag}' ausgewählt. Es werden keine weiteren Elemente ausgewählt.")
+        return []
+    needed = size - existing
+    quotas = None
+    if stratify_by is not None:
+        target = allocate(_stratum_counts(collection, query, stratify_by), size)
+        flagged = _stratum_counts(collection, {**query, flag: True}, stratify_by)
+        quotas = {stratum: max(quota - flagged.get(stratum, 0), 0) for stratum, quota in target.items()}
+        if sum(quotas.values()) > needed:
+            quotas = allocate(quotas, needed)
+    ids = sample_ids(collection, {**query, flag: {"$ne": True}}, needed, seed, stratify_by, method, quotas)
+    if len(ids) < needed:
+        print(f"Warnung: Es gibt nur {len(ids)} passende Dokumente, weniger als die benötigten {needed}.")
+    modified = apply_flag(collection, ids, flag)
+    print(f"{modified} Dokumente zusätzlich mit '{flag}' markiert ({existing} bereits vorhanden).")
+    return ids
@@ -0,0 +1,289 @@
+"""
+text_cleaning.py
+
+Bereinigung der Urteilstexte in einem Durchlauf.
+
+``clean_text_legacy`` ist die bisherige Fassung aus ``grab_text`` mit vier
+Durchläufen über den Text (NBSP entfernen, einzelne Zeilenumbrüche zu
+Leerzeichen, "Seite <Zahl>" entfernen, Leerraum zusammenfassen).
+``clean_text`` liefert dasselbe Ergebnis mit einem ``str.replace`` und einem
+einzigen Regex-Durchlauf je Textabschnitt:
+
+Nach dem Entfernen der NBSP besteht jede Stelle, die sich ändern kann, aus
+einer zusammenhängenden Folge von Leerraum und "Seite <Zahl>"-Vorkommen
+("Lauf"). Was davon übrig bleibt, hängt nur vom Lauf selbst (und den zwei
+Zeichen davor) ab:
+
+- kein Leerraum übrig (nur "Seite 3")    -> ""
+- mindestens zwei Leerraum-Zeichen          -> " "
+- genau ein Zeichen: "\\n" wird zu " ", außer nach "<Wortzeichen>." (wie
+  ``(?<!\\w\\.)\\n(?!\\n)``), andere Zeichen bleiben.
+
+Ohne Seitenzahl wird jeder Lauf, der sich ändert, zu " " – dafür reicht ein
+``sub`` mit festem Ersatz. Nur die (seltenen) Abschnitte um Seitenzahlen
+laufen über den Regex mit Callback.
+
+``clean_texts`` bereinigt viele Texte parallel in einem Prozess-Pool.
+``python text_cleaning.py`` prüft ``clean_text`` gegen die Golden-Datei
+(``--write-golden`` erzeugt sie aus ``clean_text_legacy``) und misst die
+Laufzeit beider Fassungen.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import random
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+GOLDEN_FILE = "clean_text_golden.json"
+# Gemeinsame Version der gespeicherten bereinigten Texte (text_store, document_cache,
+# corpus_pack); erhöhen, wenn sich clean_text oder die Extraktion ändert
+CLEAN_TEXT_VERSION = 1
+CLEAN_TEXTS_WORKERS = os.cpu_count() or 4
+CLEAN_TEXTS_MIN_PARALLEL = 8        # kleinere Batches laufen im aufrufenden Prozess
+# Ab einem "Seite" je so vielen Zeichen lohnt die Aufteilung in Abschnitte nicht mehr
+DENSE_PAGE_CHARS = 100
+
+_PAGE = r"Seite[ \n]\d+"            # "\n" nach "Seite" wird in der alten Fassung vorher zu " "
+_PAGE_RE = re.compile(_PAGE)
+# Läufe ohne Seitenzahl, die durch " " ersetzt werden: Mehrfach-Leerraum oder ein
+# einzelnes "\n" nicht nach "<Wortzeichen>.". Beginnt mit einer Zeichenklasse,
+# damit der Regex nur an Leerraum ansetzt.
+_WHITESPACE_RUN = re.compile(r"\s(?:\s+|(?<=\n)(?<!\w\.\n))")
+# Läufe mit Seitenzahlen (Ersatz per Callback)
+_RUN = re.compile(rf"[\sS](?:(?<=[^\S ])(?:\s|{_PAGE})*|(?<= )(?:\s|{_PAGE})+|(?<=S)eite[ \n]\d+(?:\s|{_PAGE})*)")
+_RUN_TAIL = re.compile(rf"(?:\s|{_PAGE})*")
+_TWO_NON_SPACE = re.compile(r"\S\S")
+_WORD_DOT = re.compile(r"\w\.")
+
+
+def clean_text_legacy(text):
+    """
+    Bereinigt den eingegebenen Text, indem NBSP-Zeichen, unnötige
+    Zeilenumbrüche und überflüssige Leerzeichen entfernt werden.
+    """
+    # 1. Ersetzen von NBSP-Zeichen durch reguläre Leerzeichen.
+    text = text.replace('\xa0', '')
+
+    # 2. Ersetzen von Zeilenumbrüchen, denen kein Satzzeichen (., ?, !) vorausgeht,
+    #    durch ein Leerzeichen. Dies entfernt unnötige Umbrüche innerhalb eines Satzes.
+    text = re.sub(r'(?<!\w\.)\n(?!\n)', ' ', text)
+    # Erklärung des Regex:
+    # (?<!\w\.) : Negative Lookbehind. Stellt sicher, dass das Zeichen vor dem \n kein
+    #             Buchstabe oder eine Ziffer gefolgt von einem Punkt ist.
+    # \n        : Matcht einen Zeilenumbruch.
+    # (?!\n)    : Negative Lookahead. Stellt sicher, dass der Zeilenumbruch nicht
+    #             von einem weiteren Zeilenumbruch gefolgt wird.
+
+    # 3. Entfernen des Musters "Seite <Zahl>".
+    text = re.sub(r"Seite \d+", "", text)
+
+    # 4. Ersetzen von mehreren Leerzeichen (inkl. Zeilenumbrüchen, die nicht zu Absätzen gehören)
+    #    durch ein einziges Leerzeichen.
+    text = re.sub(r'\s{2,}', ' ', text).strip()
+
+    return text
+
+
+def _single_newline(text: str, pos: int) -> str:
+    """Ersatz für ein einzelnes "\\n" an ``pos``: bleibt nur nach "<Wortzeichen>." erhalten."""
+    return "\n" if pos >= 2 and _WORD_DOT.match(text, pos - 2) else " "
+
+
+def _replace_run(match: re.Match) -> str:
+    run = match.group()
+    if "Seite" not in run:
+        if len(run) > 1:
+            return " "
+        return _single_newline(match.string, match.start()) if run == "\n" else run
+
+    # Lauf mit Seitenzahlen: nur der Leerraum zwischen ihnen bleibt übrig
+    remaining = []
+    offset = 0
+    for page in _PAGE_RE.finditer(run):
+        remaining += [(offset + i, c) for i, c in enumerate(run[offset:page.start()])]
+        offset = page.end()
+    remaining += [(offset + i, c) for i, c in enumerate(run[offset:])]
+
+    if not remaining:
+        return ""
+    if len(remaining) > 1:
+        return " "
+    index, char = remaining[0]
+    return _single_newline(match.string, match.start() + index) if char == "\n" else char
+
+
+def _page_regions(text: str):
+    """
+    Abschnitte rund um die Seitenzahlen. Jeder beginnt und endet vor zwei
+    Nicht-Leerraum-Zeichen, damit kein Lauf und kein Lookbehind über die
+    Abschnittsgrenze reicht.
+    """
+    region_start = region_end = None
+    for page in _PAGE_RE.finditer(text):
+        if region_end is not None and page.start() < region_end:
+            continue                                    # schon im vorigen Abschnitt
+        start = page.start()
+        while start > 0 and text[start - 1].isspace():
+            start -= 1
+        start -= 2
+        while start > 0 and (text[start].isspace() or text[start + 1].isspace()):
+            start -= 1
+        start = max(start, 0)
+
+        end = _RUN_TAIL.match(text, page.end()).end()
+        following = _TWO_NON_SPACE.search(text, end)
+        end = following.start() if following else len(text)
+
+        if region_end is not None and start <= region_end:
+            region_end = end
+            continue
+        if region_end is not None:
+            yield region_start, region_end
+        region_start, region_end = start, end
+    if region_end is not None:
+        yield region_start, region_end
+
+
+def clean_text(text):
+    """
+    Bereinigt den eingegebenen Text, indem NBSP-Zeichen, unnötige
+    Zeilenumbrüche, Seitenzahlen ("Seite <Zahl>") und überflüssige
+    Leerzeichen entfernt werden. Ergebnis identisch zu ``clean_text_legacy``.
+    """
+    text = text.replace("\xa0", "")
+    if text.count("Seite") * DENSE_PAGE_CHARS > len(text):
+        return _RUN.sub(_replace_run, text).strip()
+    pieces = []
+    position = 0
+    for start, end in _page_regions(text):
+        pieces.append(_WHITESPACE_RUN.sub(" ", text[position:start]))
+        pieces.append(_RUN.sub(_replace_run, text[start:end]))
+        position = end
+    pieces.append(_WHITESPACE_RUN.sub(" ", text[position:] if position else text))
+    return "".join(pieces).strip()
+
+
+def clean_texts(texts, workers: int = CLEAN_TEXTS_WORKERS, chunksize: int = 16) -> list[str]:
+    """Bereinigt viele Texte, ab ``CLEAN_TEXTS_MIN_PARALLEL`` Texten in einem Prozess-Pool."""
+    texts = list(texts)
+    if len(texts) < CLEAN_TEXTS_MIN_PARALLEL or workers <= 1:
+        return [clean_text(text) for text in texts]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(clean_text, texts, chunksize=chunksize))
+
+
+# ---------------------------------------------------------------------- #
+# Golden-Datei und Benchmark
+# ---------------------------------------------------------------------- #
+GOLDEN_CASES = [
+    "",
+    "  \n ",
+    "Satz eins.\nSatz zwei\nweiter",
+    "Abs. 1\n\nAbs. 2\n\n\nEnde",
+    "Text\xa0mit\xa0NBSP und Sei\xa0te 4 dazwischen",
+    "vorher Seite 12 nachher",
+    "vorher\nSeite\n12\nnachher",
+    "BGE 1.\nSeite 3\nweiter",
+    "x.\nSeite 3y",
+    "Seite 1Seite 2Seite 3",
+    "aSeite 3b",
+    "Seite \n3 bleibt",
+    "Tab\tbleibt, Doppel\t\tnicht",
+    "Z. 3.\n\nb",
+    "Seite 3",
+    "e.\r\nf",
+    "Nr. 5.\nSeite 7.\nSchluss",
+    "Leerraum einzeln  doppelt",
+    "Seite ٣ arabisch-indische Ziffer",
+]
+
+
+def _fuzz_cases(count: int = 2000, seed: int = 0) -> list[str]:
+    alphabet = ["a", "Z", "3", ".", " ", "\n", "\n\n", "\xa0", "\t", "\r", "Seite", "Seite ", "Sei", "te",
+                "Seite\n", "_", "ä", " ", "7", "Seite 12"]
+    rng = random.Random(seed)
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30))) for _ in range(count)]
+
+
+def _synthetic_ruling(seed: int, lines: int = 20000) -> str:
+    """Text in der Art eines aus PDF extrahierten Urteils (kurze Zeilen, alle 40 Zeilen eine Seitenzahl)."""
+    words = ("Das Gericht hat die Beschwerde abgewiesen. Der Beschwerdeführer rügt eine Verletzung "
+             "des rechtlichen Gehörs gemäss Art. 29 Abs. 2 BV.").split()
+    rng = random.Random(seed)
+    parts = []
+    for i in range(lines):
+        parts.append(" ".join(rng.choice(words) for _ in range(rng.randint(5, 12))))
+        if i % 40 == 0:
+            parts.append(f"Seite {i // 40 + 1}\n")
+    return "\n".join(parts)
+
+
+def _corpus_texts(limit: int = 200) -> list[str]:
+    from grab_text import TEXT_FILES_DIR
+
+    directory = os.path.expanduser(TEXT_FILES_DIR)
+    if not os.path.isdir(directory):
+        return []
+    texts = []
+    for name in sorted(os.listdir(directory))[:limit]:
+        with open(os.path.join(directory, name), encoding="utf-8", errors="replace") as f:
+            texts.append(f.read())
+    return texts
+
+
+def write_golden(path: str = GOLDEN_FILE):
+    """Schreibt Eingaben und Ergebnisse von ``clean_text_legacy`` als Golden-Datei."""
+    cases = GOLDEN_CASES + _fuzz_cases()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([{"input": c, "expected": clean_text_legacy(c)} for c in cases], f, ensure_ascii=False, indent=0)
+
+
+def verify_golden(path: str = GOLDEN_FILE) -> int:
+    """
+    Vergleicht ``clean_text`` mit der Golden-Datei und (falls vorhanden) mit
+    ``clean_text_legacy`` auf den Texten in ``TEXT_FILES_DIR``.
+    Gibt die Anzahl Abweichungen zurück.
+    """
+    with open(path, encoding="utf-8") as f:
+        cases = json.load(f)
+    mismatches = 0
+    for case in cases:
+        if clean_text(case["input"]) != case["expected"]:
+            mismatches += 1
+            print(f"Abweichung: {case['input']!r}")
+    for text in _corpus_texts():
+        if clean_text(text) != clean_text_legacy(text):
+            mismatches += 1
+            print(f"Abweichung im Korpus: {text[:80]!r}")
+    return mismatches
+
+
+def benchmark(texts: list[str]) -> dict:
+    results = {"texts": len(texts), "megabytes": round(sum(map(len, texts)) / 1e6, 2)}
+    for name, func in (("legacy", clean_text_legacy), ("single_pass", clean_text)):
+        start = time.perf_counter()
+        for text in texts:
+            func(text)
+        results[f"{name}_seconds"] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    clean_texts(texts)
+    results["batch_seconds"] = round(time.perf_counter() - start, 3)
+    return results
+
+
+if __name__ == "__main__":
+    if "--write-golden" in sys.argv:
+        write_golden()
+        print(f"{GOLDEN_FILE} geschrieben")
+    else:
+        errors = verify_golden()
+        print(f"{errors} Abweichungen")
+        texts = _corpus_texts() or [_synthetic_ruling(seed) for seed in range(20)]
+        for key, value in benchmark(texts).items():
+            print(f"{key}: {value}")
+        sys.exit(1 if errors else 0)
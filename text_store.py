@@ -0,0 +1,257 @@
+"""
+text_store.py
+
+Ein Speicher für die Urteilstexte, getrennt von den Urteilsdokumenten.
+
+Jedes Urteil hat höchstens ein Dokument in ``TEXT_STORE_COLLECTION`` (gleiche
+``_id`` wie das Urteil) mit bis zu zwei Texten:
+
+- ``clean``: bereinigter Text (``text_cleaning.clean_text``), für die
+  deutschen Urteile aus den Textdateien in ``TEXT_FILES_DIR``
+- ``full``: ``full_text`` der mehrsprachigen Urteile, unverändert
+
+Texte werden zlib-komprimiert als Binärfeld gespeichert; ist das Ergebnis
+größer als ``INLINE_MAX_BYTES``, liegt es in GridFS (``GRIDFS_BUCKET``) und
+das Dokument verweist nur darauf. Im Urteil selbst stehen danach nur
+``text_store.<Art>`` (Version) und ``num_characters``; der mehrere MB große
+``full_text`` kann bei der Migration aus dem Urteil entfernt werden
+(``--unset-inline``), sodass Abfragen über die Urteile ihn nicht mehr
+mitlesen. Standardmäßig bleibt die Inline-Kopie erhalten; entfernt werden
+sollte sie erst, wenn alle Leser über ``full_text_of``/``get_full_text``
+gehen.
+
+    python text_store.py --german                       # Textdateien -> clean
+    python text_store.py --full-text [--unset-inline]   # full_text -> full
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import sys
+import zlib
+
+from bson import Binary
+from gridfs import GridFSBucket
+from gridfs.errors import NoFile
+from pymongo import UpdateOne
+
+from mongo_essentials import connect_to_mongo, get_collection, get_database
+from text_cleaning import CLEAN_TEXT_VERSION, clean_texts
+
+TEXT_STORE_COLLECTION = "judgment_texts"
+GRIDFS_BUCKET = "judgment_texts_fs"
+INLINE_MAX_BYTES = 8 * 1024 ** 2    # komprimiert; darüber GridFS (Dokumentlimit 16 MB)
+COMPRESSION_LEVEL = 6
+FETCH_BATCH_SIZE = 100              # Texte pro Lesezugriff
+MIGRATION_BATCH_SIZE = 200          # Urteile pro Migrationsschritt
+TEXT_KINDS = ("clean", "full")
+
+_bucket: GridFSBucket | None = None
+
+
+def _texts():
+    return get_collection(TEXT_STORE_COLLECTION)
+
+
+def _gridfs() -> GridFSBucket:
+    global _bucket
+    if _bucket is None:
+        _bucket = GridFSBucket(get_database(), bucket_name=GRIDFS_BUCKET)
+    return _bucket
+
+
+# ---------------------------------------------------------------------- #
+# Kodierung
+# ---------------------------------------------------------------------- #
+def _encode(judgment_id, kind: str, text: str) -> dict:
+    raw = text.encode("utf-8")
+    compressed = zlib.compress(raw, COMPRESSION_LEVEL)
+    entry = {
+        "chars": len(text),
+        "size": len(raw),
+        "compressed_size": len(compressed),
+        "sha256": hashlib.sha256(raw).hexdigest(),
+        "version": CLEAN_TEXT_VERSION,
+    }
+    if len(compressed) > INLINE_MAX_BYTES:
+        entry["gridfs_id"] = _gridfs().upload_from_stream(
+            f"{judgment_id}.{kind}", compressed, metadata={"judgment_id": judgment_id, "kind": kind})
+    else:
+        entry["data"] = Binary(compressed)
+    return entry
+
+
+def _decode(entry: dict) -> str | None:
+    if "data" in entry:
+        compressed = bytes(entry["data"])
+    else:
+        try:
+            compressed = _gridfs().open_download_stream(entry["gridfs_id"]).read()
+        except NoFile:
+            logging.error(f"GridFS-Datei {entry.get('gridfs_id')} fehlt")
+            return None
+    return zlib.decompress(compressed).decode("utf-8")
+
+
+# ---------------------------------------------------------------------- #
+# Schreiben
+# ---------------------------------------------------------------------- #
+def put_texts(items: list[tuple], kind: str = "clean", unset_inline: bool = False) -> int:
+    """
+    Speichert Texte gebündelt und vermerkt sie im Urteil
+    (``text_store.<kind>``, ``num_characters``).
+
+    Args:
+        items: (judgment_id, text)-Paare.
+        unset_inline: ``full_text`` danach aus dem Urteil entfernen.
+
+    Returns:
+        Anzahl gespeicherter Texte.
+    """
+    if kind not in TEXT_KINDS:
+        raise ValueError(f"Unbekannte Textart: {kind}")
+    if not items:
+        return 0
+    ids = [judgment_id for judgment_id, _ in items]
+    # Ersetzte GridFS-Dateien nach dem Schreiben löschen
+    replaced = [doc[kind]["gridfs_id"]
+                for doc in _texts().find({"_id": {"$in": ids}, f"{kind}.gridfs_id": {"$exists": True}},
+                                         {f"{kind}.gridfs_id": 1})]
+
+    store_ops, judgment_ops = [], []
+    for judgment_id, text in items:
+        store_ops.append(UpdateOne({"_id": judgment_id}, {"$set": {kind: _encode(judgment_id, kind, text)}},
+                                   upsert=True))
+        update = {"$set": {f"text_store.{kind}": CLEAN_TEXT_VERSION, "num_characters": len(text)}}
+        if unset_inline:
+            update["$unset"] = {"full_text": ""}
+        judgment_ops.append(UpdateOne({"_id": judgment_id}, update))
+
+    _texts().bulk_write(store_ops, ordered=False)
+    connect_to_mongo().bulk_write(judgment_ops, ordered=False)
+    for gridfs_id in replaced:
+        try:
+            _gridfs().delete(gridfs_id)
+        except NoFile:
+            pass
+    return len(items)
+
+
+# ---------------------------------------------------------------------- #
+# Lesen
+# ---------------------------------------------------------------------- #
+def get_texts(judgment_ids, kind: str = "clean") -> list[str | None]:
+    """Texte der Urteile in der Reihenfolge von ``judgment_ids`` (None, wenn nicht gespeichert)."""
+    judgment_ids = list(judgment_ids)
+    found = {}
+    for start in range(0, len(judgment_ids), FETCH_BATCH_SIZE):
+        batch = judgment_ids[start:start + FETCH_BATCH_SIZE]
+        for doc in _texts().find({"_id": {"$in": batch}, kind: {"$exists": True}}, {kind: 1}):
+            found[doc["_id"]] = _decode(doc[kind])
+    return [found.get(judgment_id) for judgment_id in judgment_ids]
+
+
+def get_clean_texts(judgment_ids) -> list[str | None]:
+    """Bereinigte Texte mehrerer Urteile mit einem Lesezugriff je ``FETCH_BATCH_SIZE`` IDs."""
+    return get_texts(judgment_ids, "clean")
+
+
+def get_clean_text(judgment_id) -> str | None:
+    return get_texts([judgment_id], "clean")[0]
+
+
+def get_full_text(judgment_id) -> str | None:
+    return get_texts([judgment_id], "full")[0]
+
+
+def full_text_of(doc: dict) -> str | None:
+    """``full_text`` eines Urteils: inline, falls (noch) vorhanden, sonst aus dem Speicher."""
+    if "full_text" in doc:
+        return doc["full_text"]
+    return get_full_text(doc["_id"])
+
+
+# ---------------------------------------------------------------------- #
+# Migration
+# ---------------------------------------------------------------------- #
+def migrate_german(query: dict | None = None, batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """
+    Liest die Textdateien der deutschen Urteile, bereinigt sie gesammelt im
+    Prozess-Pool und speichert sie als ``clean``. Urteile, deren Text in der
+    aktuellen Version schon gespeichert ist, werden übersprungen.
+    """
+    from grab_text import text_file_path
+
+    collection = connect_to_mongo()
+    query = {**(query or {"HTML": {"$exists": True}}),
+             "abbreviation": {"$exists": True}, "text_store.clean": {"$ne": CLEAN_TEXT_VERSION}}
+    stored = 0
+    batch: list[tuple] = []
+
+    def flush():
+        nonlocal stored
+        cleaned = clean_texts([text for _, text in batch])
+        stored += put_texts([(judgment_id, text) for (judgment_id, _), text in zip(batch, cleaned)], "clean")
+        batch.clear()
+        logging.info(f"Textspeicher: {stored} deutsche Texte gespeichert")
+
+    for doc in collection.find(query, {"abbreviation": 1}):
+        path = text_file_path(doc["abbreviation"])
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                batch.append((doc["_id"], f.read()))
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            logging.error(f"Textdatei {path} nicht lesbar: {e}")
+            continue
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return stored
+
+
+def migrate_full_texts(query: dict | None = None, unset_inline: bool = False,
+                       batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """
+    Kopiert ``full_text`` der mehrsprachigen Urteile in den Speicher
+    (Art ``full``); mit ``unset_inline`` wird er aus dem Urteil entfernt.
+    """
+    collection = connect_to_mongo()
+    query = {**(query or {}), "full_text": {"$exists": True}}
+    stored = 0
+    batch: list[tuple] = []
+    for doc in collection.find(query, {"full_text": 1}):
+        batch.append((doc["_id"], doc["full_text"] or ""))
+        if len(batch) >= batch_size:
+            stored += put_texts(batch, "full", unset_inline)
+            batch.clear()
+            logging.info(f"Textspeicher: {stored} full_text verschoben")
+    stored += put_texts(batch, "full", unset_inline)
+    return stored
+
+
+def stats() -> dict:
+    result = {}
+    for kind in TEXT_KINDS:
+        row = next(_texts().aggregate([
+            {"$match": {kind: {"$exists": True}}},
+            {"$group": {"_id": None, "count": {"$sum": 1}, "size": {"$sum": f"${kind}.size"},
+                        "compressed_size": {"$sum": f"${kind}.compressed_size"},
+                        "gridfs": {"$sum": {"$cond": [{"$ifNull": [f"${kind}.gridfs_id", False]}, 1, 0]}}}},
+        ]), None)
+        if row:
+            row.pop("_id")
+        result[kind] = row or {"count": 0}
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    if "--german" in sys.argv:
+        print(f"{migrate_german()} deutsche Texte gespeichert")
+    if "--full-text" in sys.argv:
+        print(f"{migrate_full_texts(unset_inline='--unset-inline' in sys.argv)} full_text gespeichert")
+    print(stats())
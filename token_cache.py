@@ -0,0 +1,309 @@
+"""
+token_cache.py
+
+Persistente Tokenzahlen pro Urteil, gespeichert neben ``num_characters``:
+
+    token_counts.<tokenizer-hash> = {
+        "text_hash": <Hash des gezählten Texts>,
+        "document":  <Tokens des Urteilstexts>,
+        "prompts":   {<prompt-hash>: <Tokens des vollständigen Prompts>},
+    }
+
+Der Tokenizer-Hash macht die Zahlen unabhängig vom Modell, der Text-Hash
+erkennt geänderte Texte, der Prompt-Hash erlaubt mehrere Prompts pro Urteil.
+``refresh_token_counts`` zählt nur neue oder geänderte Dokumente nach, und
+zwar gebündelt mit ``encode_batch`` in einem Prozess-Pool. Statistiken und
+Kostenschätzungen (``token_statistics``) sind danach reine Mongo-Abfragen.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Iterable
+
+from pymongo import UpdateOne
+from tokenizers import Tokenizer
+
+# tokenizer from https://huggingface.co/unsloth/llama-3-8b/blob/main/tokenizer.json
+TOKENIZER_PATH = "tokenizer.json"
+
+# Texte pro encode_batch-Aufruf
+TOKEN_BATCH_SIZE = 64
+# Anzahl Texte, die pro Runde gelesen, gezählt und geschrieben werden (begrenzt den Speicher)
+TOKEN_ROUND_SIZE = 2048
+
+# Platzhalter für den Urteilstext beim Ausmessen eines Promptgerüsts
+# (Zeichen aus der Private Use Area, kommt in Urteilen nicht vor)
+TEXT_MARKER = "\ue000"
+
+
+@lru_cache(maxsize=None)
+def load_tokenizer(path: str = TOKENIZER_PATH) -> Tokenizer | None:
+    """Lädt den Tokenizer einmal pro Prozess. Liefert None, wenn die Datei fehlt."""
+    if not Path(path).exists():
+        logging.warning(f"Tokenizer {path} nicht gefunden, Kontextgröße wird über Zeichen geschätzt")
+        return None
+    return Tokenizer.from_file(path)
+
+
+@lru_cache(maxsize=None)
+def tokenizer_hash(path: str = TOKENIZER_PATH) -> str:
+    """Kurzer Hash der Tokenizer-Datei; Schlüssel für die gespeicherten Tokenzahlen."""
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()[:12]
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def measure_prompt(build_prompt: Callable[[str], str], tokenizer: Tokenizer | None,
+                   fallback_chars_per_token: int = 3) -> tuple[str, int, int]:
+    """
+    Misst ein Promptgerüst aus.
+
+    Returns:
+        (prompt_hash, Tokens ohne Urteilstext, Anzahl der Vorkommen des Urteilstexts)
+    """
+    skeleton = build_prompt(TEXT_MARKER)
+    bare = skeleton.replace(TEXT_MARKER, "")
+    if tokenizer is None:
+        prompt_tokens = len(bare) // fallback_chars_per_token
+    else:
+        prompt_tokens = len(tokenizer.encode(bare, add_special_tokens=False))
+    prompt_hash = hashlib.sha256(skeleton.encode("utf-8")).hexdigest()[:12]
+    return prompt_hash, prompt_tokens, skeleton.count(TEXT_MARKER)
+
+
+def cached_entry(element: dict, tokenizer_id: str) -> dict:
+    """Gespeicherter Eintrag eines Urteils für den Tokenizer (leer, falls keiner)."""
+    return element.get("token_counts", {}).get(tokenizer_id, {})
+
+
+# --------------------------------------------------------------------------- #
+# Batch-Tokenisierung im Prozess-Pool                                         #
+# --------------------------------------------------------------------------- #
+_worker_tokenizer: Tokenizer | None = None
+
+
+def _init_worker(path: str):
+    global _worker_tokenizer
+    # Der Pool parallelisiert bereits, Rust-Threads pro Prozess würden nur konkurrieren
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    _worker_tokenizer = Tokenizer.from_file(path)
+
+
+def _encode_chunk(texts: list[str]) -> list[int]:
+    encodings = _worker_tokenizer.encode_batch(texts, add_special_tokens=False)
+    return [len(encoding.ids) for encoding in encodings]
+
+
+def _chunks(items: list, size: int) -> Iterable[list]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def token_pool(tokenizer_path: str = TOKENIZER_PATH, workers: int | None = None) -> ProcessPoolExecutor:
+    """Prozess-Pool, in dem jeder Worker den Tokenizer einmal lädt."""
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(tokenizer_path,))
+
+
+def encode_texts(texts: list[str], tokenizer_path: str = TOKENIZER_PATH,
+                 pool: ProcessPoolExecutor | None = None,
+                 batch_size: int = TOKEN_BATCH_SIZE) -> list[int]:
+    """
+    Zählt die Tokens vieler Texte. Kleine Mengen werden direkt gezählt,
+    größere in Batches auf einen Prozess-Pool verteilt (``pool`` oder ein
+    eigener für diesen Aufruf).
+    """
+    if not texts:
+        return []
+    if len(texts) <= batch_size:
+        tokenizer = load_tokenizer(tokenizer_path)
+        encodings = tokenizer.encode_batch(texts, add_special_tokens=False)
+        return [len(encoding.ids) for encoding in encodings]
+
+    if pool is None:
+        with token_pool(tokenizer_path) as own_pool:
+            return encode_texts(texts, tokenizer_path, pool=own_pool, batch_size=batch_size)
+
+    counts: list[int] = []
+    for chunk_counts in pool.map(_encode_chunk, _chunks(texts, batch_size)):
+        counts.extend(chunk_counts)
+    return counts
+
+
+# --------------------------------------------------------------------------- #
+# Cache pflegen und abfragen                                                  #
+# --------------------------------------------------------------------------- #
+def entry_update(tokenizer_id: str, num_tokens: int, hashed_text: str | None,
+                 prompt_specs: dict[str, tuple[int, int]]) -> dict:
+    """$set-Dokument für einen Cache-Eintrag (Dokument- und Prompt-Tokenzahlen)."""
+    field = f"token_counts.{tokenizer_id}"
+    update = {f"{field}.document": num_tokens}
+    if hashed_text is not None:
+        update[f"{field}.text_hash"] = hashed_text
+    for prompt_hash, (prompt_tokens, occurrences) in prompt_specs.items():
+        update[f"{field}.prompts.{prompt_hash}"] = prompt_tokens + occurrences * num_tokens
+    return update
+
+
+def refresh_token_counts(collection, query: dict, get_text: Callable[[dict], str],
+                         projection: dict | None = None,
+                         prompts: Iterable[Callable[[str], str]] = (),
+                         tokenizer_path: str = TOKENIZER_PATH,
+                         workers: int | None = None,
+                         round_size: int = TOKEN_ROUND_SIZE,
+                         recheck_texts: bool = False) -> int:
+    """
+    Bringt die Tokenzahlen aller Urteile aus ``query`` auf den aktuellen Stand.
+    Neu gezählt wird nur, wenn noch kein Eintrag existiert oder (mit
+    ``recheck_texts``) sich der Text geändert hat; fehlende Prompt-Zahlen
+    werden aus der Dokumentzahl ergänzt.
+
+    Args:
+        get_text: Liefert den zu zählenden Text eines Urteils.
+        projection: Felder, die ``get_text`` braucht (z. B. {"full_text": 1}). Ohne
+                    ``recheck_texts`` werden sie nur für Urteile ohne Eintrag
+                    gelesen; alle übrigen kosten eine schlanke Projektion.
+        prompts: Prompt-Builder, deren Gesamt-Tokenzahl mitgespeichert wird.
+        recheck_texts: Auch Urteile mit Eintrag lesen und über den Text-Hash
+                       auf Änderungen prüfen (sonst wird ihr Text nicht gelesen).
+
+    Returns:
+        Anzahl der neu tokenisierten Urteile.
+    """
+    tokenizer = load_tokenizer(tokenizer_path)
+    if tokenizer is None:
+        return 0
+    tokenizer_id = tokenizer_hash(tokenizer_path)
+    prompt_specs = {}
+    for build_prompt in prompts:
+        prompt_hash, prompt_tokens, occurrences = measure_prompt(build_prompt, tokenizer)
+        prompt_specs[prompt_hash] = (prompt_tokens, occurrences)
+
+    entry_fields = {"_id": 1, f"token_counts.{tokenizer_id}": 1}
+    text_fields = {**entry_fields, **(projection or {})}
+
+    encoded = 0
+    pending: list[tuple] = []     # (_id, text_hash, text)
+    ops: list[UpdateOne] = []
+
+    def flush():
+        nonlocal encoded
+        counts = encode_texts([text for _, _, text in pending], tokenizer_path, pool=pool)
+        for (doc_id, hashed_text, _), num_tokens in zip(pending, counts):
+            ops.append(UpdateOne({"_id": doc_id},
+                                 {"$set": entry_update(tokenizer_id, num_tokens, hashed_text, prompt_specs)}))
+        encoded += len(pending)
+        pending.clear()
+        if ops:
+            collection.bulk_write(ops, ordered=False)
+            ops.clear()
+
+    def process(doc):
+        entry = cached_entry(doc, tokenizer_id)
+        current = "document" in entry and not recheck_texts
+        if not current:
+            try:
+                text = get_text(doc)
+            except Exception as e:
+                logging.error(f"Text für {doc['_id']} nicht lesbar: {e}")
+                return
+            hashed_text = text_hash(text)
+            current = "document" in entry and entry.get("text_hash") == hashed_text
+
+        if current:
+            # Text unverändert: höchstens neue Prompts nachtragen
+            missing = {ph: spec for ph, spec in prompt_specs.items() if ph not in entry.get("prompts", {})}
+            if missing:
+                ops.append(UpdateOne({"_id": doc["_id"]},
+                                     {"$set": entry_update(tokenizer_id, entry["document"], None, missing)}))
+        else:
+            pending.append((doc["_id"], hashed_text, text))
+
+        if len(pending) >= round_size or len(ops) >= round_size:
+            flush()
+            logging.info(f"Tokenzahlen aktualisiert: {encoded}")
+
+    with token_pool(tokenizer_path, workers) as pool:
+        if recheck_texts:
+            for doc in collection.find(query, text_fields):
+                process(doc)
+        else:
+            # Texte nur für Urteile ohne Eintrag nachladen, gebündelt per _id
+            uncached: list = []
+
+            def process_uncached():
+                for text_doc in collection.find({"_id": {"$in": uncached}}, text_fields):
+                    process(text_doc)
+                uncached.clear()
+
+            for doc in collection.find(query, entry_fields):
+                if "document" in cached_entry(doc, tokenizer_id):
+                    process(doc)
+                    continue
+                uncached.append(doc["_id"])
+                if len(uncached) >= round_size:
+                    process_uncached()
+            if uncached:
+                process_uncached()
+        flush()
+    return encoded
+
+
+def token_statistics(collection, query: dict, tokenizer_path: str = TOKENIZER_PATH,
+                     prompt_hash: str | None = None) -> dict:
+    """
+    Statistik der gespeicherten Tokenzahlen (Dokument oder vollständiger Prompt)
+    für alle Urteile aus ``query``.
+    """
+    field = f"token_counts.{tokenizer_hash(tokenizer_path)}"
+    field += f".prompts.{prompt_hash}" if prompt_hash else ".document"
+    result = list(collection.aggregate([
+        {"$match": {**query, field: {"$exists": True}}},
+        {"$group": {
+            "_id": None,
+            "count": {"$sum": 1},
+            "total": {"$sum": f"${field}"},
+            "mean": {"$avg": f"${field}"},
+            "min": {"$min": f"${field}"},
+            "max": {"$max": f"${field}"},
+        }},
+    ]))
+    if not result:
+        return {"count": 0, "total": 0, "mean": None, "min": None, "max": None}
+    stats = result[0]
+    stats.pop("_id")
+    return stats
+
+
+if __name__ == "__main__":
+    from prepare_data import connect_to_mongo, build_summary_prompt
+    from grab_text import get_clean_text_by_id
+    import text_store
+    from check_bias import build_bias_prompt
+    from check_bias_multilingual import build_prompt_en, build_prompt_vn, build_prompt_jp
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    collection = connect_to_mongo()
+
+    # Deutsche Urteile: Texte liegen als Dateien vor
+    german_query = {"selected_for_smaller_experiment": True}
+    count = refresh_token_counts(collection, german_query,
+                                 get_text=lambda doc: get_clean_text_by_id(doc["_id"]),
+                                 prompts=[build_bias_prompt, build_summary_prompt])
+    print(f"Deutsch: {count} Urteile neu gezählt, {token_statistics(collection, german_query)}")
+
+    # Mehrsprachige Urteile: full_text steht im Dokument oder im text_store
+    for language, build_prompt in [("English", build_prompt_en), ("Vietnamese", build_prompt_vn),
+                                   ("Japanese", build_prompt_jp)]:
+        query = {"language": language}
+        count = refresh_token_counts(collection, query, get_text=text_store.full_text_of,
+                                     projection={"full_text": 1}, prompts=[build_prompt],
+                                     recheck_texts=True)
+        print(f"{language}: {count} Urteile neu gezählt, {token_statistics(collection, query)}")
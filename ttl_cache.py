@@ -0,0 +1,85 @@
+"""
+ttl_cache.py
+
+Kleiner thread-sicherer In-Process-Cache mit Ablaufzeit für die
+Annotationsseite (Bias-Listen, einzelne Biases). Schreibzugriffe rufen
+``invalidate`` auf, damit niemand veraltete Annotationen sieht.
+"""
+
+from __future__ import annotations
+
+import functools
+import threading
+import time
+from typing import Any, Callable, Hashable
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, ttl: float, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: dict[Hashable, tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._evict()
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, predicate: Callable[[Hashable], bool] | None = None):
+        """Verwirft alle Einträge (oder nur die, deren Schlüssel ``predicate`` erfüllt)."""
+        with self._lock:
+            if predicate is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if predicate(k)]:
+                    del self._entries[key]
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self._entries.items() if expires < now]:
+            del self._entries[key]
+        if len(self._entries) >= self.max_entries:
+            # ältesten Eintrag verwerfen (dict behält die Einfügereihenfolge)
+            del self._entries[next(iter(self._entries))]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def cached(cache: TTLCache, name: str):
+    """Decorator: cached das Ergebnis pro (name, Argumente); Listen werden zu Tupeln."""
+    def freeze(value):
+        return tuple(value) if isinstance(value, list) else value
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (name, tuple(freeze(a) for a in args), tuple(sorted((k, freeze(v)) for k, v in kwargs.items())))
+            return cache.get_or_compute(key, lambda: func(*args, **kwargs))
+        wrapper.uncached = func
+        return wrapper
+    return decorator
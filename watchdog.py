@@ -4,9 +4,12 @@ import time
 from datetime import datetime
 import sys
 import os
+import urllib.error
+import urllib.request
 
-# Befehl, der alle Prozesse des Benutzers 'herzberg' sucht, deren Kommandozeile 'annotation_handler.py' enthält.
-CHECK_CMD = "pgrep -u herzberg -f annotation_handler.py"
+# Health-Endpunkt des annotation_handler (ersetzt die pgrep-Heuristik)
+HEALTH_URL = "http://127.0.0.1:5000/health"
+HEALTH_TIMEOUT = 10  # Sekunden
 
 # Befehl zum Starten des annotation_handler.py über nohup.
 START_CMD = ("nohup /home/herzberg/project/venv/bin/python3.12 "
@@ -19,20 +22,25 @@ def log(message: str):
     print(f"[{timestamp}] {message}")
     sys.stdout.flush()
 
-def is_annotation_handler_running() -> bool:
+def check_health() -> str:
     """
-    Prüft, ob annotation_handler.py läuft, indem versucht wird, eine gültige PID zu extrahieren.
-    Wenn keine gültige PID vorhanden ist, wird False zurückgegeben.
+    Fragt den Health-Endpunkt ab.
+    Gibt "ok" zurück, "unhealthy", wenn der Server nicht gesund ist (z. B. MongoDB
+    nicht erreichbar) oder hängt (Timeout), und "down" nur, wenn die Verbindung
+    abgewiesen wird, also kein Prozess auf dem Port lauscht.
     """
-    result = subprocess.run(CHECK_CMD, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    stdout_str = result.stdout.strip()
-    # Zerlege die Ausgabe in Zeilen/Einzelelemente (über whitespace getrennt)
-    pid_lines = stdout_str.split()
-    # Filtere alle Einträge, die ausschließlich Ziffern enthalten und entferne die eigene PID.
-    valid_pids = [pid for pid in pid_lines if pid.isdigit()]
-    
-    # mindestens 2 Prozesse von FLask, eher 3
-    return len(valid_pids) > 1
+    try:
+        with urllib.request.urlopen(HEALTH_URL, timeout=HEALTH_TIMEOUT) as response:
+            return "ok" if response.status == 200 else "unhealthy"
+    except urllib.error.HTTPError:
+        return "unhealthy"
+    except urllib.error.URLError as e:
+        return "down" if isinstance(e.reason, ConnectionRefusedError) else "unhealthy"
+    except ConnectionRefusedError:
+        return "down"
+    except OSError:
+        # u. a. socket.timeout beim Lesen: der Prozess läuft noch und hält den Port
+        return "unhealthy"
 
 def start_annotation_handler():
     """Startet annotation_handler.py im Hintergrund."""
@@ -41,8 +49,12 @@ def start_annotation_handler():
 
 if __name__ == "__main__":
     while True:
-        if not is_annotation_handler_running():
+        status = check_health()
+        if status == "down":
             log("annotation_handler.py läuft nicht. Starte neu …")
             start_annotation_handler()
+        elif status == "unhealthy":
+            # Server läuft oder hängt, ein Neustart hilft nicht (Port belegt) – nur melden
+            log("annotation_handler.py läuft, ist aber nicht gesund (MongoDB? hängt?).")
         
         time.sleep(60)  # Überprüft alle 60 Sekunden